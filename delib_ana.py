@@ -16,9 +16,13 @@ Contact: eleonore.fournier-tombs@mail.mcgill.ca
 """
 
 import argparse
+import sys
+import delib_ana_cache as cache
+import delib_ana_daemon as daemon
 import delib_ana_process as process
 import delib_ana_utils as utils
 from delib_ana_config import DelibAnaConfiguration
+from delib_ana_config import get_action
 from delib_ana_config import test_config_file
 
 
@@ -36,37 +40,71 @@ def main():
     parser.add_argument('-c', '--config_file', default='delib_ana.ini', help='''
                         Name of configuration file to be used. Default:
                         delib.ana.ini.''')
+    parser.add_argument('--no-cache', action='store_true', help='''
+                        Bypass the preprocessing and utterance caches and
+                        the feature store.''')
+    parser.add_argument('--clear-cache', action='store_true', help='''
+                        Delete all the preprocessing and utterance cache
+                        entries before running.''')
     args = parser.parse_args()
     config_file = args.config_file
+    results = sys.stdout
+    if get_action(config_file) == 'stream_predict':
+        # Standard output only carries the results, messages go to stderr
+        sys.stdout = sys.stderr
 
     # Get config info
     config_good = test_config_file(config_file)
     if config_good:
         delib_config = DelibAnaConfiguration(config_file)
-        run_process(delib_config)
+        cache.configure(delib_config.cache_dir, delib_config.cache_size,
+                        not args.no_cache, delib_config.utterance_cache_size,
+                        delib_config.feature_store,
+                        delib_config.feature_store_dir)
+        if args.clear_cache:
+            cache.clear_cache()
+        if delib_config.memory_report:
+            utils.add_frame_hook(utils.memory_report)
+        run_process(delib_config, results)
+        cache.report_utterance_cache()
     else:
         print('Improperly formatted config file\nDelibAnalysis Exiting.')
 
 
-def run_process(config_obj):
+def run_process(config_obj, out_stream=sys.stdout):
     """Run Delib Analysis process based on configuration file options.
 
     Arguments:
         config_obj {DelibAnaConfiguration} -- DelibAnalys configuration object.
+
+    Keyword Arguments:
+        out_stream {file} -- stream the "stream_predict" results are written
+            to. (default: {sys.stdout})
     """
 
     ana_process = config_obj.action
     active_indicator = config_obj.indicator
     active_tag = config_obj.tag
+    dense = config_obj.dense_features
+    workers = config_obj.workers
+    lean = config_obj.lean_store
+    compress = config_obj.compress
+    compact = config_obj.compact_frames
+    out_columns = config_obj.output_columns
+    out_format = config_obj.output_format
+    out_compression = config_obj.output_compression
+    level = config_obj.compression_level
 
     if ana_process in ['predict', 'generate_predict']:
         loc_unlabelled = config_obj.unlabelled
-    if ana_process in ['predict', 'generate', 'batch_predict']:
+    if ana_process in ['predict', 'generate', 'generate_all',
+                       'batch_predict', 'stream_predict']:
         file_name = config_obj.store_name
         file_type = config_obj.store_type
     if ana_process == 'batch_predict':
         loc_dir_unlabelled = config_obj.unlabelled_dir
-    if ana_process in ['generate', 'generate_predict', 'test']:
+    if ana_process in ['generate', 'generate_all', 'generate_predict',
+                       'test']:
         loc_labelled_train = config_obj.labelled
         indicator_vocab = config_obj.vocab
         train_split = config_obj.train_split
@@ -85,49 +123,142 @@ def run_process(config_obj):
     param_list = []
     param_dict = {}
 
-    if ana_process == 'predict':
+    if ana_process == 'predict' and config_obj.models:
+        param_list = utils.add_to_list(loc_unlabelled, config_obj.models,
+                                       file_type)
+        param_dict = utils.add_to_dict(
+            dense=dense, workers=workers,
+            extra_features=config_obj.extra_features,
+            output_columns=out_columns, compact=compact,
+            row_index=config_obj.row_index)
+        new_label_dataset = process.predict_all_process(*param_list,
+                                                        **param_dict)
+        f_name = loc_unlabelled.split('/')[-1:][0]
+        outfile_name = utils.output_name(
+            active_tag + '-' + process.MULTI_NAME + f_name, out_format,
+            out_compression)
+        utils.write_dataset(new_label_dataset, outfile_name,
+                            compression=out_compression, level=level)
+        print("Predict process result saved to file:", outfile_name)
+        print(new_label_dataset.head(10))
+    elif ana_process == 'predict' and config_obj.chunk_size:
+        f_name = loc_unlabelled.split('/')[-1:][0]
+        outfile_name = active_tag + '-' + active_indicator
+        outfile_name = utils.output_name(outfile_name + f_name, out_format,
+                                         out_compression)
+        param_list = utils.add_to_list(loc_unlabelled, active_indicator,
+                                       file_type, file_name, outfile_name)
+        param_dict = utils.add_to_dict(
+            chunk_size=config_obj.chunk_size, dense=dense, workers=workers,
+            extra_features=config_obj.extra_features,
+            output_columns=out_columns, output_compression=out_compression,
+            compression_level=level, compact=compact)
+        process.stream_predict_process(*param_list, **param_dict)
+        print("Predict process result saved to file:", outfile_name)
+    elif ana_process == 'predict':
         param_list = utils.add_to_list(loc_unlabelled, active_indicator,
                                        file_type, file_name)
-        new_label_dataset = process.predict_process(*param_list)
+        param_dict = utils.add_to_dict(
+            dense=dense, workers=workers,
+            extra_features=config_obj.extra_features,
+            output_columns=out_columns, compact=compact,
+            row_index=config_obj.row_index)
+        new_label_dataset = process.predict_process(*param_list, **param_dict)
         f_name = loc_unlabelled.split('/')[-1:][0]
         outfile_name = active_tag + '-' + active_indicator
-        outfile_name += f_name
-        new_label_dataset.to_csv(outfile_name)
+        outfile_name = utils.output_name(outfile_name + f_name, out_format,
+                                         out_compression)
+        utils.write_dataset(new_label_dataset, outfile_name,
+                            compression=out_compression, level=level)
         print("Predict process result saved to file:", outfile_name)
         print(new_label_dataset.head(10))
     elif ana_process == 'generate':
         param_list = utils.add_to_list(loc_labelled_train, active_indicator,
                                        indicator_vocab)
         param_dict = utils.add_to_dict(tag=active_tag, store_name=file_name,
-                                       store_type=file_type)
+                                       store_type=file_type, dense=dense,
+                                       workers=workers, lean=lean,
+                                       compress=compress, compact=compact)
         process.generate_process(*param_list, **param_dict)
+    elif ana_process == 'generate_all':
+        param_list = utils.add_to_list(loc_labelled_train,
+                                       config_obj.indicators, indicator_vocab)
+        param_dict = utils.add_to_dict(tag=active_tag, store_name=file_name,
+                                       store_type=file_type,
+                                       train_split=train_split, r_state=r_seed,
+                                       train_jobs=config_obj.train_jobs,
+                                       dense=dense, workers=workers,
+                                       lean=lean, compress=compress,
+                                       compact=compact)
+        process.generate_all_process(*param_list, **param_dict)
     elif ana_process == 'generate_predict':
         param_list = utils.add_to_list(loc_labelled_train, loc_unlabelled,
                                        active_indicator, indicator_vocab,
                                        active_tag)
         param_dict = utils.add_to_dict(store=stored, store_name=file_name,
                                        store_type=file_type,
-                                       train_split=train_split, r_state=r_seed)
+                                       train_split=train_split, r_state=r_seed,
+                                       dense=dense, workers=workers,
+                                       lean=lean, compress=compress,
+                                       extra_features=(
+                                           config_obj.extra_features),
+                                       output_columns=out_columns,
+                                       compact=compact,
+                                       row_index=config_obj.row_index)
         new_label_dataset = process.gen_predict_process(*param_list,
                                                         **param_dict)
         f_name = loc_unlabelled.split('/')[-1:][0]
         outfile_name = active_tag + '-' + active_indicator
-        outfile_name += f_name
-        new_label_dataset.to_csv(outfile_name)
+        outfile_name = utils.output_name(outfile_name + f_name, out_format,
+                                         out_compression)
+        utils.write_dataset(new_label_dataset, outfile_name,
+                            compression=out_compression, level=level)
         print("Generate-Predict process result saved to file:", outfile_name)
         print(new_label_dataset.head(10))
     elif ana_process == 'batch_predict':
         param_list = utils.add_to_list(loc_dir_unlabelled, active_indicator,
                                        file_name, file_type)
-        param_dict = utils.add_to_dict(tag=active_tag)
+        param_dict = utils.add_to_dict(
+            tag=active_tag, combined_output=config_obj.combined_output,
+            dense=dense, workers=workers,
+            extra_features=config_obj.extra_features,
+            models=config_obj.models or None, output_columns=out_columns,
+            output_format=out_format, output_compression=out_compression,
+            compression_level=level, compact=compact,
+            staged=config_obj.batch_pipeline,
+            queue_size=config_obj.pipeline_queue)
         process.dir_predict_process(*param_list, **param_dict)
     elif ana_process == 'test':
         param_list = utils.add_to_list(loc_labelled_train, active_indicator,
                                        indicator_vocab, active_tag)
         param_dict = utils.add_to_dict(store=stored, store_name=file_name,
                                        store_type=file_type,
-                                       train_split=train_split, r_state=r_seed)
+                                       train_split=train_split, r_state=r_seed,
+                                       dense=dense, workers=workers,
+                                       lean=lean, compress=compress,
+                                       compact=compact)
         process.testing_process(*param_list, **param_dict)
+    elif ana_process == 'stream_predict':
+        param_list = utils.add_to_list(active_indicator, file_type, file_name,
+                                       sys.stdin, out_stream)
+        param_dict = utils.add_to_dict(batch_size=config_obj.stream_batch,
+                                       batch_wait=config_obj.stream_wait,
+                                       dense=dense, workers=workers,
+                                       extra_features=(
+                                           config_obj.extra_features))
+        n_lines = process.jsonl_predict_process(*param_list, **param_dict)
+        print("Stream predict process labelled %d lines." % n_lines)
+    elif ana_process == 'serve':
+        param_list = utils.add_to_list(config_obj.daemon_models,
+                                       config_obj.store_type)
+        param_dict = utils.add_to_dict(host=config_obj.host,
+                                       port=config_obj.port,
+                                       socket_path=config_obj.socket_path,
+                                       max_batch=config_obj.max_batch,
+                                       batch_wait=config_obj.batch_wait,
+                                       dense=dense,
+                                       data_dir=config_obj.data_dir)
+        daemon.serve(*param_list, **param_dict)
 
 
 if __name__ == '__main__':
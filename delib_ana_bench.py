@@ -0,0 +1,440 @@
+#!/usr/local/bin/python3
+"""DelibAnalysis Benchmarks
+
+Command line benchmarks used to compare the resource usage of the different
+DelibAnalysis code paths on the same corpus. Each measured run is executed in
+a freshly spawned process so the peak resident set size (RSS) of one run can
+not leak into the next one.
+
+Usage:
+    python3 delib_ana_bench.py memory -l [labelled_dataset.csv] -i [indicator]
+    python3 delib_ana_bench.py store -l [labelled_dataset.csv] -i [indicator]
+    python3 delib_ana_bench.py features -l [labelled_dataset.csv] -n [rows]
+    python3 delib_ana_bench.py phrases -l [labelled_dataset.csv] -n [rows]
+
+Package: DelibAnalysis
+Version: 2.0
+Authors: Eleonore Fournier-Tombs and Curtis Hendricks
+Source: https://github.com/eleonoreft/DelibAnalysis
+Copyright: Attribution-NonCommercial-ShareAlike CC BY-NC-SA
+https://creativecommons.org/licenses/by-nc-sa/4.0/
+Contact: eleonore.fournier-tombs@mail.mcgill.ca
+
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the current process.
+
+    Returns:
+        float -- peak RSS in megabytes.
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def memory_mb():
+    """Returns the current resident and private memory of the process.
+
+    Private memory excludes the pages shared with other processes, such as
+    memory mapped files in the page cache. It is only available on Linux.
+
+    Returns:
+        [tuple] -- RSS and private memory in megabytes (None if unknown).
+    """
+
+    rss = private = None
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return peak_rss_mb(), None
+    rss = int(fields['Rss'].split()[0]) / 1024
+    private = (int(fields['Private_Clean'].split()[0]) +
+               int(fields['Private_Dirty'].split()[0])) / 1024
+    return rss, private
+
+
+def run_isolated(func, *args):
+    """Run a benchmark function in a freshly spawned process.
+
+    Arguments:
+        func {function} -- module level function to be run.
+
+    Returns:
+        [any] -- the value returned by func.
+    """
+
+    ctx = multiprocessing.get_context('spawn')
+    result_queue = ctx.Queue()
+    # A plain (non daemonic) process lets the forest use its own job pool
+    proc = ctx.Process(target=queue_result, args=(result_queue, func, args))
+    proc.start()
+    result = result_queue.get()
+    proc.join()
+    return result
+
+
+def queue_result(result_queue, func, args):
+    """Helper for run_isolated, sends the result of func back to the parent.
+
+    Arguments:
+        result_queue {Queue} -- queue shared with the parent process.
+        func {function} -- module level function to be run.
+        args {tuple} -- positional arguments for func.
+    """
+
+    result_queue.put(func(*args))
+
+
+def feature_memory_run(labelled, indic, dense):
+    """Build features, train and predict using one of the feature layouts.
+
+    Arguments:
+        labelled {str} -- filename of the labelled dataset.
+        indic {str} -- name of the indicator to train on.
+        dense {bool} -- use the dense feature layout.
+
+    Returns:
+        dict -- measurements of the run.
+    """
+
+    import delib_ana_forest as forest
+    import delib_ana_utils as utils
+
+    data = utils.import_label_data(labelled)
+    vecs = forest.make_vectorizers(data, [])
+    base_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    feats = forest.get_feats(data, vecs['vec_combo'], dense)
+    feat_rss = peak_rss_mb()
+    classifier = forest.f_class_train(feats, data, indic)
+    forest.f_class_predict_compare(data, vecs['vec_combo'], classifier, indic,
+                                   dense)
+    elapsed = time.perf_counter() - start
+
+    return {'layout': 'dense' if dense else 'sparse', 'rows': len(data),
+            'base_rss': base_rss, 'feat_rss': feat_rss,
+            'peak_rss': peak_rss_mb(), 'seconds': elapsed}
+
+
+def bench_memory(labelled, indic):
+    """Compare peak RSS of the sparse and dense feature layouts.
+
+    Arguments:
+        labelled {str} -- filename of the labelled dataset.
+        indic {str} -- name of the indicator to train on.
+    """
+
+    print('%-8s %8s %12s %12s %12s %10s' % ('layout', 'rows', 'base MB',
+                                            'features MB', 'peak MB',
+                                            'seconds'))
+    for dense in [False, True]:
+        res = run_isolated(feature_memory_run, labelled, indic, dense)
+        print('%-8s %8d %12.1f %12.1f %12.1f %10.2f' % (
+            res['layout'], res['rows'], res['base_rss'], res['feat_rss'],
+            res['peak_rss'], res['seconds']))
+
+
+def store_load_run(store_type, file_name, labelled):
+    """Load a stored model and use it once.
+
+    Arguments:
+        store_type {str} -- method used to store the model.
+        file_name {str} -- name of the file that stores the model.
+        labelled {str} -- filename of the dataset to predict.
+
+    Returns:
+        dict -- measurements of the run.
+    """
+
+    import delib_ana_forest as forest
+    import delib_ana_process as process
+    import delib_ana_utils as utils
+
+    data = utils.import_label_data(labelled)
+    base_rss, base_private = memory_mb()
+
+    start = time.perf_counter()
+    model, vecs = process.load_model(store_type, file_name, None, False)
+    load_time = time.perf_counter() - start
+    rss, private = memory_mb()
+
+    start = time.perf_counter()
+    output = forest.f_class_predict(data, 'predicted', vecs['vec_combo'],
+                                    model)
+    predict_time = time.perf_counter() - start
+    used_rss, used_private = memory_mb()
+
+    res = {'store_type': store_type, 'load': load_time,
+           'predict': predict_time,
+           'predicted': output['predicted'].tolist(),
+           'load_rss': rss - base_rss, 'used_rss': used_rss - base_rss,
+           'load_private': None, 'used_private': None}
+    if private is not None:
+        res['load_private'] = private - base_private
+        res['used_private'] = used_private - base_private
+    return res
+
+
+def bench_store(labelled, indic):
+    """Compare size, load and predict time and memory of the model stores.
+
+    A model is trained on the labelled dataset and stored with each store
+    type, as is and as a lean export, and compressed for joblib. Each file is
+    then loaded and used to predict the same dataset in a fresh process. The
+    predict time includes the features of the dataset, and anything a store
+    defers to the first prediction. The last column tells if the predictions
+    equal those of the trained model.
+
+    Arguments:
+        labelled {str} -- filename of the labelled dataset.
+        indic {str} -- name of the indicator to train on.
+    """
+
+    import delib_ana_forest as forest
+    import delib_ana_process as process
+    import delib_ana_utils as utils
+
+    data = utils.import_label_data(labelled)
+    vecs = forest.make_vectorizers(data, [])
+    feats = forest.get_feats(data, vecs['vec_combo'])
+    classifier = forest.f_class_train(feats, data, indic)
+    expected = forest.f_class_predict(
+        data, 'predicted', vecs['vec_combo'], classifier)['predicted'].tolist()
+    variants = [('pickle', False, 0), ('joblib', False, 0),
+                ('joblib', False, 3), ('mmap', False, 0), ('pickle', True, 0),
+                ('joblib', True, 0), ('joblib', True, 3), ('mmap', True, 0)]
+
+    def fmt(val):
+        return '%12s' % 'n/a' if val is None else '%12.1f' % val
+
+    print('%-14s %10s %10s %10s %12s %12s %12s %12s %12s %6s' % (
+        'store', 'load s', 'predict s', 'total s', 'size MB', 'load RSS',
+        'load priv.', 'used RSS', 'used priv.', 'same'))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            for store_type, lean, compress in variants:
+                name = '%s%s%s' % (store_type, '-lean' if lean else '',
+                                   '-z%d' % compress if compress else '')
+                process.store_model(store_type, name, classifier, vecs,
+                                    indic, '', False, lean, compress)
+                file_name = [f for f in os.listdir(tmp_dir)
+                             if f.startswith(name + '-' + indic)][0]
+                size = os.path.getsize(file_name) / (1024 * 1024)
+                res = run_isolated(store_load_run, store_type,
+                                   os.path.join(tmp_dir, file_name),
+                                   os.path.join(cwd, labelled))
+                print('%-14s %10.4f %10.4f %10.4f %12.1f%s%s%s%s %6s' % (
+                    name, res['load'], res['predict'],
+                    res['load'] + res['predict'], size, fmt(res['load_rss']),
+                    fmt(res['load_private']), fmt(res['used_rss']),
+                    fmt(res['used_private']),
+                    'yes' if res['predicted'] == expected else 'NO'))
+        finally:
+            os.chdir(cwd)
+
+
+def best_time(func, repeat):
+    """Returns the best run time of a function and its last result.
+
+    Arguments:
+        func {function} -- function without arguments.
+        repeat {int} -- number of runs.
+
+    Returns:
+        [tuple] -- run time in seconds and value returned by func.
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def bench_features(labelled, rows=100000, repeat=3):
+    """Compare the row by row and vectorized quantitative feature columns.
+
+    The speeches of the labelled dataset are repeated up to the requested
+    number of rows. Each column is computed with the original per row
+    functions and with the vectorized column functions, and the outputs are
+    checked to be identical.
+
+    Arguments:
+        labelled {str} -- filename of the labelled dataset.
+
+    Keyword Arguments:
+        rows {int} -- number of rows to benchmark. (default: {100000})
+        repeat {int} -- number of runs, the best one is kept. (default: {3})
+    """
+
+    import numpy as np
+    import pandas as pd
+    import delib_ana_utils as utils
+
+    data = pd.read_csv(labelled)
+    data = data.iloc[np.arange(rows) % len(data)].reset_index(drop=True)
+    speech = data['speech'].astype(str)
+    cleaned = utils.clean_column(speech)
+    counts = cleaned.str.len()
+    flags = utils.question_column(speech)
+
+    def buckets_by_row():
+        return np.column_stack([
+            counts.map(lambda x: 1 if (x <= v[0] and x > v[1]) else 0)
+            for v in utils.char_dict.values()])
+
+    def buckets_by_column():
+        frame = pd.DataFrame({'cleaned_comment': cleaned})
+        utils.add_character_counts(frame, utils.char_dict)
+        return frame[list(utils.char_dict)].to_numpy()
+
+    def parent_by_row():
+        new_column = [0]
+        for i in range(0, len(flags) - 1):
+            new_column.append(utils.change_to_binary(flags.iloc[i]))
+        return new_column
+
+    cases = [
+        ('cleaned_comment', lambda: speech.apply(utils.comment_to_words),
+         lambda: utils.clean_column(speech)),
+        ('char_buckets', buckets_by_row, buckets_by_column),
+        ('has_question', lambda: speech.apply(utils.get_question),
+         lambda: utils.question_column(speech)),
+        ('has_respect', lambda: speech.apply(utils.get_respect),
+         lambda: utils.respect_column(speech)),
+        ('gender', lambda: data['speaker'].apply(utils.get_gender),
+         lambda: utils.gender_column(data['speaker'])),
+        ('binary', lambda: flags.apply(utils.change_to_binary),
+         lambda: utils.binary_column(flags)),
+        ('question_parent', parent_by_row,
+         lambda: utils.add_column_parent(flags)),
+    ]
+
+    print('%-16s %8s %12s %12s %9s %6s' % ('column', 'rows', 'by row s',
+                                           'vector s', 'speedup', 'same'))
+    for name, by_row, by_column in cases:
+        row_time, expected = best_time(by_row, repeat)
+        col_time, result = best_time(by_column, repeat)
+        same = np.array_equal(np.asarray(expected), np.asarray(result))
+        print('%-16s %8d %12.4f %12.4f %8.1fx %6s' % (
+            name, rows, row_time, col_time, row_time / max(col_time, 1e-9),
+            'yes' if same else 'NO'))
+
+
+def bench_phrases(labelled, rows=20000, sizes=(20, 100, 500), repeat=3):
+    """Compare phrase searches by "in" and by PhraseMatcher as lists grow.
+
+    Phrase lists of increasing sizes are made of word pairs taken from the
+    labelled dataset, and the texts containing one of them are flagged with
+    one "in" search per phrase and with a PhraseMatcher.
+
+    Arguments:
+        labelled {str} -- filename of the labelled dataset.
+
+    Keyword Arguments:
+        rows {int} -- number of rows to benchmark. (default: {20000})
+        sizes {tuple} -- numbers of phrases. (default: {(20, 100, 500)})
+        repeat {int} -- number of runs, the best one is kept. (default: {3})
+    """
+
+    import random
+    import numpy as np
+    import pandas as pd
+    import delib_ana_utils as utils
+
+    data = pd.read_csv(labelled)
+    speech = data['speech'].astype(str)
+    speech = speech.iloc[np.arange(rows) % len(speech)].reset_index(drop=True)
+    words = sorted(set(' '.join(utils.clean_column(speech[:1000])).split()))
+    rand = random.Random(1)
+
+    def flag_by_in(phrases):
+        return [int(any(p in t for p in phrases))
+                for t in speech.str.lower().tolist()]
+
+    print('%8s %8s %12s %12s %9s %6s' % ('phrases', 'rows', 'in s',
+                                         'matcher s', 'speedup', 'same'))
+    for size in sizes:
+        phrases = [' '.join(rand.sample(words, 2)) for _ in range(size)]
+        in_time, expected = best_time(lambda: flag_by_in(phrases), repeat)
+        matcher = utils.PhraseMatcher(phrases)
+        match_time, result = best_time(lambda: matcher.flag_column(speech),
+                                       repeat)
+        print('%8d %8d %12.4f %12.4f %8.1fx %6s' % (
+            size, rows, in_time, match_time,
+            in_time / max(match_time, 1e-9),
+            'yes' if np.array_equal(expected, result) else 'NO'))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="DelibAnalysis benchmarks")
+    subparsers = parser.add_subparsers(dest='bench')
+    subparsers.required = True
+
+    mem_parser = subparsers.add_parser('memory', help='''
+                                       Peak RSS of the sparse and dense
+                                       feature layouts.''')
+    mem_parser.add_argument('-l', '--labelled', required=True,
+                            help='Labelled dataset file.')
+    mem_parser.add_argument('-i', '--indicator', default='respect',
+                            help='Indicator to train on. Default: respect.')
+
+    store_parser = subparsers.add_parser('store', help='''
+                                         Size, load and predict time and memory
+                                         (MB) of the model store types.''')
+    store_parser.add_argument('-l', '--labelled', required=True,
+                              help='Labelled dataset file.')
+    store_parser.add_argument('-i', '--indicator', default='respect',
+                              help='Indicator to train on. Default: respect.')
+
+    feat_parser = subparsers.add_parser('features', help='''
+                                        Run time of the row by row and
+                                        vectorized feature columns.''')
+    feat_parser.add_argument('-l', '--labelled', required=True,
+                             help='Labelled dataset file.')
+    feat_parser.add_argument('-n', '--rows', type=int, default=100000,
+                             help='Number of rows. Default: 100000.')
+
+    phrase_parser = subparsers.add_parser('phrases', help='''
+                                          Run time of phrase searches as the
+                                          phrase lists grow.''')
+    phrase_parser.add_argument('-l', '--labelled', required=True,
+                               help='Labelled dataset file.')
+    phrase_parser.add_argument('-n', '--rows', type=int, default=20000,
+                               help='Number of rows. Default: 20000.')
+
+    args = parser.parse_args()
+    if args.bench == 'memory':
+        bench_memory(args.labelled, args.indicator)
+    if args.bench == 'store':
+        bench_store(args.labelled, args.indicator)
+    if args.bench == 'features':
+        bench_features(args.labelled, args.rows)
+    if args.bench == 'phrases':
+        bench_phrases(args.labelled, args.rows)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,604 @@
+#!/usr/local/bin/python3
+"""DelibAnalysis Preprocessing Cache
+
+Content addressed on-disk cache for the preprocessed (enriched) datasets.
+Importing a dataset cleans the text, counts characters, detects questions and
+respect and POS tags every speech, which is only worth doing once for a given
+file. The enriched DataFrame is stored in Parquet format (pickle if pyarrow
+is not installed) under a key made of the input file content hash, the import
+function and the preprocessing pipeline version. The cache is bounded in size
+and the least recently used entries are evicted first.
+
+A second, finer grained cache stores the cleaned text and POS tags of each
+individual utterance in an SQLite database, keyed by a hash of the normalized
+speech text. Procedural lines and speeches repeated across files are then only
+tagged once, whatever the dataset they appear in.
+
+The optional feature store keeps the text features computed by the
+vectorizers of a model for a dataset file, as uncompressed .npz files next to
+the input. Entries are keyed by the input file hash and a fingerprint of the
+fitted vocabularies and IDF weights, so retrained models sharing the same
+vectorizers reuse them.
+
+Package: DelibAnalysis
+Version: 2.0
+Authors: Eleonore Fournier-Tombs and Curtis Hendricks
+Source: https://github.com/eleonoreft/DelibAnalysis
+Copyright: Attribution-NonCommercial-ShareAlike CC BY-NC-SA
+https://creativecommons.org/licenses/by-nc-sa/4.0/
+Contact: eleonore.fournier-tombs@mail.mcgill.ca
+
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+from scipy import sparse
+
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = 'parquet'
+except ImportError:
+    CACHE_FORMAT = 'pickle'
+
+# Version of the preprocessing pipeline. Must be increased whenever the import
+# functions change the content of the DataFrames they return, so stale entries
+# are never reused.
+PREPROCESS_VERSION = 1
+
+# File extensions of the dataset cache entries
+ENTRY_EXTENSIONS = ('.parquet', '.pickle')
+
+# Name of the utterance cache database, stored in the cache directory
+UTTERANCE_DB = 'utterances.sqlite'
+
+# Maximum number of SQLite parameters used in a single query
+SQL_BATCH = 500
+
+# Directory of the feature store entries, next to the input files unless
+# another directory is configured
+FEATURE_STORE_DIR = '.delib_ana_features/'
+
+# Active cache settings, see configure()
+CACHE_SETTINGS = {
+    'enabled': True,
+    'cache_dir': '.delib_ana_cache/',
+    'max_size': 1024 * 1024 * 1024,
+    'utterance_max_entries': 1000000,
+    'feature_store': False,
+    'feature_dir': None
+}
+
+# Utterance cache opened by the current process, see utterance_cache()
+UTTERANCE_CACHE = {'pid': None, 'cache': None}
+
+
+def configure(cache_dir=None, max_size_mb=None, enabled=None,
+              utterance_max_entries=None, feature_store=None,
+              feature_dir=None):
+    """Change the active cache settings.
+
+    Keyword Arguments:
+        cache_dir {str} -- directory where the cache entries are stored.
+            (default: {None})
+        max_size_mb {float} -- maximum size of the cache in megabytes.
+            (default: {None})
+        enabled {bool} -- False to bypass the cache. (default: {None})
+        utterance_max_entries {int} -- maximum number of utterances kept in
+            the utterance cache. (default: {None})
+        feature_store {bool} -- True to use the feature store.
+            (default: {None})
+        feature_dir {str} -- directory of the feature store entries, instead
+            of a directory next to each input file. (default: {None})
+    """
+
+    if cache_dir:
+        CACHE_SETTINGS['cache_dir'] = os.path.join(cache_dir, '')
+    if max_size_mb is not None:
+        CACHE_SETTINGS['max_size'] = int(max_size_mb * 1024 * 1024)
+    if enabled is not None:
+        CACHE_SETTINGS['enabled'] = enabled
+    if utterance_max_entries is not None:
+        CACHE_SETTINGS['utterance_max_entries'] = utterance_max_entries
+    if feature_store is not None:
+        CACHE_SETTINGS['feature_store'] = feature_store
+    if feature_dir:
+        CACHE_SETTINGS['feature_dir'] = os.path.join(feature_dir, '')
+    UTTERANCE_CACHE['pid'] = None
+    UTTERANCE_CACHE['cache'] = None
+
+
+def file_digest(file_loc, block_size=1024 * 1024):
+    """Returns the SHA-256 hash of the content of a file.
+
+    Arguments:
+        file_loc {str} -- location of the file.
+
+    Keyword Arguments:
+        block_size {int} -- number of bytes read at a time.
+            (default: {1048576})
+
+    Returns:
+        str -- hexadecimal digest of the file content.
+    """
+
+    digest = hashlib.sha256()
+    with open(file_loc, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(file_loc, import_func, feature_names=None, columns=None,
+              compact=False):
+    """Returns the cache key of a dataset file for an import function.
+
+    Arguments:
+        file_loc {str} -- location of the dataset file.
+        import_func {function} -- function used to import the dataset.
+
+    Keyword Arguments:
+        feature_names {list} -- features computed by the import, None for
+            the default ones. (default: {None})
+        columns {list} -- columns of the file kept by the import, None for
+            all of them. (default: {None})
+        compact {bool} -- the import stores the columns with compact types.
+            (default: {False})
+
+    Returns:
+        str -- cache key.
+    """
+
+    key = '%s-v%d-%s' % (import_func.__name__, PREPROCESS_VERSION,
+                         file_digest(file_loc))
+    for prefix, names in [('-f', feature_names), ('-c', columns)]:
+        if names is not None:
+            names = ','.join(names).encode('utf-8')
+            key += prefix + hashlib.sha256(names).hexdigest()[:16]
+    if compact:
+        key += '-compact'
+    return key
+
+
+def cached_import(import_func, file_loc, **kwargs):
+    """Import a dataset, reusing the cached enriched DataFrame if present.
+
+    Arguments:
+        import_func {function} -- import function, e.g.
+            utils.import_label_data.
+        file_loc {str} -- location of the dataset file.
+
+    Keyword Arguments:
+        Passed on to import_func. They must not change its result, apart
+        from "feature_names", "columns" and "compact" which are part of the
+        cache key.
+
+    Returns:
+        DataFrame -- enriched dataset.
+    """
+
+    if not CACHE_SETTINGS['enabled']:
+        return import_func(file_loc, **kwargs)
+
+    data = load_cached(import_func, file_loc, **kwargs)
+    if data is None:
+        data = import_func(file_loc, **kwargs)
+        store_cached(data, import_func, file_loc, **kwargs)
+    return data
+
+
+def import_entry(import_func, file_loc, kwargs):
+    """Returns the location of the cache entry of a dataset import."""
+
+    return os.path.join(CACHE_SETTINGS['cache_dir'],
+                        cache_key(file_loc, import_func,
+                                  kwargs.get('feature_names'),
+                                  kwargs.get('columns'),
+                                  kwargs.get('compact', False)) +
+                        '.' + CACHE_FORMAT)
+
+
+def load_cached(import_func, file_loc, **kwargs):
+    """Returns the cached enriched DataFrame of a dataset import.
+
+    Used with store_cached when reading a dataset and enriching it are done
+    separately, see cached_import for the arguments.
+
+    Returns:
+        DataFrame -- enriched dataset, None if it isn't cached or the cache is
+            disabled.
+    """
+
+    if not CACHE_SETTINGS['enabled']:
+        return None
+    entry = import_entry(import_func, file_loc, kwargs)
+    # Other processes evicting entries may delete this one at any time, in
+    # which case it is a cache miss
+    try:
+        data = read_entry(entry)
+        # Refresh the entry's modification time for LRU eviction
+        os.utime(entry)
+    except FileNotFoundError:
+        return None
+    return data
+
+
+def store_cached(data, import_func, file_loc, **kwargs):
+    """Store the enriched DataFrame of a dataset import in the cache.
+
+    Arguments:
+        data {DataFrame} -- enriched dataset, as returned by import_func.
+
+    See cached_import for the other arguments.
+    """
+
+    if not CACHE_SETTINGS['enabled']:
+        return
+    write_entry(data, import_entry(import_func, file_loc, kwargs))
+    evict(CACHE_SETTINGS['max_size'])
+
+
+def vectorizer_fingerprint(combo_vec):
+    """Returns a fingerprint of fitted vectorizers.
+
+    The fingerprint covers the parameters, vocabulary and IDF weights of each
+    vectorizer, which fully determine the features they produce.
+
+    Arguments:
+        combo_vec {FeatureUnion} -- combined vectorizers of a model.
+
+    Returns:
+        str -- hexadecimal digest.
+    """
+
+    digest = hashlib.sha256()
+    for name, vec in combo_vec.transformer_list:
+        params = sorted(vec.get_params().items())
+        terms = sorted(vec.vocabulary_, key=vec.vocabulary_.get)
+        digest.update(('%s\n%r\n' % (name, params)).encode('utf-8'))
+        digest.update('\n'.join(terms).encode('utf-8'))
+        if vec.use_idf:
+            digest.update(vec.idf_.tobytes())
+    return digest.hexdigest()
+
+
+def feature_store_entry(file_loc, fingerprint):
+    """Returns the location of the feature store entry of a dataset file.
+
+    Arguments:
+        file_loc {str} -- location of the dataset file.
+        fingerprint {str} -- fingerprint of the vectorizers.
+
+    Returns:
+        str -- location of the .npz entry.
+    """
+
+    store_dir = CACHE_SETTINGS['feature_dir']
+    if not store_dir:
+        store_dir = os.path.join(os.path.dirname(file_loc), FEATURE_STORE_DIR)
+    return os.path.join(store_dir, '%s-v%d-%s-%s.npz' % (
+        os.path.basename(file_loc), PREPROCESS_VERSION,
+        file_digest(file_loc)[:16], fingerprint[:16]))
+
+
+def stored_text_feats(file_loc, data, combo_vec, fingerprint=None):
+    """Returns the text features of a dataset file.
+
+    The features are read from the feature store when present, and added to
+    it otherwise. They are computed directly when the feature store or the
+    cache are disabled.
+
+    Arguments:
+        file_loc {str} -- location of the dataset file.
+        data {DataFrame} -- the dataset imported from the file.
+        combo_vec {FeatureUnion} -- combined vectorizers of a model.
+
+    Keyword Arguments:
+        fingerprint {str} -- fingerprint of the vectorizers, computed if not
+            given. (default: {None})
+
+    Returns:
+        csr_matrix -- 2d sparse matrix of text features.
+    """
+
+    if not (CACHE_SETTINGS['enabled'] and CACHE_SETTINGS['feature_store']):
+        return combo_vec.transform(data["cleaned_comment"])
+
+    if fingerprint is None:
+        fingerprint = vectorizer_fingerprint(combo_vec)
+    entry = feature_store_entry(file_loc, fingerprint)
+    if os.path.isfile(entry):
+        feats = sparse.load_npz(entry)
+        if feats.shape[0] == len(data):
+            return feats.tocsr()
+
+    feats = combo_vec.transform(data["cleaned_comment"])
+    # save_npz adds the .npz extension to names without it
+    tmp_entry = '%s.%d.tmp.npz' % (entry[:-len('.npz')], os.getpid())
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        sparse.save_npz(tmp_entry, feats, compressed=False)
+        os.replace(tmp_entry, entry)
+    except OSError as err:
+        print('Feature store entry "%s" not stored: %s' % (entry, err))
+        if os.path.exists(tmp_entry):
+            os.remove(tmp_entry)
+    return feats
+
+
+def read_entry(entry):
+    """Read a cache entry.
+
+    Arguments:
+        entry {str} -- location of the cache entry.
+
+    Returns:
+        DataFrame -- enriched dataset.
+    """
+
+    if CACHE_FORMAT == 'parquet':
+        return pd.read_parquet(entry)
+    return pd.read_pickle(entry)
+
+
+def write_entry(data, entry):
+    """Write a cache entry, failures only disable caching for this dataset.
+
+    Arguments:
+        data {DataFrame} -- enriched dataset.
+        entry {str} -- location of the cache entry.
+    """
+
+    # Worker processes may import identical files at the same time
+    tmp_entry = '%s.%d.tmp' % (entry, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        if CACHE_FORMAT == 'parquet':
+            data.to_parquet(tmp_entry)
+        else:
+            data.to_pickle(tmp_entry)
+        os.replace(tmp_entry, entry)
+    except (OSError, ValueError, TypeError, NotImplementedError) as err:
+        print('Cache entry "%s" not stored: %s' % (entry, err))
+        if os.path.exists(tmp_entry):
+            os.remove(tmp_entry)
+
+
+def cache_entries():
+    """Returns the cache entries, least recently used first.
+
+    Returns:
+        list -- list of (path, size) tuples.
+    """
+
+    cache_dir = CACHE_SETTINGS['cache_dir']
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for a_file in os.scandir(cache_dir):
+        if not a_file.name.endswith(ENTRY_EXTENSIONS):
+            continue
+        try:
+            if not a_file.is_file():
+                continue
+            stats = a_file.stat()
+        except FileNotFoundError:
+            # Deleted by another process since the directory was listed
+            continue
+        entries.append((stats.st_mtime, a_file.path, stats.st_size))
+    entries.sort()
+    return [(pth, size) for _, pth, size in entries]
+
+
+def evict(max_size):
+    """Delete least recently used entries until the cache fits in max_size.
+
+    Arguments:
+        max_size {int} -- maximum size of the cache in bytes.
+    """
+
+    entries = cache_entries()
+    total = sum(size for _, size in entries)
+    for pth, size in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(pth)
+        except FileNotFoundError:
+            # Already evicted by another process
+            pass
+        total -= size
+
+
+def clear_cache(verbose=True):
+    """Delete all the cache entries, including the utterance cache.
+
+    Keyword Arguments:
+        verbose {bool} -- print process messages. (default: {True})
+    """
+
+    entries = cache_entries()
+    for pth, _ in entries:
+        os.remove(pth)
+    utt_deleted = 0
+    db_path = os.path.join(CACHE_SETTINGS['cache_dir'], UTTERANCE_DB)
+    if os.path.isfile(db_path):
+        utt_cache = UtteranceCache(db_path)
+        utt_deleted = utt_cache.clear()
+        utt_cache.close()
+    if verbose:
+        print('%d preprocessing cache entries and %d utterances deleted from '
+              '"%s".' % (len(entries), utt_deleted,
+                         CACHE_SETTINGS['cache_dir']))
+
+
+class UtteranceCache:
+    """Persistent cache of the cleaned text and POS tags of utterances.
+
+    Utterances are keyed by a hash of their normalized text (lower case,
+    collapsed whitespace), which the cleaning and POS tagging steps do not
+    depend on. Each lookup refreshes the last use time of the utterances
+    found, and the least recently used ones are deleted once the cache holds
+    more than max_entries utterances. The connection can be used by several
+    threads of the same process, one at a time.
+    """
+
+    def __init__(self, db_path, max_entries=1000000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, timeout=60,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS utterances ('
+                          'key TEXT PRIMARY KEY, cleaned TEXT, pos TEXT, '
+                          'last_used REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS utterances_last_used '
+                          'ON utterances (last_used)')
+        self.conn.commit()
+
+    @staticmethod
+    def text_key(text):
+        """Returns the cache key of an utterance.
+
+        Arguments:
+            text {str} -- utterance text.
+
+        Returns:
+            str -- hexadecimal hash of the normalized text.
+        """
+
+        norm = ' '.join(text.lower().split())
+        return hashlib.sha1(('%d:%s' % (PREPROCESS_VERSION, norm)).encode(
+            'utf-8')).hexdigest()
+
+    def lookup(self, keys, counts=None):
+        """Retrieve the cached utterances.
+
+        Arguments:
+            keys {list} -- unique keys of the utterances.
+
+        Keyword Arguments:
+            counts {dict} -- number of occurrences of each key, used for the
+                hit/miss counters. (default: {None})
+
+        Returns:
+            dict -- (cleaned text, POS tags) tuple of each key found.
+        """
+
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), SQL_BATCH):
+                batch = keys[i:i + SQL_BATCH]
+                rows = self.conn.execute(
+                    'SELECT key, cleaned, pos FROM utterances WHERE key IN '
+                    '(%s)' % ','.join('?' * len(batch)), batch)
+                for key, cleaned, pos in rows:
+                    found[key] = (cleaned, pos)
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    'UPDATE utterances SET last_used = ? WHERE key = ?',
+                    [(now, key) for key in found])
+                self.conn.commit()
+
+            for key in keys:
+                occurrences = counts[key] if counts else 1
+                if key in found:
+                    self.hits += occurrences
+                else:
+                    self.misses += occurrences
+        return found
+
+    def store(self, items):
+        """Add utterances to the cache.
+
+        Arguments:
+            items {dict} -- (cleaned text, POS tags) tuple of each key.
+        """
+
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO utterances VALUES (?, ?, ?, ?)',
+                [(key, cleaned, pos, now)
+                 for key, (cleaned, pos) in items.items()])
+            self.conn.commit()
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used utterances above max_entries."""
+
+        with self.lock:
+            total = self.conn.execute(
+                'SELECT COUNT(*) FROM utterances').fetchone()[0]
+            if total > self.max_entries:
+                self.conn.execute(
+                    'DELETE FROM utterances WHERE key IN (SELECT key FROM '
+                    'utterances ORDER BY last_used LIMIT ?)',
+                    (total - self.max_entries,))
+                self.conn.commit()
+
+    def clear(self):
+        """Delete all the utterances.
+
+        Returns:
+            int -- number of utterances deleted.
+        """
+
+        with self.lock:
+            deleted = self.conn.execute('DELETE FROM utterances').rowcount
+            self.conn.commit()
+        return deleted
+
+    def close(self):
+        self.conn.close()
+
+    def stats(self):
+        """Returns the cache counters.
+
+        Returns:
+            dict -- hits, misses and number of stored utterances.
+        """
+
+        with self.lock:
+            entries = self.conn.execute(
+                'SELECT COUNT(*) FROM utterances').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+
+def utterance_cache():
+    """Returns the utterance cache of the current process.
+
+    The database is opened on first use, separately in each process, as
+    SQLite connections can not be shared with forked processes.
+
+    Returns:
+        UtteranceCache -- the utterance cache, None if caching is disabled.
+    """
+
+    if not CACHE_SETTINGS['enabled']:
+        return None
+    if UTTERANCE_CACHE['pid'] != os.getpid():
+        db_path = os.path.join(CACHE_SETTINGS['cache_dir'], UTTERANCE_DB)
+        UTTERANCE_CACHE['cache'] = UtteranceCache(
+            db_path, CACHE_SETTINGS['utterance_max_entries'])
+        UTTERANCE_CACHE['pid'] = os.getpid()
+    return UTTERANCE_CACHE['cache']
+
+
+def report_utterance_cache():
+    """Print the utterance cache counters of the current process."""
+
+    if UTTERANCE_CACHE['pid'] == os.getpid():
+        stats = UTTERANCE_CACHE['cache'].stats()
+        print('Utterance cache: %d hits, %d misses, %d utterances stored.'
+              % (stats['hits'], stats['misses'], stats['entries']))
@@ -15,11 +15,14 @@ Contact: eleonore.fournier-tombs@mail.mcgill.ca
 """
 
 import configparser
-from delib_ana_utils import INDICATORS
+import delib_ana_features as features
+from delib_ana_utils import INDICATORS, COMPRESSION_EXTENSIONS, \
+    COLUMNAR_CODECS
 
 config = configparser.ConfigParser()
 
-ACTIONS = ['predict',  'generate', 'generate_predict', 'batch_predict', 'test']
+ACTIONS = ['predict',  'generate', 'generate_all', 'generate_predict',
+           'batch_predict', 'test', 'serve', 'stream_predict']
 
 # TODO: Include file error handling functions
 
@@ -40,22 +43,154 @@ class DelibAnaConfiguration:
             self.tag = tag
         else:
             self.tag = ''
+        workers = check_config_key('general', 'workers')
+        if workers:
+            self.workers = int(workers)
+        else:
+            self.workers = None
+        self.cache_dir = check_config_key('general', 'cache_dir')
+        cache_size = check_config_key('general', 'cache_size')
+        if cache_size:
+            self.cache_size = float(cache_size)
+        else:
+            self.cache_size = None
+        utt_size = check_config_key('general', 'utterance_cache_size')
+        if utt_size:
+            self.utterance_cache_size = int(utt_size)
+        else:
+            self.utterance_cache_size = None
+        feature_store = check_config_key('general', 'feature_store')
+        if feature_store is not None:
+            self.feature_store = self.config['general'].getboolean(
+                'feature_store')
+        else:
+            self.feature_store = False
+        self.feature_store_dir = check_config_key('general',
+                                                  'feature_store_dir')
+        memory_report = check_config_key('general', 'memory_report')
+        if memory_report is not None:
+            self.memory_report = self.config['general'].getboolean(
+                'memory_report')
+        else:
+            self.memory_report = False
+        dense = check_config_key('input', 'dense_features')
+        if dense is not None:
+            self.dense_features = self.config['input'].getboolean(
+                'dense_features')
+        else:
+            self.dense_features = False
+        row_index = check_config_key('input', 'row_index')
+        if row_index is not None:
+            self.row_index = self.config['input'].getboolean('row_index')
+        else:
+            self.row_index = False
+        compact = check_config_key('input', 'compact_frames')
+        if compact is not None:
+            self.compact_frames = self.config['input'].getboolean(
+                'compact_frames')
+        else:
+            self.compact_frames = False
+        lean = check_config_key('input', 'lean_store')
+        if lean is not None:
+            self.lean_store = self.config['input'].getboolean('lean_store')
+        else:
+            self.lean_store = False
+        compress = check_config_key('input', 'compress')
+        if compress:
+            self.compress = int(compress)
+        else:
+            self.compress = None
+        self.output_format = check_config_key('input', 'output_format')
+        self.output_compression = check_config_key('input',
+                                                   'output_compression')
+        level = check_config_key('input', 'compression_level')
+        if level:
+            self.compression_level = int(level)
+        else:
+            self.compression_level = None
+        self.output_columns = get_output_columns()
 
+        if self.action in ['predict', 'generate_predict', 'batch_predict',
+                           'stream_predict']:
+            self.extra_features = get_extra_features()
+        if self.action in ['predict', 'batch_predict']:
+            self.models = get_model_entries()
         if self.action in ['predict', 'generate_predict']:
             self.unlabelled = self.config['input']['unlabelled']
-        if self.action in ['predict', 'generate', 'batch_predict']:
+        if self.action == 'predict':
+            chunk_size = check_config_key('input', 'chunk_size')
+            if chunk_size:
+                self.chunk_size = int(chunk_size)
+            else:
+                self.chunk_size = None
+        if self.action == 'stream_predict':
+            stream_batch = check_config_key('input', 'stream_batch')
+            if stream_batch:
+                self.stream_batch = int(stream_batch)
+            else:
+                self.stream_batch = None
+            stream_wait = check_config_key('input', 'stream_wait')
+            if stream_wait:
+                self.stream_wait = float(stream_wait)
+            else:
+                self.stream_wait = None
+        if self.action in ['predict', 'generate', 'batch_predict',
+                           'stream_predict']:
             self.store_name = self.config['input']['store_name']
-        if self.action in ['generate']:
+        if self.action in ['generate', 'generate_all']:
             str_type = self.config['input']['store_type']
             if str_type == '' or str_type is None:
                 self.store_type = None
             else:
                 self.store_type = str_type
-        if self.action in ['predict', 'batch_predict']:
+        if self.action in ['predict', 'batch_predict', 'serve',
+                           'stream_predict']:
             self.store_type = self.config['input']['store_type']
         if self.action == 'batch_predict':
             self.unlabelled_dir = self.config['input']['unlabelled_dir']
-        if self.action in ['generate', 'generate_predict', 'test']:
+            self.combined_output = check_config_key('input',
+                                                    'combined_output')
+            staged = check_config_key('input', 'batch_pipeline')
+            if staged is not None:
+                self.batch_pipeline = self.config['input'].getboolean(
+                    'batch_pipeline')
+            else:
+                self.batch_pipeline = False
+            queue_size = check_config_key('input', 'pipeline_queue')
+            if queue_size:
+                self.pipeline_queue = int(queue_size)
+            else:
+                self.pipeline_queue = None
+        if self.action == 'generate_all':
+            self.store_name = self.config['input']['store_name']
+            self.indicators = get_indicator_list()
+            train_jobs = check_config_key('input', 'train_jobs')
+            if train_jobs:
+                self.train_jobs = int(train_jobs)
+            else:
+                self.train_jobs = None
+        if self.action == 'serve':
+            self.daemon_models = get_daemon_models(self.tag)
+            self.host = check_config_key('daemon', 'host')
+            port = check_config_key('daemon', 'port')
+            if port:
+                self.port = int(port)
+            else:
+                self.port = None
+            self.socket_path = check_config_key('daemon', 'socket')
+            max_batch = check_config_key('daemon', 'max_batch')
+            if max_batch:
+                self.max_batch = int(max_batch)
+            else:
+                self.max_batch = None
+            batch_wait = check_config_key('daemon', 'batch_wait')
+            if batch_wait:
+                self.batch_wait = float(batch_wait)
+            else:
+                self.batch_wait = None
+            self.data_dir = check_config_key('daemon', 'data_dir')
+        if self.action in ['generate', 'generate_all', 'generate_predict',
+                           'test']:
             self.labelled = self.config['input']['labelled']
             self.get_vocab()
             train_split = check_config_key('input', 'train_split')
@@ -126,12 +261,18 @@ def test_config_file(config_filename):
         valid = test_config_predict(err, warn)
     if action == 'generate':
         valid = test_config_generate(err, warn)
+    if action == 'generate_all':
+        valid = test_config_generate_all(err, warn)
     if action == 'generate_predict':
         valid = test_config_generate_predict(err, warn)
     if action == 'batch_predict':
         valid = test_config_batch_predict(err, warn)
     if action == 'test':
         valid = test_config_testing(err, warn)
+    if action == 'serve':
+        valid = test_config_serve(err, warn)
+    if action == 'stream_predict':
+        valid = test_config_stream_predict(err, warn)
 
     if valid:
         print(action.upper(), 'config entries appear valid.')
@@ -150,13 +291,23 @@ def test_config_predict(e_st, w_st):
     w_ed = 'may be required for "Predict" process.'
 
     check_tag(w_st, w_ed)
-    if not check_indicator(e_st, e_ed):
-        valid = False
+    if get_model_entries():
+        if not check_model_entries(e_st, e_ed):
+            valid = False
+    else:
+        if not check_indicator(e_st, e_ed):
+            valid = False
+        if not check_store_name(e_st, e_ed):
+            valid = False
     if not check_unlabelled(e_st, e_ed):
         valid = False
     if not check_store_type(e_st, e_ed):
         valid = False
-    if not check_store_name(e_st, e_ed):
+    if not check_extra_features(e_st):
+        valid = False
+    if not check_output_format(e_st):
+        valid = False
+    if not check_output_compression(e_st):
         valid = False
 
     return valid
@@ -181,6 +332,25 @@ def test_config_generate(e_st, w_st):
     return valid
 
 
+def test_config_generate_all(e_st, w_st):
+
+    valid = True
+    e_ed = 'is required for "Generate All" process.'
+    w_ed = 'may be required for "Generate All" process.'
+
+    check_tag(w_st, w_ed)
+    if not check_indicators(e_st, e_ed):
+        valid = False
+    if not check_labelled(e_st, e_ed):
+        valid = False
+    check_vocab(w_st, w_ed)
+    check_store_type(w_st, w_ed)
+    if not check_store_name(e_st, e_ed):
+        valid = False
+
+    return valid
+
+
 def test_config_generate_predict(e_st, w_st):
 
     valid = True
@@ -195,6 +365,12 @@ def test_config_generate_predict(e_st, w_st):
     if not check_labelled(e_st, e_ed):
         valid = False
     check_vocab(w_st, w_ed)
+    if not check_extra_features(e_st):
+        valid = False
+    if not check_output_format(e_st):
+        valid = False
+    if not check_output_compression(e_st):
+        valid = False
 
     if check_stored(w_st, w_ed):
         check_store_type(w_st, w_ed)
@@ -211,8 +387,14 @@ def test_config_batch_predict(e_st, w_st):
     w_ed = 'may be required for "Batch Predict" process.'
 
     check_tag(w_st, w_ed)
-    if not check_indicator(e_st, e_ed):
-        valid = False
+    if get_model_entries():
+        if not check_model_entries(e_st, e_ed):
+            valid = False
+    else:
+        if not check_indicator(e_st, e_ed):
+            valid = False
+        if not check_store_name(e_st, e_ed):
+            valid = False
 
     unlabelled_dir = check_config_key('input', 'unlabelled_dir')
     if not unlabelled_dir:
@@ -221,7 +403,11 @@ def test_config_batch_predict(e_st, w_st):
 
     if not check_store_type(e_st, e_ed):
         valid = False
-    if not check_store_name(e_st, e_ed):
+    if not check_extra_features(e_st):
+        valid = False
+    if not check_output_format(e_st):
+        valid = False
+    if not check_output_compression(e_st):
         valid = False
 
     return valid
@@ -248,6 +434,49 @@ def test_config_testing(e_st, w_st):
     return valid
 
 
+def test_config_serve(e_st, w_st):
+
+    valid = True
+    e_ed = 'is required for "Serve" process.'
+
+    if not check_daemon_models(e_st, e_ed):
+        valid = False
+    if not check_store_type(e_st, e_ed):
+        valid = False
+
+    return valid
+
+
+def test_config_stream_predict(e_st, w_st):
+
+    valid = True
+    e_ed = 'is required for "Stream Predict" process.'
+
+    if not check_indicator(e_st, e_ed):
+        valid = False
+    if not check_store_type(e_st, e_ed):
+        valid = False
+    if not check_store_name(e_st, e_ed):
+        valid = False
+    if not check_extra_features(e_st):
+        valid = False
+
+    return valid
+
+
+def get_action(config_filename):
+    """
+    Returns the action of a configuration file in lower case, or None if it
+    has no action.
+    """
+    action_config = configparser.ConfigParser()
+    action_config.read(config_filename)
+    try:
+        return action_config['general']['action'].lower()
+    except KeyError:
+        return None
+
+
 def check_config_key(section, key):
     """
     Input ini file section and key and returns a value if it is not an empty
@@ -279,6 +508,172 @@ def check_indicator(st, ed):
     return True
 
 
+def get_indicator_list():
+    """
+    Returns the comma separated "indicators" list of the input section, or the
+    single "indicator" if no list is provided.
+    """
+    indics = check_config_key('input', 'indicators')
+    if not indics:
+        indics = check_config_key('input', 'indicator')
+    if not indics:
+        return []
+    return [i.strip() for i in indics.split(',') if i.strip()]
+
+
+def check_indicators(st, ed):
+    indics = get_indicator_list()
+    if not indics:
+        print(st, 'indicator names', ed)
+        return False
+    for indic in indics:
+        if indic not in INDICATORS:
+            print(st, 'invalid indicator "%s". List of valid indicators:'
+                  % indic, INDICATORS)
+            return False
+    return True
+
+
+def get_model_entries():
+    """
+    Returns the (indicator, file name) tuple of each entry of the comma
+    separated "models" list of the input section. Entries are written
+    "indicator:file_name", malformed entries are returned as (None, entry).
+    """
+    models = check_config_key('input', 'models')
+    if not models:
+        return []
+    entries = []
+    for entry in models.split(','):
+        parts = [part.strip() for part in entry.split(':', 1)]
+        if len(parts) == 2 and parts[0] and parts[1]:
+            entries.append(tuple(parts))
+        elif entry.strip():
+            entries.append((None, entry.strip()))
+    return entries
+
+
+def check_model_entries(st, ed):
+    for indic, file_name in get_model_entries():
+        if indic is None:
+            print(st, 'model entry "%s" in the form "indicator:file"'
+                  % file_name, ed)
+            return False
+        if indic not in INDICATORS and indic != 'bundle':
+            print(st, 'valid indicator for model "%s". List of valid '
+                  'indicators:' % file_name, INDICATORS + ['bundle'])
+            return False
+    return True
+
+
+def get_output_columns():
+    """
+    Returns the comma separated "output_columns" list of the input section,
+    None if no list is provided or it is "all", and an empty list if it is
+    "none".
+    """
+    columns = check_config_key('input', 'output_columns')
+    if not columns or columns.strip().lower() == 'all':
+        return None
+    if columns.strip().lower() == 'none':
+        return []
+    return [c.strip() for c in columns.split(',') if c.strip()]
+
+
+def check_output_format(st):
+    out_format = check_config_key('input', 'output_format')
+    if out_format and out_format not in ['csv', 'parquet', 'feather']:
+        print(st, 'invalid output format. Options: ["csv", "parquet", '
+              '"feather"].')
+        return False
+    return True
+
+
+def check_output_compression(st):
+    compression = check_config_key('input', 'output_compression')
+    options = list(COMPRESSION_EXTENSIONS) + ['none']
+    if compression and compression not in options:
+        print(st, 'invalid output compression. Options:', options)
+        return False
+    out_format = check_config_key('input', 'output_format')
+    if compression in COMPRESSION_EXTENSIONS and \
+            out_format in COLUMNAR_CODECS and \
+            compression not in COLUMNAR_CODECS[out_format]:
+        print(st, '%s compression is not available for %s files. Options:'
+              % (compression, out_format), COLUMNAR_CODECS[out_format])
+        return False
+    level = check_config_key('input', 'compression_level')
+    if level:
+        try:
+            int(level)
+        except ValueError:
+            print(st, 'compression level must be an integer.')
+            return False
+    return True
+
+
+def get_extra_features():
+    """
+    Returns the comma separated "extra_features" list of the input section,
+    or None if no list is provided. "all" stands for every feature of the
+    unlabelled dataset imports.
+    """
+    extra = check_config_key('input', 'extra_features')
+    if not extra:
+        return None
+    if extra.strip().lower() == 'all':
+        return list(features.UNLABELLED_FEATURES)
+    return [f.strip() for f in extra.split(',') if f.strip()]
+
+
+def check_extra_features(st):
+    for name in get_extra_features() or []:
+        if name not in features.registry():
+            print(st, 'invalid extra feature "%s". List of valid features:'
+                  % name, list(features.registry()))
+            return False
+    return True
+
+
+def get_daemon_models(tag=''):
+    """
+    Returns the (tag, indicator, file name) tuple of each entry of the comma
+    separated "models" list of the daemon section. Entries are written
+    "tag:indicator:file_name" or "indicator:file_name", in which case the
+    general tag is used.
+    """
+    models = check_config_key('daemon', 'models')
+    if not models:
+        return []
+    entries = []
+    for entry in models.split(','):
+        parts = [part.strip() for part in entry.split(':')]
+        if len(parts) == 2:
+            parts = [tag] + parts
+        if len(parts) == 3 and parts[1] and parts[2]:
+            entries.append(tuple(parts))
+        elif entry.strip():
+            entries.append((None, None, entry.strip()))
+    return entries
+
+
+def check_daemon_models(st, ed):
+    models = get_daemon_models()
+    if not models:
+        print(st, '[daemon] models list', ed)
+        return False
+    for tag, indic, file_name in models:
+        if indic is None:
+            print(st, 'model entry "%s" in the form "[tag:]indicator:file"'
+                  % file_name, ed)
+            return False
+        if indic not in INDICATORS and indic != 'bundle':
+            print(st, 'valid indicator for model "%s". List of valid '
+                  'indicators:' % file_name, INDICATORS + ['bundle'])
+            return False
+    return True
+
+
 def check_vocab(st, ed):
     vocab = check_config_key('input', 'vocab')
     if not vocab:
@@ -314,9 +709,9 @@ def check_store_type(st, ed):
     if not file_type:
         print(st, 'stored model file type', ed)
         return False
-    elif file_type not in ['pickle', 'joblib']:
+    elif file_type not in ['pickle', 'joblib', 'mmap']:
         print(st, 'invalid stored model file type. Options: ["pickle", \
-                "joblib"].')
+                "joblib", "mmap"].')
         return False
     return True
 
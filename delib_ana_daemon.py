@@ -0,0 +1,469 @@
+#!/usr/local/bin/python3
+"""Module: DelibAnalysis Prediction Daemon
+
+Long running prediction server. The stored models, their vectorizers and the
+POS tagger are loaded once, then predictions are served over HTTP on a local
+port or on a Unix socket. Concurrent requests for the same model are grouped
+in micro-batches so their rows are labelled by a single f_class_predict call.
+
+Endpoints:
+    POST /predict -- JSON body {"indicator": str, "tag": str (optional),
+        "rows": [{"speaker": str, "speech": str}, ...]}. Returns
+        {"tag": str, "indicator": str, "predictions": [...]}. When a data
+        directory is configured, {"file": str, "row_numbers": [int, ...]}
+        can be sent instead of "rows", to label rows of a CSV dataset of the
+        directory read with its row index.
+    GET /health -- status and list of the loaded models.
+    GET /metrics -- request, row and batch counters of each model.
+
+Package: DelibAnalysis
+Version: 2.0
+Authors: Eleonore Fournier-Tombs and Curtis Hendricks
+Source: https://github.com/eleonoreft/DelibAnalysis
+Copyright: Attribution-NonCommercial-ShareAlike CC BY-NC-SA
+https://creativecommons.org/licenses/by-nc-sa/4.0/
+Contact: eleonore.fournier-tombs@mail.mcgill.ca
+
+"""
+
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import delib_ana_features as features
+import delib_ana_forest as forest
+import delib_ana_process as process
+import delib_ana_rowindex as rowindex
+import delib_ana_utils as utils
+
+MAX_BODY = 64 * 1024 * 1024
+
+
+class RequestError(Exception):
+    """Invalid prediction request, reported to the client with status 400."""
+
+
+class ModelMetrics:
+    """Thread safe counters of the requests served by one model."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_batch_rows = 0
+        self.predict_seconds = 0.0
+        self.latency_seconds = 0.0
+
+    def add_batch(self, n_rows, seconds):
+        with self.lock:
+            self.batches += 1
+            self.max_batch_rows = max(self.max_batch_rows, n_rows)
+            self.predict_seconds += seconds
+
+    def add_request(self, n_rows, seconds, failed=False):
+        with self.lock:
+            self.requests += 1
+            self.rows += n_rows
+            self.latency_seconds += seconds
+            if failed:
+                self.errors += 1
+
+    def report(self):
+        """Returns the counters and derived averages in a dictionary."""
+
+        with self.lock:
+            batches = max(self.batches, 1)
+            requests = max(self.requests, 1)
+            return {'requests': self.requests, 'rows': self.rows,
+                    'batches': self.batches, 'errors': self.errors,
+                    'max_batch_rows': self.max_batch_rows,
+                    'mean_batch_rows': self.rows / batches,
+                    'mean_requests_per_batch': self.requests / batches,
+                    'mean_predict_ms': 1000 * self.predict_seconds / batches,
+                    'mean_latency_ms': 1000 * self.latency_seconds / requests}
+
+
+class MicroBatcher:
+    """Group the concurrent requests of one model in micro-batches.
+
+    A background thread takes the first waiting request, then keeps
+    collecting requests for up to batch_wait seconds or until max_batch rows
+    are waiting. Each request is preprocessed on its own, so the
+    "has_question_parent" column never crosses request boundaries, and all
+    the rows of the batch are then labelled with one f_class_predict call.
+
+    Arguments:
+        model {model object} -- trained classifier.
+        vecs {dict} -- vectorizers of the classifier.
+        indic {str} -- name of the indicator predicted by the model.
+
+    Keyword Arguments:
+        max_batch {int} -- maximum number of rows in a batch. Larger requests
+            are labelled on their own. (default: {256})
+        batch_wait {float} -- seconds to wait for more requests after the
+            first one. (default: {0.01})
+        dense {bool} -- use dense feature arrays. (default: {False})
+    """
+
+    def __init__(self, model, vecs, indic, max_batch=256, batch_wait=0.01,
+                 dense=False):
+        self.model = model
+        self.vecs = vecs
+        self.indic = indic
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.dense = dense
+        # Only the labels are returned, other features are not computed
+        self.feature_names = features.required_features(vecs)
+        self.metrics = ModelMetrics()
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def predict(self, data):
+        """Label a DataFrame of rows, blocking until its batch is done.
+
+        Arguments:
+            data {DataFrame} -- rows with columns "speaker" and "speech".
+
+        Returns:
+            list -- predicted indicator values, one per row.
+        """
+
+        start = time.perf_counter()
+        future = Future()
+        self.requests.put((data, future))
+        try:
+            labels = future.result()
+        except Exception:
+            self.metrics.add_request(len(data), time.perf_counter() - start,
+                                     True)
+            raise
+        self.metrics.add_request(len(data), time.perf_counter() - start)
+        return labels
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            n_rows = len(batch[0][0])
+            deadline = time.monotonic() + self.batch_wait
+            while n_rows < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+            self.predict_batch(batch)
+
+    def predict_batch(self, batch):
+        """Preprocess each request of a batch and label them together.
+
+        Arguments:
+            batch {list} -- (DataFrame, Future) tuple of each request.
+        """
+
+        start = time.perf_counter()
+        frames = []
+        futures = []
+        for data, future in batch:
+            try:
+                frames.append(utils.prepare_unlabelled_data(
+                    data, feature_names=self.feature_names))
+                futures.append(future)
+            except Exception as err:
+                future.set_exception(err)
+        if not frames:
+            return
+        try:
+            data = forest.pd.concat(frames, ignore_index=True)
+            labelled = forest.f_class_predict(
+                data, self.indic, self.vecs['vec_combo'], self.model,
+                self.dense, features.model_feature_names(self.vecs))
+        except Exception as err:
+            for future in futures:
+                future.set_exception(err)
+            return
+        labels = labelled[self.indic].tolist()
+        first = 0
+        for frame, future in zip(frames, futures):
+            future.set_result(labels[first:first + len(frame)])
+            first += len(frame)
+        self.metrics.add_batch(len(data), time.perf_counter() - start)
+
+
+class PredictionService:
+    """Models served by the daemon, keyed by tag and indicator.
+
+    Arguments:
+        models {list} -- (tag, indicator, file name) tuple of each model. The
+            "bundle" indicator loads every model of a model bundle.
+        store_type {str} -- method used to store the model files.
+
+    Keyword Arguments:
+        max_batch {int} -- maximum number of rows in a batch.
+            (default: {256})
+        batch_wait {float} -- seconds to wait for more requests after the
+            first one of a batch. (default: {0.01})
+        dense {bool} -- use dense feature arrays. (default: {False})
+        data_dir {str} -- directory of the CSV datasets whose rows can be
+            requested by number, None to only accept rows in the requests.
+            (default: {None})
+        verbose {bool} -- print process messages. (default: {True})
+    """
+
+    def __init__(self, models, store_type, max_batch=256, batch_wait=0.01,
+                 dense=False, data_dir=None, verbose=True):
+        self.started = time.time()
+        self.data_dir = None
+        if data_dir:
+            self.data_dir = os.path.realpath(data_dir)
+        self.batchers = {}
+        for tag, indic, file_name in models:
+            bundle = indic == process.BUNDLE_NAME
+            model, vecs = process.load_model(store_type, file_name,
+                                             None if bundle else indic,
+                                             verbose)
+            if not isinstance(model, dict):
+                model = {indic: model}
+            for model_indic, classifier in model.items():
+                if hasattr(classifier, 'n_jobs'):
+                    # Batches are small, the thread pool only adds overhead
+                    classifier.n_jobs = 1
+                self.batchers[(tag, model_indic)] = MicroBatcher(
+                    classifier, vecs, model_indic, max_batch, batch_wait,
+                    dense)
+        utils.init_pos_worker()
+
+    def find_batcher(self, tag, indic):
+        """Returns the model of an indicator, and the tag it is served under.
+
+        The tag can be omitted when a single tag serves the indicator.
+        """
+
+        if tag is not None:
+            if (tag, indic) not in self.batchers:
+                raise RequestError('no model for tag "%s" and indicator "%s"'
+                                   % (tag, indic))
+            return tag, self.batchers[(tag, indic)]
+        matches = [key for key in self.batchers if key[1] == indic]
+        if len(matches) != 1:
+            raise RequestError('%d models for indicator "%s", a tag is '
+                               'required' % (len(matches), indic))
+        return matches[0][0], self.batchers[matches[0]]
+
+    def predict(self, request):
+        """Label the rows of a decoded /predict request.
+
+        Arguments:
+            request {dict} -- decoded JSON request body.
+
+        Returns:
+            dict -- response body.
+        """
+
+        if not isinstance(request, dict) or 'indicator' not in request:
+            raise RequestError('"indicator" is required')
+        if 'row_numbers' in request and 'rows' not in request:
+            tag, batcher = self.find_batcher(request.get('tag'),
+                                             request['indicator'])
+            data = self.file_rows(request)
+            return {'tag': tag, 'indicator': batcher.indic,
+                    'file': request['file'],
+                    'row_numbers': request['row_numbers'],
+                    'predictions': batcher.predict(data)}
+        rows = request.get('rows')
+        if not isinstance(rows, list) or not rows:
+            raise RequestError('"rows" must be a non empty list')
+        for row in rows:
+            if not isinstance(row, dict) or \
+                    not isinstance(row.get('speech'), str):
+                raise RequestError('each row needs a "speech" string')
+        tag, batcher = self.find_batcher(request.get('tag'),
+                                         request['indicator'])
+        data = forest.pd.DataFrame(
+            {'speaker': [str(row.get('speaker', '')) for row in rows],
+             'speech': [row['speech'] for row in rows]})
+        return {'tag': tag, 'indicator': batcher.indic,
+                'predictions': batcher.predict(data)}
+
+    def file_rows(self, request):
+        """Read the rows of a dataset file requested by number.
+
+        Arguments:
+            request {dict} -- decoded JSON request body, with the "file" name
+                relative to the data directory and the "row_numbers".
+
+        Returns:
+            DataFrame -- the rows, with columns "speaker" and "speech".
+        """
+
+        if self.data_dir is None:
+            raise RequestError('no data directory, "rows" are required')
+        numbers = request['row_numbers']
+        if not isinstance(numbers, list) or not numbers or \
+                not all(type(n) is int for n in numbers):
+            raise RequestError('"row_numbers" must be a non empty list of '
+                               'integers')
+        if not isinstance(request.get('file'), str):
+            raise RequestError('"file" is required with "row_numbers"')
+        file_loc = os.path.realpath(os.path.join(self.data_dir,
+                                                 request['file']))
+        if os.path.commonpath([file_loc, self.data_dir]) != self.data_dir \
+                or not os.path.isfile(file_loc) or \
+                not rowindex.indexable(file_loc):
+            raise RequestError('no CSV dataset "%s" in the data directory'
+                               % request['file'])
+        index = rowindex.load_row_index(file_loc)
+        try:
+            data = forest.pd.concat(
+                [rowindex.read_rows(file_loc, n, n + 1, utils.RAW_COLUMNS,
+                                    index) for n in numbers],
+                ignore_index=True)
+        except IndexError:
+            raise RequestError('row numbers out of range, "%s" has %d rows'
+                               % (request['file'],
+                                  len(rowindex.row_offsets(index)) - 1))
+        if 'speech' not in data.columns:
+            raise RequestError('"%s" has no "speech" column'
+                               % request['file'])
+        speakers = data['speaker'] if 'speaker' in data.columns else ''
+        return forest.pd.DataFrame(
+            {'speaker': forest.pd.Series(speakers, index=data.index)
+             .fillna('').astype(str),
+             'speech': data['speech'].fillna('').astype(str)})
+
+    def health(self):
+        return {'status': 'ok', 'uptime': time.time() - self.started,
+                'models': [{'tag': tag, 'indicator': indic}
+                           for tag, indic in self.batchers]}
+
+    def metrics(self):
+        return {'uptime': time.time() - self.started,
+                'models': [dict(tag=tag, indicator=indic,
+                                **batcher.metrics.report())
+                           for (tag, indic), batcher in self.batchers.items()]}
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler of the daemon endpoints."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, self.server.service.health())
+        elif self.path == '/metrics':
+            self.send_json(200, self.server.service.metrics())
+        else:
+            self.send_json(404, {'error': 'unknown endpoint'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json(404, {'error': 'unknown endpoint'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_BODY:
+                raise RequestError('request body too large')
+            try:
+                request = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                raise RequestError('invalid JSON body')
+            response = self.server.service.predict(request)
+        except RequestError as err:
+            self.send_json(400, {'error': str(err)})
+        except Exception as err:
+            self.send_json(500, {'error': repr(err)})
+        else:
+            self.send_json(200, response)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return self.server.server_address
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class DaemonHTTPServer(ThreadingHTTPServer):
+    """HTTP server listening on a local port."""
+
+    # Concurrent dashboard requests overflow the default backlog of 5
+    request_queue_size = 128
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    """HTTP server listening on a Unix socket."""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def serve(models, store_type, host='127.0.0.1', port=8150, socket_path=None,
+          max_batch=256, batch_wait=10, dense=False, data_dir=None,
+          verbose=True):
+    """Load the models and serve predictions until interrupted.
+
+    Arguments:
+        models {list} -- (tag, indicator, file name) tuple of each model.
+        store_type {str} -- method used to store the model files.
+
+    Keyword Arguments:
+        host {str} -- address the HTTP server listens on.
+            (default: {'127.0.0.1'})
+        port {int} -- port the HTTP server listens on. (default: {8150})
+        socket_path {str} -- Unix socket to listen on instead of a port.
+            (default: {None})
+        max_batch {int} -- maximum number of rows labelled in one batch.
+            (default: {256})
+        batch_wait {float} -- milliseconds to wait for more requests after
+            the first one of a batch. (default: {10})
+        dense {bool} -- use dense feature arrays. (default: {False})
+        data_dir {str} -- directory of the CSV datasets whose rows can be
+            requested by number. (default: {None})
+        verbose {bool} -- print process messages and requests.
+            (default: {True})
+    """
+
+    service = PredictionService(models, store_type, max_batch,
+                                batch_wait / 1000, dense, data_dir, verbose)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, DaemonRequestHandler)
+        address = socket_path
+    else:
+        server = DaemonHTTPServer((host, port), DaemonRequestHandler)
+        address = 'http://%s:%d' % server.server_address[:2]
+    server.service = service
+    server.verbose = verbose
+    print('Serving %d models on %s' % (len(service.batchers), address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Daemon stopped.')
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,358 @@
+#!/usr/local/bin/python3
+"""Module: DelibAnalysis Feature Registry
+
+Declarations of the columns computed from the speeches. Each feature names
+its input columns, its relative cost and the function computing it, and the
+features used by the classifiers (the quantitative feature block) are
+flagged as model features. Datasets are enriched with compute_features, which
+only computes the requested features and the ones they depend on.
+
+Each feature also declares the compact type its columns are stored with
+when datasets are imported with compact types, see utils.compact_frame.
+
+A new feature is added by declaring it in default_features, or by passing
+it to register. Marking it as a model feature includes it in the models
+trained afterwards, as each model records the model features it was trained
+with.
+
+Package: DelibAnalysis
+Version: 2.0
+Authors: Eleonore Fournier-Tombs and Curtis Hendricks
+Source: https://github.com/eleonoreft/DelibAnalysis
+Copyright: Attribution-NonCommercial-ShareAlike CC BY-NC-SA
+https://creativecommons.org/licenses/by-nc-sa/4.0/
+Contact: eleonore.fournier-tombs@mail.mcgill.ca
+
+"""
+
+import numpy as np
+import delib_ana_utils as utils
+
+# Registered features, by name, in registration order. Use registry() to
+# access them, the default features are registered on first use as they
+# need the utilities module to be fully imported.
+FEATURES = {}
+
+# Model features of the models stored before the features were recorded
+LEGACY_MODEL_FEATURES = ['char_count', 'has_respect', 'has_question',
+                         'has_question_parent']
+
+# Text column transformed by the vectorizers of every model
+TEXT_FEATURE = 'cleaned_comment'
+
+
+class Feature:
+    """Declaration of a computed feature.
+
+    Arguments:
+        name {str} -- name of the feature, and of its column unless columns
+            is given.
+        inputs {list} -- dataset columns or features the feature is computed
+            from, passed in order to compute.
+        compute {function} -- called with the input columns and a context
+            dictionary ("workers", "prev_question"), returns the feature
+            column or a dictionary of columns.
+
+    Keyword Arguments:
+        cost {float} -- relative cost per row, 1 being a simple string
+            operation. (default: {1})
+        dtype {type} -- type of the column in the model feature block.
+            (default: {None})
+        model {bool} -- used by the classifiers. (default: {False})
+        columns {list} -- names of the columns computed, when there are more
+            than one. (default: {None})
+        compact {type} -- type of the columns in compact datasets, e.g.
+            np.int8 for binary flags or 'category' for labels with few
+            distinct values. Kept as computed if None. (default: {None})
+    """
+
+    def __init__(self, name, inputs, compute, cost=1, dtype=None, model=False,
+                 columns=None, compact=None):
+        self.name = name
+        self.inputs = inputs
+        self.compute = compute
+        self.cost = cost
+        self.dtype = dtype
+        self.model = model
+        self.columns = columns if columns is not None else [name]
+        self.compact = compact
+
+    def __repr__(self):
+        return 'Feature(%s <- %s, cost %g)' % (self.name,
+                                               ', '.join(self.inputs),
+                                               self.cost)
+
+
+def registry():
+    """Returns the registered features, by name.
+
+    Returns:
+        dict -- Feature object of each feature name.
+    """
+
+    if not FEATURES:
+        for feature in default_features():
+            FEATURES[feature.name] = feature
+    return FEATURES
+
+
+def register(feature):
+    """Add a feature to the registry.
+
+    Arguments:
+        feature {Feature} -- feature declaration.
+    """
+
+    registry()[feature.name] = feature
+
+
+def model_features():
+    """Returns the names of the model features, in registration order."""
+
+    return [name for name, feat in registry().items() if feat.model]
+
+
+def model_dtypes(names):
+    """Returns the model feature block type of each feature.
+
+    Arguments:
+        names {list} -- feature names.
+
+    Returns:
+        dict -- type of each feature declaring one.
+    """
+
+    features = registry()
+    return {name: features[name].dtype for name in names
+            if features[name].dtype is not None}
+
+
+def compact_dtypes():
+    """Returns the compact type of each feature column declaring one.
+
+    Returns:
+        dict -- type of each column.
+    """
+
+    return {column: feat.compact for feat in registry().values()
+            if feat.compact is not None for column in feat.columns}
+
+
+def plan(names):
+    """Returns the features to compute, dependencies first.
+
+    Arguments:
+        names {list} -- requested feature names.
+
+    Returns:
+        list -- Feature objects in computation order.
+    """
+
+    features = registry()
+    ordered = []
+    visiting = set()
+
+    def visit(name):
+        # Inputs that are not features are columns of the dataset
+        if name not in features or features[name] in ordered:
+            return
+        if name in visiting:
+            raise ValueError('circular feature dependency on "%s"' % name)
+        visiting.add(name)
+        for input_name in features[name].inputs:
+            visit(input_name)
+        visiting.discard(name)
+        ordered.append(features[name])
+
+    for name in names:
+        if name not in features:
+            raise KeyError('unknown feature "%s"' % name)
+        visit(name)
+    return ordered
+
+
+def plan_cost(names):
+    """Returns the relative cost per row of computing features.
+
+    Arguments:
+        names {list} -- requested feature names.
+
+    Returns:
+        float -- sum of the costs of the features and their dependencies.
+    """
+
+    return sum(feat.cost for feat in plan(names))
+
+
+def compute_features(data, names, workers=1, prev_question=0):
+    """Add the requested feature columns to a dataset.
+
+    Only the requested features and the features they depend on are
+    computed. The columns of the requested features are added in the
+    requested order, intermediate features are not kept.
+
+    Arguments:
+        data {DataFrame} -- dataset with the raw columns.
+        names {list} -- requested feature names.
+
+    Keyword Arguments:
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        prev_question {int} -- has_question value of the row preceding the
+            data, when it is a chunk of a larger dataset. (default: {0})
+
+    Returns:
+        DataFrame -- the dataset with the feature columns.
+    """
+
+    context = {'workers': workers, 'prev_question': prev_question}
+    computed = {}
+    for feat in plan(names):
+        args = [computed[i] if i in computed else data[i]
+                for i in feat.inputs]
+        values = feat.compute(*args, context)
+        if not isinstance(values, dict):
+            values = {feat.name: values}
+        computed.update(values)
+
+    features = registry()
+    for name in names:
+        for column in features[name].columns:
+            data[column] = computed[column]
+    return data
+
+
+def compute_char_buckets(char_count, context):
+    return {k: ((char_count <= v[0]) & (char_count > v[1])).astype(np.int64)
+            for k, v in utils.char_dict.items()}
+
+
+def compute_parent(has_question, context):
+    return utils.add_column_parent(
+        has_question, utils.change_to_binary(context['prev_question']))
+
+
+def default_features():
+    """Returns the declarations of the DelibAnalysis features.
+
+    The model features are listed in the order of the feature block.
+
+    Returns:
+        list -- Feature objects.
+    """
+
+    return [
+        Feature('cleaned_comment', ['speech'],
+                lambda speech, context: utils.clean_column(speech), cost=5),
+        Feature('pos', ['speech', 'cleaned_comment'],
+                lambda speech, cleaned, context: utils.text_columns(
+                    speech, context['workers'], cleaned)[1], cost=500),
+        Feature('char_count', ['cleaned_comment'],
+                lambda cleaned, context: cleaned.str.len().astype(np.int64),
+                dtype=np.float32, model=True, compact=np.int32),
+        Feature('has_respect', ['speech'],
+                lambda speech, context: utils.respect_column(speech),
+                cost=2, dtype=np.int8, model=True, compact=np.int8),
+        Feature('has_question', ['speech'],
+                lambda speech, context: utils.question_column(speech),
+                dtype=np.int8, model=True, compact=np.int8),
+        Feature('has_question_parent', ['has_question'], compute_parent,
+                dtype=np.int8, model=True, compact=np.int8),
+        Feature('char_buckets', ['char_count'], compute_char_buckets,
+                columns=list(utils.char_dict), compact=np.int8),
+        Feature('gender', ['speaker'],
+                lambda speaker, context: utils.gender_column(speaker),
+                compact='category'),
+        Feature('indicator_columns', [],
+                lambda context: {i: '' for i in utils.INDICATORS},
+                columns=list(dict.fromkeys(utils.INDICATORS)),
+                compact='category'),
+    ]
+
+
+# Features added by the imports when no feature list is given
+LABEL_FEATURES = ['cleaned_comment', 'char_count', 'char_buckets',
+                  'has_question', 'has_respect', 'pos', 'has_question_parent']
+UNLABELLED_FEATURES = ['cleaned_comment', 'char_count', 'char_buckets',
+                       'has_respect', 'has_question', 'has_question_parent',
+                       'gender', 'pos', 'indicator_columns']
+
+
+def model_feature_names(vecs):
+    """Returns the model features a model was trained with.
+
+    Arguments:
+        vecs {dict} -- vectorizers of the model.
+
+    Returns:
+        list -- model feature names, in feature block order.
+    """
+
+    return vecs.get('features', LEGACY_MODEL_FEATURES)
+
+
+def describe_plan(names):
+    """Returns a description of the features computed for a request.
+
+    Arguments:
+        names {list} -- requested feature names.
+
+    Returns:
+        str -- features computed and their relative cost, compared with the
+            cost of all the registered features.
+    """
+
+    steps = plan(names)
+    return 'Computing features: %s (relative cost %g of %g).' % (
+        ', '.join(feat.name for feat in steps),
+        sum(feat.cost for feat in steps), plan_cost(list(registry())))
+
+
+def required_features(vecs, extra=None):
+    """Returns the features needed to predict with a model.
+
+    Arguments:
+        vecs {dict} -- vectorizers of the model, or list of the vectorizers
+            of several models.
+
+    Keyword Arguments:
+        extra {list} -- additional features wanted in the output.
+            (default: {None})
+
+    Returns:
+        list -- feature names, without duplicates. The features of the
+            unlabelled dataset imports come first, in the same order.
+    """
+
+    if isinstance(vecs, dict):
+        vecs = [vecs]
+    names = [TEXT_FEATURE]
+    for model_vecs in vecs:
+        names += model_feature_names(model_vecs)
+    names += list(extra or [])
+    names = list(dict.fromkeys(names))
+    order = {name: i for i, name in enumerate(UNLABELLED_FEATURES)}
+    return sorted(names, key=lambda name: order.get(name, len(order)))
+
+
+def drop_intermediate(data, extra=None, columns=None):
+    """Drop the text columns only computed to be vectorized.
+
+    Used once a compact dataset has been predicted, so the cleaned text isn't
+    kept alive along with the speeches.
+
+    Arguments:
+        data {DataFrame} -- predicted dataset.
+
+    Keyword Arguments:
+        extra {list} -- extra features requested, kept. (default: {None})
+        columns {list} -- output columns requested, kept. (default: {None})
+
+    Returns:
+        DataFrame -- the dataset without the intermediate columns.
+    """
+
+    keep = set(extra or []) | set(columns or [])
+    if TEXT_FEATURE in keep or TEXT_FEATURE not in data.columns:
+        return data
+    return data.drop(columns=[TEXT_FEATURE])
@@ -21,30 +21,76 @@ from sklearn.metrics import classification_report
 
 import pandas as pd
 import numpy as np
+import delib_ana_features as features
 import delib_ana_utils as utils
 
-QUANTITATIVE_FEATURES = ['char_count', 'has_respect', 'has_question',
-                         'has_question_parent']
+from scipy import sparse
+
+QUANTITATIVE_FEATURES = features.model_features()
+
+# Storage type of each quantitative feature in the feature block. The trees
+# work in float32 internally so these types do not change the predictions.
+QUANTITATIVE_DTYPES = features.model_dtypes(QUANTITATIVE_FEATURES)
 
 # TODO: Write module to test model by accessing features
 
 
-def get_feats(data, combo_vec):
+def get_feats(data, combo_vec, dense=False, feature_names=None,
+              text_feats=None):
     """Get list of indication features
 
+    The text features produced by the vectorizers are kept in sparse CSR
+    format and the quantitative features are attached as a single typed block
+    of extra columns. The dense layout is only built when explicitly
+    requested, as it needs roughly 80 KB per row with the default 5000 feature
+    vectorizers.
+
     Arguments:
         data {DataFrame} -- training dataset
         combo_vec {TfidfVectorizer} -- Combo of 2 and 3-grams vectorizers
-        q_features {list} -- quantitative features
+
+    Keyword Arguments:
+        dense {bool} -- return a dense numpy array instead of a sparse matrix
+            (default: {False})
+        feature_names {list} -- quantitative features of the model, see
+            features.model_feature_names. (default: {QUANTITATIVE_FEATURES})
+        text_feats {csr_matrix} -- text features already computed by
+            combo_vec, e.g. by cache.stored_text_feats. (default: {None})
+
+    Returns:
+        [csr_matrix] -- 2d sparse matrix of features (2d numpy array if dense)
+    """
+
+    if feature_names is None:
+        feature_names = QUANTITATIVE_FEATURES
+    if text_feats is None:
+        raw = combo_vec.transform(data["cleaned_comment"])
+    else:
+        raw = text_feats
+    q_block = utils.feature_block(data, feature_names,
+                                  features.model_dtypes(feature_names))
+    return attach_feature_block(raw, q_block, dense)
+
+
+def attach_feature_block(text_feats, q_block, dense=False):
+    """Attach the quantitative feature block to the text features.
+
+    Arguments:
+        text_feats {csr_matrix} -- sparse text features from the vectorizers.
+        q_block {nparray} -- 2d array of quantitative features.
+
+    Keyword Arguments:
+        dense {bool} -- return a dense numpy array instead of a sparse matrix
+            (default: {False})
 
     Returns:
-        [nparray] -- 2d numpy arrary of features
+        [csr_matrix] -- 2d sparse matrix of features (2d numpy array if dense)
     """
 
-    raw = combo_vec.transform(data["cleaned_comment"])
-    feats = raw.toarray()
-    for f in QUANTITATIVE_FEATURES:
-        feats = utils.append_features(feats, data[f].to_numpy())
+    feats = sparse.hstack([text_feats, sparse.csr_matrix(q_block)],
+                          format='csr')
+    if dense:
+        return feats.toarray()
     return feats
 
 
@@ -52,7 +98,7 @@ def f_class_train(feats, data, indicator):
     """Train a random forest classifier model.
 
     Arguments:
-        feats {nparray} -- numpy array of features
+        feats {csr_matrix} -- sparse matrix (or numpy array) of features
         data {dataframe} -- training dataset
         indicator {str} -- indicator to train the model on
 
@@ -65,10 +111,14 @@ def f_class_train(feats, data, indicator):
                                           warm_start=True,
                                           bootstrap=True)
     y, _ = pd.factorize(data[indicator])
+    if sparse.issparse(feats):
+        # Tree building works column-wise on sparse input
+        feats = feats.tocsc()
     return f_classifier.fit(feats, y)
 
 
-def f_class_predict(data, indic, combo_vec, f_classifier):
+def f_class_predict(data, indic, combo_vec, f_classifier, dense=False,
+                    feature_names=None, text_feats=None):
     """
     Use a trained RandomForestClassifier to predict the disired field in an
     unlabelled dataset
@@ -81,20 +131,29 @@ def f_class_predict(data, indic, combo_vec, f_classifier):
         f_classifier {RandomForestClassifier} -- trained random forest
         classifier
 
+    Keyword Arguments:
+        dense {bool} -- use dense feature arrays (default: {False})
+        feature_names {list} -- quantitative features of the model
+            (default: {QUANTITATIVE_FEATURES})
+        text_feats {csr_matrix} -- text features already computed by
+            combo_vec (default: {None})
+
     Returns:
         DataFrame -- Labelled data set
     """
 
-    test_inidicator_feats = get_feats(data, combo_vec)
+    test_inidicator_feats = get_feats(data, combo_vec, dense, feature_names,
+                                      text_feats)
 
     labels = f_classifier.predict(test_inidicator_feats)
-    labelled = data.drop(columns=['Unnamed: 0'])
+    labelled = data.drop(columns=['Unnamed: 0'], errors='ignore')
     labelled[indic] = labels
 
     return labelled
 
 
-def f_class_predict_compare(data, combo_vec, f_classifier, indicator):
+def f_class_predict_compare(data, combo_vec, f_classifier, indicator,
+                            dense=False, feature_names=None):
     """
     Used to test the accuracy of a trained RandomForestClassifier by using a
     test dataset where the target field values are known. The known and
@@ -108,11 +167,16 @@ def f_class_predict_compare(data, combo_vec, f_classifier, indicator):
         classifier
         indicator {str} -- name of the target field/property
 
+    Keyword Arguments:
+        dense {bool} -- use dense feature arrays (default: {False})
+        feature_names {list} -- quantitative features of the model
+            (default: {QUANTITATIVE_FEATURES})
+
     Returns:
         DataFrame -- Dataset with actual and predicted target field included.
     """
 
-    test_inidicator_feats = get_feats(data, combo_vec)
+    test_inidicator_feats = get_feats(data, combo_vec, dense, feature_names)
 
     labelled = f_classifier.predict(test_inidicator_feats)
     compare = pd.DataFrame(data={
@@ -123,7 +187,7 @@ def f_class_predict_compare(data, combo_vec, f_classifier, indicator):
     return compare
 
 
-def make_vectorizers(data_source, vocab=None):
+def make_vectorizers(data_source, vocab=None, return_feats=False):
     """Create vectorizers based on datasource
 
     Arguments:
@@ -132,6 +196,8 @@ def make_vectorizers(data_source, vocab=None):
     Keyword Arguments:
         vocab {list} -- vocabulary list to be included in the vectorizer
         (default: {None})
+        return_feats {bool} -- also return the text features of the training
+            dataset, as vec_combo would transform them. (default: {False})
 
     Returns:
         dictionary -- dictionary containing created vectorizers
@@ -139,6 +205,9 @@ def make_vectorizers(data_source, vocab=None):
                       key: vec_pos -- positional vectorizer
                       key: vec_combo -- combined vec_word and vec_pos
                       vectorizer
+                      key: features -- quantitative features of the model
+        The text features are returned as a second item if return_feats is
+        set.
     """
 
     param_dict = {'use_idf': True, 'analyzer': 'word', 'ngram_range': (1, 2),
@@ -149,19 +218,53 @@ def make_vectorizers(data_source, vocab=None):
     # vec_word = TfidfVectorizer(use_idf=True, analyzer='word',
     #                            ngram_range=(1, 2), max_features=5000,
     #                            vocabulary=vocab)
-    vec_word.fit_transform(data_source["cleaned_comment"])
+    word_feats = vec_word.fit_transform(data_source["cleaned_comment"])
     vec_pos = TfidfVectorizer(use_idf=True,
                               analyzer='word',
                               ngram_range=(1, 3),
                               max_features=5000)
-    vec_pos.fit_transform(data_source["pos"])
+    vec_pos.fit(data_source["pos"])
 
     vec_combo = FeatureUnion([('tfidf', vec_word), ('pos', vec_pos)])
 
-    return {'vec_word': vec_word, 'vec_pos': vec_pos, 'vec_combo': vec_combo}
+    vecs = {'vec_word': vec_word, 'vec_pos': vec_pos, 'vec_combo': vec_combo,
+            'features': list(QUANTITATIVE_FEATURES)}
+    if not return_feats:
+        return vecs
+    # vec_combo applies both vectorizers to the cleaned comments, so only the
+    # vec_word output of the fit can be reused
+    pos_feats = vec_pos.transform(data_source["cleaned_comment"])
+    return vecs, sparse.hstack([word_feats, pos_feats], format='csr')
+
 
+def make_training_feats(data_source, vocab=None, dense=False):
+    """Create the vectorizers and the features of a training dataset.
 
-def get_top_params(classifier, vec_combo, qty):
+    Gives the same features as get_feats on the vectorizers returned by
+    make_vectorizers, but the comments are only tokenized once by the word
+    vectorizer.
+
+    Arguments:
+        data_source {DataFrame} -- training dataset
+
+    Keyword Arguments:
+        vocab {list} -- vocabulary list to be included in the vectorizer
+            (default: {None})
+        dense {bool} -- return a dense numpy array instead of a sparse matrix
+            (default: {False})
+
+    Returns:
+        [tuple] -- dictionary of vectorizers, see make_vectorizers, and 2d
+            sparse matrix of features (2d numpy array if dense)
+    """
+
+    vecs, text_feats = make_vectorizers(data_source, vocab, return_feats=True)
+    q_block = utils.feature_block(data_source, vecs['features'],
+                                  features.model_dtypes(vecs['features']))
+    return vecs, attach_feature_block(text_feats, q_block, dense)
+
+
+def get_top_params(classifier, vec_combo, qty, feature_names=None):
     """
     Get an ordered list of the highest rated parameter from most to least
     important.
@@ -172,6 +275,10 @@ def get_top_params(classifier, vec_combo, qty):
         feats {list} -- list of quantitative features
         qty {int} -- the number of features to return
 
+    Keyword Arguments:
+        feature_names {list} -- quantitative features of the model
+            (default: {QUANTITATIVE_FEATURES})
+
     Returns:
         Dataframe -- dataframe containing the order list of features
     """
@@ -179,7 +286,7 @@ def get_top_params(classifier, vec_combo, qty):
     importances = classifier.feature_importances_
     indices = np.argsort(importances)[::-1]
     vocab = vec_combo.get_feature_names()
-    for i in QUANTITATIVE_FEATURES:
+    for i in feature_names or QUANTITATIVE_FEATURES:
         vocab.append(i)
     feat_ordered_df = pd.DataFrame(data=None,
                                    columns=['Feature name', 'Importance'])
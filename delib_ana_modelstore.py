@@ -3,9 +3,11 @@
 
 DelibAnalysis functions to store and load the trained Random Forest Classifier
 models to enable resue. Vectorizers are also stored and optionally the training
-data can also be stored. Two mehtods are implemented: Serialization and
-deserialization using Python built-in pickle module, and Sci-kit Learn joblib
-module.
+data can also be stored. Three mehtods are implemented: Serialization and
+deserialization using Python built-in pickle module, Sci-kit Learn joblib
+module, and a memory mapped joblib file where the trees of the forest are
+stored as flat arrays, mapped in place when loaded and turned back into trees
+on first use.
 
 Package: DelibAnalysis
 Version: 2.0
@@ -17,15 +19,18 @@ Contact: eleonore.fournier-tombs@mail.mcgill.ca
 
 """
 
+import copy
 import pickle
+import numpy as np
 from sklearn.externals import joblib
+from sklearn.feature_extraction.text import TfidfTransformer
 from delib_ana_utils import curr_dte_txt
 
 # TODO: add checks for file overwriting
 
 
 def pickling(model, vectorizer, indic, train_data=None, tag='', name='',
-             verbose=True):
+             verbose=True, lean=False):
     """Store the model using Python's Pickle module.
 
     'Pickle' the model and vectorizer, and optionally training data, and stores
@@ -43,6 +48,8 @@ def pickling(model, vectorizer, indic, train_data=None, tag='', name='',
             model. (default: {None})
         name {str} -- prefix to be used for file name. (default: {''})
         verbose {bool} -- print process messages. (default: {True})
+        lean {bool} -- store a lean export of the model, see lean_export.
+            (default: {False})
     """
 
     suffix = '-' + indic + '_pickle_model.pkl'
@@ -54,6 +61,8 @@ def pickling(model, vectorizer, indic, train_data=None, tag='', name='',
     if tag:
         outfile = tag + '-' + outfile
 
+    if lean:
+        model, vectorizer = lean_export(model, vectorizer)
     data_dict = {'model': model, 'vectorizer': vectorizer,
                  'training': train_data}
 
@@ -85,6 +94,7 @@ def unpickle(pkl_file, verbose=True):
 
     with open(pkl_file, 'rb') as f:
         data_dict = pickle._load(f)
+    restore_vectorizers(data_dict['vectorizer'])
 
     if verbose:
         print('Model and vectorizer created from file,', pkl_file, '.')
@@ -98,7 +108,7 @@ def unpickle(pkl_file, verbose=True):
 
 
 def joblib_store(model, vectorizer, indic, train_data=None, tag='', name='',
-                 verbose=True):
+                 verbose=True, lean=False, compress=0):
     """Store the model using Sci-Kit Learn's JobLib module.
 
     Stores the model and vectorizers, and optionally the  training data, in the
@@ -116,6 +126,10 @@ def joblib_store(model, vectorizer, indic, train_data=None, tag='', name='',
             model. (default: {None})
         name {str} -- prefix to be used for file name. (default: {''})
         verbose {bool} -- print process messages. (default: {False})
+        lean {bool} -- store a lean export of the model, see lean_export.
+            (default: {False})
+        compress {int} -- compression level of the file, from 0 (no
+            compression) to 9. (default: {0})
     """
 
     suffix = '-' + indic + '_joblib_model.pkl'
@@ -127,10 +141,12 @@ def joblib_store(model, vectorizer, indic, train_data=None, tag='', name='',
     if tag:
         outfile = tag + '-' + outfile
 
+    if lean:
+        model, vectorizer = lean_export(model, vectorizer)
     data_dict = {'model': model, 'vectorizer': vectorizer,
                  'training': train_data}
 
-    joblib.dump(data_dict, outfile)
+    joblib.dump(data_dict, outfile, compress=compress)
 
     if verbose:
         print('Model and vectorizers added to', outfile, '.')
@@ -138,7 +154,26 @@ def joblib_store(model, vectorizer, indic, train_data=None, tag='', name='',
             print('Training data added to file', outfile, '.')
 
 
-def joblib_retrieve(job_file, verbose=True):
+def joblib_share(model, vectorizer, share_file):
+    """Store the model for memory mapped loading by worker processes.
+
+    Arrays are stored uncompressed so joblib_retrieve can map them from the
+    file instead of reading them in. Only the arrays used in place, such as
+    the IDF vectors, are then shared by concurrent processes through the page
+    cache: scikit-learn copies the nodes of each tree of a forest into the
+    memory of the process loading it.
+
+    Arguments:
+        model {model object} -- model to be shared
+        vectorizer {nparray} -- vectorizers created from the training data.
+        share_file {str} -- name of the file to be created.
+    """
+
+    data_dict = {'model': model, 'vectorizer': vectorizer, 'training': None}
+    joblib.dump(data_dict, share_file)
+
+
+def joblib_retrieve(job_file, verbose=True, mmap_mode=None):
     """Retrieves model stored using Sci-kit Learn's Joblib module.
 
     Unpacks the model and optionally other data from file storage and
@@ -149,13 +184,16 @@ def joblib_retrieve(job_file, verbose=True):
 
     Keyword Arguments:
         verbose {bool} -- print process messages. (default: {True})
+        mmap_mode {str} -- memory map the arrays of an uncompressed file
+            using this mode, e.g. 'r'. (default: {None})
 
     Returns:
         [tuple] -- three item tuple containg the model object, vectorizers and
             training data is present (None otherwise).
     """
 
-    data_dict = joblib.load(job_file)
+    data_dict = joblib.load(job_file, mmap_mode=mmap_mode)
+    restore_vectorizers(data_dict['vectorizer'])
 
     if verbose:
         print('Model and vectorizers created from file,', job_file, '.')
@@ -166,3 +204,249 @@ def joblib_retrieve(job_file, verbose=True):
         print('training data.')
 
     return (data_dict['model'], data_dict['vectorizer'], data_dict['training'])
+
+
+class MappedForest:
+    """Random forest classifier stored as flat, memory mappable arrays.
+
+    The nodes of all the trees of a trained RandomForestClassifier are stored
+    in a few flat numpy arrays, in the node format of scikit-learn, with a
+    copy of the classifier without its trees. Loaded with
+    joblib_retrieve(mmap_mode='r'), the arrays are mapped from the file in
+    milliseconds instead of being unpickled tree by tree.
+
+    The trees are rebuilt from the arrays the first time the process uses
+    the model, and predictions are made by the rebuilt RandomForestClassifier,
+    so they are identical to the ones of the original forest and as fast.
+    Rebuilding a tree copies its nodes into process memory: processes forked
+    once the trees are built share them copy on write, see forest().
+    """
+
+    def __init__(self, classifier):
+        skeleton = copy.copy(classifier)
+        skeleton.estimators_ = [copy.copy(est)
+                                for est in classifier.estimators_]
+        nodes, values = [], []
+        self.trees = []
+        for est in skeleton.estimators_:
+            tree_class, args, state = est.tree_.__reduce__()
+            self.trees.append((args, state['max_depth'],
+                               state['node_count']))
+            nodes.append(state['nodes'])
+            values.append(state['values'])
+            del est.tree_
+        self.tree_class = tree_class
+        self.skeleton = skeleton
+        self.nodes = np.concatenate(nodes)
+        self.values = np.concatenate(values)
+        self.classes_ = classifier.classes_
+        self.n_features_in_ = classifier.n_features_in_
+        self.n_jobs = classifier.n_jobs
+        self._forest = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The rebuilt trees are never stored, only the flat arrays
+        state['_forest'] = None
+        return state
+
+    def forest(self):
+        """Returns the RandomForestClassifier rebuilt from the node arrays.
+
+        The trees are rebuilt once per process, on first use.
+
+        Returns:
+            RandomForestClassifier -- the original forest.
+        """
+
+        if self._forest is None:
+            forest = copy.deepcopy(self.skeleton)
+            start = 0
+            for est, (args, max_depth, node_count) in zip(forest.estimators_,
+                                                          self.trees):
+                tree = self.tree_class(*args)
+                tree.__setstate__({
+                    'max_depth': max_depth, 'node_count': node_count,
+                    'nodes': self.nodes[start:start + node_count],
+                    'values': self.values[start:start + node_count]})
+                est.tree_ = tree
+                start += node_count
+            self._forest = forest
+        self._forest.n_jobs = self.n_jobs
+        return self._forest
+
+    def apply(self, X):
+        """Returns the index of the leaf reached by each sample in each tree.
+
+        Arguments:
+            X {csr_matrix} -- 2d sparse matrix (or numpy array) of features.
+
+        Returns:
+            nparray -- 2d array of node indexes, one column per tree.
+        """
+
+        return self.forest().apply(X)
+
+    def predict_proba(self, X):
+        """Returns the class probabilities of each sample.
+
+        Arguments:
+            X {csr_matrix} -- 2d sparse matrix (or numpy array) of features.
+
+        Returns:
+            nparray -- 2d array of probabilities, one column per class.
+        """
+
+        return self.forest().predict_proba(X)
+
+    def predict(self, X):
+        """Returns the predicted class of each sample.
+
+        Arguments:
+            X {csr_matrix} -- 2d sparse matrix (or numpy array) of features.
+
+        Returns:
+            nparray -- predicted classes.
+        """
+
+        return self.forest().predict(X)
+
+
+def mapped_forest(model):
+    """Convert a model, or a dictionary of models, to MappedForest.
+
+    Arguments:
+        model {model object} -- trained RandomForestClassifier, or dictionary
+            of them keyed by indicator for model bundles.
+
+    Returns:
+        [MappedForest] -- converted model (or dictionary of them).
+    """
+
+    if isinstance(model, dict):
+        return {key: mapped_forest(clf) for key, clf in model.items()}
+    if isinstance(model, MappedForest):
+        return model
+    return MappedForest(model)
+
+
+def lean_export(model, vectorizer, compact_idf=True):
+    """Returns a compact version of a model and its vectorizers.
+
+    Attributes only needed for training are dropped: the vectorizers lose
+    their "stop_words_" attribute, which holds every term pruned by
+    max_features. The IDF vectors are stored as their distinct values and an
+    index into them, which restore_vectorizers expands back to the exact same
+    values. The forest is kept as it is, scikit-learn only predicts from
+    trees with float64 thresholds. The lean export gives the same predictions
+    as the original model, at the same speed.
+
+    Arguments:
+        model {model object} -- trained RandomForestClassifier, or dictionary
+            of them keyed by indicator for model bundles.
+        vectorizer {dict} -- vectorizers created from the training data.
+
+    Keyword Arguments:
+        compact_idf {bool} -- store the IDF vectors in compact form.
+            (default: {True})
+
+    Returns:
+        [tuple] -- the model and a lean copy of the vectorizers.
+    """
+
+    vectorizer = copy.deepcopy(vectorizer)
+    idf_codes = {}
+    for key in ['vec_word', 'vec_pos']:
+        vec = vectorizer[key]
+        if hasattr(vec, 'stop_words_'):
+            del vec.stop_words_
+        if compact_idf and vec.use_idf:
+            uniques, codes = np.unique(vec.idf_, return_inverse=True)
+            code_type = np.uint16 if len(uniques) < 2 ** 16 else np.uint32
+            idf_codes[key] = (uniques, codes.astype(code_type))
+            vec._tfidf = TfidfTransformer(norm=vec.norm, use_idf=vec.use_idf,
+                                          smooth_idf=vec.smooth_idf,
+                                          sublinear_tf=vec.sublinear_tf)
+    if idf_codes:
+        vectorizer['idf_codes'] = idf_codes
+    return model, vectorizer
+
+
+def restore_vectorizers(vectorizer):
+    """Expand the compact IDF vectors of a lean export, in place.
+
+    Arguments:
+        vectorizer {dict} -- vectorizers retrieved from a model file.
+    """
+
+    idf_codes = vectorizer.pop('idf_codes', {})
+    for key, (uniques, codes) in idf_codes.items():
+        vectorizer[key]._tfidf.idf_ = uniques[codes]
+
+
+def mmap_store(model, vectorizer, indic, train_data=None, tag='', name='',
+               verbose=True, lean=False):
+    """Store the model in a memory mappable file.
+
+    The trees of the model are converted to a MappedForest, and everything is
+    stored uncompressed with Sci-Kit Learn's JobLib module. Filename will have
+    suffix "_mmap_model.pkl". Prefix is either the name provided or the
+    current date [YYYY-MM-DD].
+
+    Arguments:
+        model {model object} -- model to be stored, or dictionary of models
+            keyed by indicator for model bundles.
+        vectorizer {nparray} -- vectorizers created from the training data.
+        indic {str} -- name fo the indicator.
+
+    Keyword Arguments:
+        train_data {DataFrame} -- training data used to create vectorizers and
+            model. (default: {None})
+        name {str} -- prefix to be used for file name. (default: {''})
+        verbose {bool} -- print process messages. (default: {True})
+        lean {bool} -- strip the vectorizers, see lean_export.
+            (default: {False})
+    """
+
+    suffix = '-' + indic + '_mmap_model.pkl'
+    if name:
+        outfile = name + suffix
+    else:
+        outfile = curr_dte_txt(1) + suffix
+
+    if tag:
+        outfile = tag + '-' + outfile
+
+    if lean:
+        # The IDF vectors are kept as they are to remain memory mapped
+        model, vectorizer = lean_export(model, vectorizer, compact_idf=False)
+    model = mapped_forest(model)
+    data_dict = {'model': model, 'vectorizer': vectorizer,
+                 'training': train_data}
+
+    joblib.dump(data_dict, outfile)
+
+    if verbose:
+        print('Memory mappable model and vectorizers added to', outfile, '.')
+        if train_data:
+            print('Training data added to file', outfile, '.')
+
+
+def mmap_retrieve(mmap_file, verbose=True):
+    """Retrieves a model stored with mmap_store.
+
+    The arrays of the model and vectorizers are memory mapped from the file
+    rather than read in.
+
+    Arguments:
+        mmap_file {string} -- name of the file with the stored object.
+
+    Keyword Arguments:
+        verbose {bool} -- print process messages. (default: {True})
+
+    Returns:
+        [tuple] -- three item tuple containg the model object, vectorizers and
+            training data is present (None otherwise).
+    """
+
+    return joblib_retrieve(mmap_file, verbose, mmap_mode='r')
@@ -0,0 +1,224 @@
+#!/usr/local/bin/python3
+"""Module: DelibAnalysis Staged Pipeline
+
+Runs jobs through three stages connected by bounded queues: read (reader
+threads), work (a pool of processes, or threads) and write (writer threads).
+The stages work on different jobs at the same time, e.g. the next file is
+read while the current one is predicted and the previous one written, so
+disk and CPU time overlap.
+
+The queues are bounded: a slow stage blocks the stages feeding it, which
+caps the number of datasets held in memory at once (backpressure). The
+throughput of each stage is measured, along with the time it was blocked
+by a full queue downstream, which shows the stage limiting the pipeline.
+
+Package: DelibAnalysis
+Version: 2.0
+Authors: Eleonore Fournier-Tombs and Curtis Hendricks
+Source: https://github.com/eleonoreft/DelibAnalysis
+Copyright: Attribution-NonCommercial-ShareAlike CC BY-NC-SA
+https://creativecommons.org/licenses/by-nc-sa/4.0/
+Contact: eleonore.fournier-tombs@mail.mcgill.ca
+
+"""
+
+import queue
+import threading
+import time
+
+# Names of the pipeline stages, in order
+STAGES = ['read', 'work', 'write']
+
+# Marks the end of the jobs in a queue, one per consuming thread
+END = None
+
+
+class StageMetrics:
+    """Throughput counters of a pipeline stage.
+
+    Arguments:
+        name {str} -- name of the stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.jobs = 0
+        self.failed = 0
+        self.rows = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+
+    def add(self, rows, seconds):
+        with self.lock:
+            self.jobs += 1
+            self.rows += rows
+            self.busy += seconds
+
+    def add_failure(self, seconds):
+        with self.lock:
+            self.failed += 1
+            self.busy += seconds
+
+    def add_blocked(self, seconds):
+        with self.lock:
+            self.blocked += seconds
+
+    def report(self, wall):
+        """Returns the counters of the stage.
+
+        Arguments:
+            wall {float} -- run time of the pipeline, in seconds.
+
+        Returns:
+            dict -- jobs, failures, rows, busy and blocked seconds, and rows
+                per second of the stage, over its busy time and over the run
+                time of the pipeline.
+        """
+
+        with self.lock:
+            return {'jobs': self.jobs, 'failed': self.failed,
+                    'rows': self.rows, 'busy': self.busy,
+                    'blocked': self.blocked,
+                    'rows_per_busy_second': self.rows / max(self.busy, 1e-9),
+                    'rows_per_second': self.rows / max(wall, 1e-9)}
+
+
+class StagedPipeline:
+    """Run jobs through read, work and write stages in parallel.
+
+    Each stage is run by its own threads. The work stage is run by worker
+    threads, each one handing its job to the executor when one is given. At
+    most queue_size jobs wait between two stages, so at most
+    readers + queue_size + workers + queue_size + writers jobs are held in
+    memory at once.
+
+    Arguments:
+        read {function} -- called with a job, returns its data.
+        work {function} -- called with a job and its data, returns its
+            result. Must be picklable when run by a process pool.
+        write {function} -- called with a job and its result.
+
+    Keyword Arguments:
+        workers {int} -- jobs in the work stage at the same time.
+            (default: {1})
+        readers {int} -- reader threads. (default: {2})
+        writers {int} -- writer threads. (default: {2})
+        queue_size {int} -- jobs waiting between two stages, the number of
+            workers if None. (default: {None})
+        executor {Executor} -- pool running the work stage, e.g. a
+            ProcessPoolExecutor of workers processes. The worker threads run
+            it if None. (default: {None})
+        count {function} -- returns the number of rows of the data or result
+            of a job. (default: {len})
+    """
+
+    def __init__(self, read, work, write, workers=1, readers=2, writers=2,
+                 queue_size=None, executor=None, count=len):
+        self.read = read
+        self.work = work
+        self.write = write
+        self.workers = max(1, workers)
+        self.readers = max(1, readers)
+        self.writers = max(1, writers)
+        self.queue_size = max(1, queue_size or self.workers)
+        self.executor = executor
+        self.count = count
+        self.metrics = {name: StageMetrics(name) for name in STAGES}
+        self.wall = 0.0
+
+    def run(self, jobs, done):
+        """Run jobs through the pipeline, returning once all are finished.
+
+        A job failing in a stage isn't passed on to the next stages.
+
+        Arguments:
+            jobs {list} -- jobs to run.
+            done {function} -- called with each job, its result and the
+                exception it failed with (None if it succeeded), once it is
+                written or has failed. Calls are made one at a time.
+        """
+
+        start = time.perf_counter()
+        job_queue = queue.Queue()
+        for job in jobs:
+            job_queue.put((job, None))
+        for _ in range(self.readers):
+            job_queue.put(END)
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        done_lock = threading.Lock()
+
+        def finish(job, result, err):
+            with done_lock:
+                done(job, result, err)
+
+        def work(job, data):
+            if self.executor is None:
+                return self.work(job, data)
+            return self.executor.submit(self.work, job, data).result()
+
+        def run_stage(name, inputs, outputs, func):
+            metrics = self.metrics[name]
+            while True:
+                item = inputs.get()
+                if item is END:
+                    return
+                job, data = item
+                begin = time.perf_counter()
+                try:
+                    result = func(job, data)
+                except Exception as err:
+                    metrics.add_failure(time.perf_counter() - begin)
+                    finish(job, None, err)
+                    continue
+                if outputs is None:
+                    metrics.add(self.count(data), time.perf_counter() - begin)
+                    finish(job, data, None)
+                    continue
+                metrics.add(self.count(result), time.perf_counter() - begin)
+                begin = time.perf_counter()
+                outputs.put((job, result))
+                metrics.add_blocked(time.perf_counter() - begin)
+
+        def start_threads(n_threads, *args):
+            threads = [threading.Thread(target=run_stage, args=args,
+                                        daemon=True)
+                       for _ in range(n_threads)]
+            for thread in threads:
+                thread.start()
+            return threads
+
+        readers = start_threads(self.readers, 'read', job_queue, read_queue,
+                                lambda job, _: self.read(job))
+        workers = start_threads(self.workers, 'work', read_queue, write_queue,
+                                work)
+        writers = start_threads(self.writers, 'write', write_queue, None,
+                                self.write)
+        # Each stage ends once the one before it has ended
+        for threads, next_queue, n_next in [(readers, read_queue, workers),
+                                            (workers, write_queue, writers),
+                                            (writers, None, [])]:
+            for thread in threads:
+                thread.join()
+            for _ in n_next:
+                next_queue.put(END)
+        self.wall = time.perf_counter() - start
+
+    def report(self):
+        """Returns the throughput of each stage, as a printable table."""
+
+        lines = ['%-6s %6s %6s %10s %9s %9s %12s' % (
+            'Stage', 'Jobs', 'Failed', 'Rows', 'Busy (s)', 'Blocked',
+            'Rows/busy s')]
+        for name in STAGES:
+            stats = self.metrics[name].report(self.wall)
+            lines.append('%-6s %6d %6d %10d %9.2f %9.2f %12.1f' % (
+                name, stats['jobs'], stats['failed'], stats['rows'],
+                stats['busy'], stats['blocked'],
+                stats['rows_per_busy_second']))
+        lines.append('Pipeline run time: %.2f s, %d readers, %d workers, %d '
+                     'writers, queues of %d.' % (
+                         self.wall, self.readers, self.workers, self.writers,
+                         self.queue_size))
+        return '\n'.join(lines)
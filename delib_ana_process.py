@@ -23,11 +23,45 @@ Contact: eleonore.fournier-tombs@mail.mcgill.ca
 import delib_ana_utils as utils
 import delib_ana_forest as forest
 import delib_ana_modelstore as storage
+import delib_ana_cache as cache
+import delib_ana_features as features
+import delib_ana_pipeline as pipeline
 
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import as_completed
 from sklearn.model_selection import train_test_split
 
+# Name used in place of the indicator for files storing a model bundle
+BUNDLE_NAME = 'bundle'
+
+# Name used in place of the indicator for results labelled by several models
+MULTI_NAME = 'multi'
+
+# Model file loaded by the batch worker processes where they can't be forked,
+# in the output directory
+SHARED_MODEL_FILE = '.shared_model.joblib'
+
+# Record of the files labelled by batch processes, in the output directory
+MANIFEST_FILE = 'manifest.json'
+
+# Model and settings of the current batch process, see init_batch_worker
+BATCH_STATE = {}
+
+# Maximum number of batches read ahead of the one being labelled by
+# jsonl_predict_process
+JSONL_READ_AHEAD = 4
+
 
 def predict_process(input_unlabelled, indic, model_file_type, model_file_name,
+                    dense=False, workers=1, extra_features=None,
+                    output_columns=None, compact=False, row_index=False,
                     verbose=True):
     """Predict the indicator field in a dataset.
 
@@ -43,6 +77,22 @@ def predict_process(input_unlabelled, indic, model_file_type, model_file_name,
         model_file_name {str} -- the name of the file storing the model.
 
     Keyword Arguments:
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        extra_features {list} -- features added to the output in addition
+            to the ones used by the model, see delib_ana_features.
+            (default: {None})
+        output_columns {list} -- columns written with the predicted
+            indicator, None for all of them. Only these columns are read
+            from the input file. (default: {None})
+        compact {bool} -- import the datasets with compact column types, and
+            drop the cleaned text once predicted, see utils.compact_frame.
+            (default: {False})
+        row_index {bool} -- import an uncompressed CSV file in parallel byte
+            ranges with the workers, see utils.import_unlabelled_data.
+            (default: {False})
         verbose {bool} -- print progress results to standard output
             (default: {True})
 
@@ -51,20 +101,383 @@ def predict_process(input_unlabelled, indic, model_file_type, model_file_name,
             indicator field labelled.
     """
 
-    unlabelled_data = utils.import_unlabelled_data(input_unlabelled)
+    model, vecs = load_model(model_file_type, model_file_name, indic)
+    feature_names = features.required_features(vecs, extra_features)
+    if verbose:
+        print(features.describe_plan(feature_names))
+    unlabelled_data = cache.cached_import(utils.import_unlabelled_data,
+                                          input_unlabelled, workers=workers,
+                                          feature_names=feature_names,
+                                          columns=output_columns,
+                                          compact=compact,
+                                          row_index=row_index)
+    utils.frame_hook('import ' + os.path.basename(input_unlabelled),
+                     unlabelled_data)
+    text_feats = cache.stored_text_feats(input_unlabelled, unlabelled_data,
+                                         vecs['vec_combo'])
+
+    labelled = forest.f_class_predict(unlabelled_data, indic,
+                                      vecs['vec_combo'], model, dense,
+                                      features.model_feature_names(vecs),
+                                      text_feats)
+    return labelled_output(labelled, [indic], input_unlabelled,
+                           extra_features, output_columns, compact)
+
+
+def predict_all_process(input_unlabelled, models, model_file_type,
+                        dense=False, workers=1, extra_features=None,
+                        output_columns=None, compact=False, row_index=False,
+                        verbose=True):
+    """Predict the indicators of several stored models in a dataset.
+
+    The dataset is imported once with the features required by all the
+    models, and its text features are computed once per distinct vectorizer.
+
+    Arguments:
+        input_unlabelled {str} -- filename and location of the unlabelled
+            dataset.
+        models {list} -- (indicator, file name) tuple of each model, see
+            load_models.
+        model_file_type {str} -- the method used to store/retrieve the
+            models.
+
+    Keyword Arguments:
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        extra_features {list} -- features added to the output in addition
+            to the ones used by the models. (default: {None})
+        output_columns {list} -- columns written with the predicted
+            indicators, None for all of them. (default: {None})
+        compact {bool} -- import the datasets with compact column types, and
+            drop the cleaned text once predicted, see utils.compact_frame.
+            (default: {False})
+        row_index {bool} -- import an uncompressed CSV file in parallel byte
+            ranges with the workers, see utils.import_unlabelled_data.
+            (default: {False})
+        verbose {bool} -- print progress results to standard output
+            (default: {True})
+
+    Returns:
+        DataFrame -- the dataset with one column per predicted indicator.
+    """
+
+    loaded = [(indic, model, vecs,
+               cache.vectorizer_fingerprint(vecs['vec_combo']))
+              for indic, model, vecs, _ in load_models(model_file_type,
+                                                       models, verbose)]
+    feature_names = features.required_features(
+        [vecs for _, _, vecs, _ in loaded], extra_features)
+    if verbose:
+        print(features.describe_plan(feature_names))
+        print('%d models, %d distinct vectorizers.' % (
+            len(loaded), len(set(fp for _, _, _, fp in loaded))))
+    unlabelled_data = cache.cached_import(utils.import_unlabelled_data,
+                                          input_unlabelled, workers=workers,
+                                          feature_names=feature_names,
+                                          columns=output_columns,
+                                          compact=compact,
+                                          row_index=row_index)
+    utils.frame_hook('import ' + os.path.basename(input_unlabelled),
+                     unlabelled_data)
+
+    labelled = predict_models(unlabelled_data, loaded, dense,
+                              input_unlabelled)
+    return labelled_output(labelled, [m[0] for m in loaded], input_unlabelled,
+                           extra_features, output_columns, compact)
+
+
+def labelled_output(labelled, indicators, file_loc, extra_features=None,
+                    output_columns=None, compact=False):
+    """Select the output columns of a predicted dataset.
+
+    Arguments:
+        labelled {DataFrame} -- predicted dataset.
+        indicators {list} -- names of the predicted indicators.
+        file_loc {str} -- location of the unlabelled dataset, reported to the
+            frame hooks.
+
+    Keyword Arguments:
+        extra_features {list} -- extra features requested. (default: {None})
+        output_columns {list} -- columns written with the predicted
+            indicators, None for all of them. (default: {None})
+        compact {bool} -- drop the cleaned text, unless requested.
+            (default: {False})
+
+    Returns:
+        DataFrame -- the output dataset.
+    """
+
+    if compact:
+        labelled = features.drop_intermediate(labelled, extra_features,
+                                              output_columns)
+    labelled = utils.output_projection(labelled, indicators, output_columns)
+    utils.frame_hook('labelled ' + os.path.basename(file_loc), labelled)
+    return labelled
+
+
+def stream_predict_process(input_unlabelled, indic, model_file_type,
+                           model_file_name, outfile, chunk_size=10000,
+                           dense=False, workers=1, extra_features=None,
+                           output_columns=None, output_compression=None,
+                           compression_level=None, compact=False,
+                           verbose=True):
+    """Predict the indicator field in a dataset, one chunk of rows at a time.
+
+    The unlabelled dataset is read, processed and predicted in chunks of
+    chunk_size rows, and each labelled chunk is appended to the output file
+    as soon as it is ready. Memory use depends on the chunk size rather than
+    on the size of the dataset. The input and output files can be in any of
+    the formats of utils.read_dataset, from their extension, and compressed
+    files are streamed through the compression.
+
+    Arguments:
+        input_unlabelled {str} -- filename and location of the unlabelled
+            dataset.
+        indic {str} -- the indicator that will be predicted by the model.
+        model_file_type {str} -- the method used to store/retrieve the
+            model.
+        model_file_name {str} -- the name of the file storing the model.
+        outfile {str} -- filename of the labelled output dataset.
+
+    Keyword Arguments:
+        chunk_size {int} -- number of rows processed at a time.
+            (default: {10000})
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        extra_features {list} -- features added to the output in addition
+            to the ones used by the model, see delib_ana_features.
+            (default: {None})
+        output_columns {list} -- columns written with the predicted
+            indicator, None for all of them. Only these columns are read
+            from the input file. (default: {None})
+        output_compression {str} -- internal compression of a Parquet or
+            Feather output file, see utils.DatasetWriter. (default: {None})
+        compression_level {int} -- compression level of the output file.
+            (default: {None})
+        compact {bool} -- import the datasets with compact column types, and
+            drop the cleaned text once predicted, see utils.compact_frame.
+            (default: {False})
+        verbose {bool} -- print progress results to standard output
+            (default: {True})
+
+    Returns:
+        int -- number of rows labelled.
+    """
+
+    model, vecs = load_model(model_file_type, model_file_name, indic)
+    # has_question is needed to carry has_question_parent between chunks
+    feature_names = features.required_features(
+        vecs, ['has_question'] + list(extra_features or []))
+    if verbose:
+        print(features.describe_plan(feature_names))
+
+    n_rows = 0
+    prev_question = 0
+    columns = None
+    if output_columns is not None:
+        columns = utils.RAW_COLUMNS + list(output_columns)
+    reader = utils.read_dataset_chunks(input_unlabelled, chunk_size, columns)
+    writer = utils.DatasetWriter(outfile, compression=output_compression,
+                                 level=compression_level)
+    try:
+        for chunk in reader:
+            chunk = utils.prepare_unlabelled_data(chunk, workers,
+                                                  prev_question, feature_names,
+                                                  compact)
+            if len(chunk) > 0:
+                prev_question = chunk["has_question"].iloc[-1]
+            labelled = forest.f_class_predict(
+                chunk, indic, vecs['vec_combo'], model, dense,
+                features.model_feature_names(vecs))
+            writer.write(labelled_output(labelled, [indic], input_unlabelled,
+                                         extra_features, output_columns,
+                                         compact))
+            n_rows += len(chunk)
+            if verbose:
+                print('%d rows labelled ...' % n_rows)
+    finally:
+        writer.close()
+
+    return n_rows
+
+
+def jsonl_predict_process(indic, model_file_type, model_file_name, in_stream,
+                          out_stream, batch_size=64, batch_wait=200,
+                          dense=False, workers=1, extra_features=None,
+                          verbose=True):
+    """Predict the indicator of JSON lines read from a stream.
+
+    Each input line is a JSON object with "speaker" and "speech" fields. The
+    same object is written back to the output stream with the predicted
+    indicator added, one line per input line and in the same order. Lines
+    that can not be labelled are answered with an "error" field instead.
+
+    A reader thread fills a bounded queue, and lines are labelled in batches
+    of up to batch_size lines. A batch is labelled early when no new line
+    arrives for batch_wait milliseconds, so slow producers get their results
+    promptly. The output stream is flushed after each batch. Consecutive
+    batches are treated as one transcript for the "has_question_parent"
+    column, as in stream_predict_process.
+
+    Arguments:
+        indic {str} -- the indicator that will be predicted by the model.
+        model_file_type {str} -- the method used to store/retrieve the
+            model.
+        model_file_name {str} -- the name of the file storing the model.
+        in_stream {file} -- text stream of JSON lines.
+        out_stream {file} -- text stream the results are written to.
+
+    Keyword Arguments:
+        batch_size {int} -- maximum number of lines labelled at a time.
+            (default: {64})
+        batch_wait {float} -- milliseconds without input after which a
+            partial batch is labelled. (default: {200})
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        extra_features {list} -- features computed in addition to the ones
+            used by the model, see delib_ana_features. (default: {None})
+        verbose {bool} -- print progress results to standard output
+            (default: {True})
+
+    Returns:
+        int -- number of lines read.
+    """
+
+    model, vecs = load_model(model_file_type, model_file_name, indic, verbose)
+    feature_names = features.required_features(
+        vecs, ['has_question'] + list(extra_features or []))
+    if verbose:
+        print(features.describe_plan(feature_names))
+
+    lines = queue.Queue(maxsize=batch_size * JSONL_READ_AHEAD)
+
+    def read_lines():
+        # Errors reading the stream are raised again by the main thread
+        try:
+            for line in in_stream:
+                if line.strip():
+                    lines.put(line)
+        except Exception as err:
+            lines.put(err)
+        finally:
+            lines.put(None)
+
+    reader = threading.Thread(target=read_lines, daemon=True)
+    reader.start()
+
+    n_lines = 0
+    prev_question = 0
+    done = False
+    read_error = None
+    while not done:
+        batch = [lines.get()]
+        if isinstance(batch[0], Exception):
+            raise batch[0]
+        if batch[0] is None:
+            break
+        deadline = time.monotonic() + batch_wait / 1000
+        while len(batch) < batch_size:
+            try:
+                line = lines.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if isinstance(line, Exception):
+                # Label the lines read before the error first
+                read_error = line
+                done = True
+                break
+            if line is None:
+                done = True
+                break
+            batch.append(line)
+
+        results, prev_question = label_json_lines(
+            batch, indic, model, vecs, prev_question, dense, workers,
+            feature_names)
+        for result in results:
+            out_stream.write(json.dumps(result) + '\n')
+        out_stream.flush()
+        n_lines += len(batch)
+        if verbose:
+            print('%d lines labelled ...' % n_lines)
+    if read_error is not None:
+        raise read_error
+
+    return n_lines
+
+
+def label_json_lines(batch, indic, model, vecs, prev_question=0, dense=False,
+                     workers=1, feature_names=None):
+    """Label a batch of JSON lines, see jsonl_predict_process.
+
+    Arguments:
+        batch {list} -- JSON lines.
+        indic {str} -- the indicator that will be predicted by the model.
+        model {model object} -- trained classifier.
+        vecs {dict} -- vectorizers of the classifier.
+
+    Keyword Arguments:
+        prev_question {int} -- has_question value of the line preceding the
+            batch. (default: {0})
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        feature_names {list} -- features to compute, they must include
+            "has_question". (default: {all the unlabelled dataset features})
+
+    Returns:
+        [tuple] -- result object of each line and has_question value of the
+            last labelled line.
+    """
+
+    results = []
+    rows = []
+    for line in batch:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            results.append({'error': 'invalid JSON'})
+            continue
+        if not isinstance(record, dict) or \
+                not isinstance(record.get('speech'), str):
+            results.append({'error': 'a "speech" string is required'})
+            continue
+        results.append(record)
+        rows.append(len(results) - 1)
+    if not rows:
+        return results, prev_question
 
-    if model_file_type == 'joblib':
-        model, vecs, _ = storage.joblib_retrieve(model_file_name)
-    if model_file_type == 'pickle':
-        model, vecs, _ = storage.unpickle(model_file_name)
+    records = [results[i] for i in rows]
+    data = forest.pd.DataFrame(
+        {'speaker': [str(rec.get('speaker', '')) for rec in records],
+         'speech': [rec['speech'] for rec in records]})
+    try:
+        data = utils.prepare_unlabelled_data(data, workers, prev_question,
+                                             feature_names)
+        labelled = forest.f_class_predict(data, indic, vecs['vec_combo'],
+                                          model, dense,
+                                          features.model_feature_names(vecs))
+    except Exception as err:
+        for i in rows:
+            results[i] = {'error': repr(err)}
+        return results, prev_question
+    for i, label in zip(rows, labelled[indic].tolist()):
+        results[i][indic] = label
 
-    return forest.f_class_predict(unlabelled_data, indic, vecs['vec_combo'],
-                                  model)
+    return results, data["has_question"].iloc[-1]
 
 
 def generate_process(input_label_data, indic, vocab, tag='', store_name='',
                      store_type='joblib', train_split=0.7, r_state=33,
-                     verbose=True):
+                     dense=False, workers=1, lean=False, compress=0,
+                     compact=False, verbose=True):
     """Create a classifier on an indicator an store it to file.
 
     Arguments:
@@ -84,16 +497,29 @@ def generate_process(input_label_data, indic, vocab, tag='', store_name='',
             (default: {0.7})
         r_state {int} -- number to initialize train/text creation function.
             (default: {33})
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        lean {bool} -- store a lean export of the model.
+            (default: {False})
+        compress {int} -- compression level of joblib model files, 0 to 9.
+            (default: {0})
+        compact {bool} -- import the labelled dataset with compact column
+            types, see utils.compact_frame. (default: {False})
         verbose {bool} -- print descriptive process output to standard output.
             (default: {True})
     """
 
-    labelled_data = utils.import_label_data(input_label_data)
+    labelled_data = cache.cached_import(utils.import_label_data,
+                                        input_label_data, workers=workers,
+                                        compact=compact)
+    utils.frame_hook('import ' + os.path.basename(input_label_data),
+                     labelled_data)
     train, test = train_test_split(labelled_data,
                                    train_size=train_split,
                                    random_state=r_state)
-    vecs = forest.make_vectorizers(train, vocab)
-    indicator_features = forest.get_feats(train, vecs["vec_combo"])
+    vecs, indicator_features = forest.make_training_feats(train, vocab, dense)
 
     forest_classifier = forest.f_class_train(indicator_features, train, indic)
 
@@ -101,12 +527,89 @@ def generate_process(input_label_data, indic, vocab, tag='', store_name='',
         print('Classifier on %s created.' % indic)
 
     store_model(store_type, store_name, forest_classifier, vecs, indic, tag,
-                verbose)
+                verbose, lean, compress)
+
+
+def generate_all_process(input_label_data, indics, vocab, tag='',
+                         store_name='', store_type='joblib', train_split=0.7,
+                         r_state=33, train_jobs=1, dense=False, workers=1,
+                         lean=False, compress=0, compact=False,
+                         verbose=True):
+    """Create a classifier for each of several indicators and store them.
+
+    The labelled dataset is imported, split and vectorized only once. The
+    same features are then used to train one classifier per indicator, and
+    all the classifiers are stored together with the shared vectorizers in a
+    single model bundle.
+
+    Arguments:
+        input_label_data {str} -- filename and location of the labelled
+            dataset.
+        indics {list} -- names of the indicators classifiers will predict.
+        vocab {list} -- vocabulary list related to the indicators.
+
+    Keyword Arguments:
+        tag {str} -- overall title for the dataset (default: {''})
+        store_name {str} -- prefix to be given to the file name.
+            (default: {''})
+        store_type {str} -- method to be used to create/retrieve the the model.
+            (default: {'joblib'})
+        train_split {float} -- the percentage of the labelled dataset to be
+            used for training.
+            (default: {0.7})
+        r_state {int} -- number to initialize train/text creation function.
+            (default: {33})
+        train_jobs {int} -- number of classifiers trained concurrently.
+            (default: {1})
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        lean {bool} -- store a lean export of the model.
+            (default: {False})
+        compress {int} -- compression level of joblib model files, 0 to 9.
+            (default: {0})
+        compact {bool} -- import the labelled dataset with compact column
+            types, see utils.compact_frame. (default: {False})
+        verbose {bool} -- print descriptive process output to standard output.
+            (default: {True})
+
+    Returns:
+        dict -- the trained classifiers, keyed by indicator name.
+    """
+
+    labelled_data = cache.cached_import(utils.import_label_data,
+                                        input_label_data, workers=workers,
+                                        compact=compact)
+    utils.frame_hook('import ' + os.path.basename(input_label_data),
+                     labelled_data)
+    train, test = train_test_split(labelled_data,
+                                   train_size=train_split,
+                                   random_state=r_state)
+    vecs, indicator_features = forest.make_training_feats(train, vocab, dense)
+
+    def train_indicator(indic):
+        classifier = forest.f_class_train(indicator_features, train, indic)
+        if verbose:
+            print('Classifier on %s created.' % indic)
+        return classifier
+
+    with ThreadPoolExecutor(max_workers=max(1, train_jobs)) as executor:
+        classifiers = list(executor.map(train_indicator, indics))
+    models = dict(zip(indics, classifiers))
+
+    store_model(store_type, store_name, models, vecs, BUNDLE_NAME, tag,
+                verbose, lean, compress)
+
+    return models
 
 
 def gen_predict_process(input_label_data, input_unlabelled, indic, vocab, tag,
                         train_split=0.7, r_state=33, store=True,
-                        store_name='', store_type='joblib', verbose=True):
+                        store_name='', store_type='joblib', dense=False,
+                        workers=1, lean=False, compress=0,
+                        extra_features=None, output_columns=None,
+                        compact=False, row_index=False, verbose=True):
     """Create a classifier and predict the indicator in an ulabelled dataset
 
     Arguments:
@@ -126,6 +629,21 @@ def gen_predict_process(input_label_data, input_unlabelled, indic, vocab, tag,
         store_name {str} -- prefix to be given to the file name (default: '')
         store_type {str} -- method to be used to create the storage file
             (default: 'joblib')
+        dense {bool} -- use dense feature arrays instead of sparse matrices
+            (default: False)
+        workers {int} -- number of processes used for POS tagging
+            (default: 1)
+        lean {bool} -- store a lean export of the model (default: False)
+        compress {int} -- compression level of joblib model files, 0 to 9
+            (default: 0)
+        extra_features {list} -- features added to the output in addition
+            to the ones used by the model (default: None)
+        output_columns {list} -- columns written with the predicted
+            indicator, None for all of them (default: None)
+        compact {bool} -- import the datasets with compact column types, and
+            drop the cleaned text once predicted (default: False)
+        row_index {bool} -- import an uncompressed CSV file in parallel byte
+            ranges with the workers (default: False)
         verbose {bool} -- print descriptive process output to standard output.
             (default: True)
 
@@ -133,12 +651,15 @@ def gen_predict_process(input_label_data, input_unlabelled, indic, vocab, tag,
         DataFrame -- dataset with the predicted indicator values
     """
 
-    labelled_data = utils.import_label_data(input_label_data)
+    labelled_data = cache.cached_import(utils.import_label_data,
+                                        input_label_data, workers=workers,
+                                        compact=compact)
+    utils.frame_hook('import ' + os.path.basename(input_label_data),
+                     labelled_data)
     train, test = train_test_split(labelled_data,
                                    train_size=train_split,
                                    random_state=r_state)
-    vecs = forest.make_vectorizers(train, vocab)
-    indicator_features = forest.get_feats(train, vecs["vec_combo"])
+    vecs, indicator_features = forest.make_training_feats(train, vocab, dense)
 
     forest_classifier = forest.f_class_train(indicator_features, train, indic)
 
@@ -147,17 +668,30 @@ def gen_predict_process(input_label_data, input_unlabelled, indic, vocab, tag,
 
     if store:
         store_model(store_type, store_name, forest_classifier, vecs, indic,
-                    tag, verbose)
+                    tag, verbose, lean, compress)
 
-    unlabelled_data = utils.import_unlabelled_data(input_unlabelled)
+    feature_names = features.required_features(vecs, extra_features)
+    unlabelled_data = cache.cached_import(utils.import_unlabelled_data,
+                                          input_unlabelled, workers=workers,
+                                          feature_names=feature_names,
+                                          columns=output_columns,
+                                          compact=compact,
+                                          row_index=row_index)
+    utils.frame_hook('import ' + os.path.basename(input_unlabelled),
+                     unlabelled_data)
 
-    return forest.f_class_predict(unlabelled_data, indic, vecs['vec_combo'],
-                                  forest_classifier)
+    labelled = forest.f_class_predict(unlabelled_data, indic,
+                                      vecs['vec_combo'], forest_classifier,
+                                      dense,
+                                      features.model_feature_names(vecs))
+    return labelled_output(labelled, [indic], input_unlabelled,
+                           extra_features, output_columns, compact)
 
 
 def testing_process(input_label_data, indic, vocab, tag, store_name='',
                     store_type='joblib', train_split=0.7, r_state=33,
-                    store=False):
+                    store=False, dense=False, workers=1, lean=False,
+                    compress=0, compact=False):
     """Special testing process for classifier creation
 
     Create a classifier and print the results of performance tests to standard
@@ -183,6 +717,16 @@ def testing_process(input_label_data, indic, vocab, tag, store_name='',
             (default: '')
         store_type {str} -- method to be used to create the storage file.
             (default: 'joblib')
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: False)
+        workers {int} -- number of processes used for POS tagging.
+            (default: 1)
+        lean {bool} -- store a lean export of the model.
+            (default: False)
+        compress {int} -- compression level of joblib model files, 0 to 9.
+            (default: 0)
+        compact {bool} -- import the labelled dataset with compact column
+            types, see utils.compact_frame. (default: False)
     """
 
     dte_txt = "-" + utils.curr_dte_txt(1)
@@ -191,27 +735,31 @@ def testing_process(input_label_data, indic, vocab, tag, store_name='',
     loc_labelled = tag + "-Labelled-" + indic + dte_txt + tm_txt + ".csv"
     report_out = tag + "-Report-" + indic + dte_txt + tm_txt + ".txt"
 
-    labelled_data = utils.import_label_data(input_label_data)
+    labelled_data = cache.cached_import(utils.import_label_data,
+                                        input_label_data, workers=workers,
+                                        compact=compact)
+    utils.frame_hook('import ' + os.path.basename(input_label_data),
+                     labelled_data)
     train, test = train_test_split(labelled_data, train_size=train_split,
                                    random_state=r_state)
-    vecs = forest.make_vectorizers(train, vocab)
-    indicator_features = forest.get_feats(train, vecs["vec_combo"])
+    vecs, indicator_features = forest.make_training_feats(train, vocab, dense)
 
     forest_classifier = forest.f_class_train(indicator_features, train, indic)
 
     if store:
         store_model(store_type, store_name, forest_classifier, vecs, indic,
-                    tag, True)
+                    tag, True, lean, compress)
 
     top_parameters = forest.get_top_params(forest_classifier,
-                                           vecs['vec_combo'], 1000)
+                                           vecs['vec_combo'], 1000,
+                                           vecs['features'])
 
     top_parameters.to_csv(feat_out)
     print('Parameter priority list file created: %s' % feat_out)
 
     print(top_parameters.head(n=20))
     output = forest.f_class_predict_compare(test, vecs['vec_combo'],
-                                            forest_classifier, indic)
+                                            forest_classifier, indic, dense)
     output.to_csv(loc_labelled)
     print('Labelled comparisons file created: %s' % loc_labelled)
 
@@ -225,11 +773,38 @@ def testing_process(input_label_data, indic, vocab, tag, store_name='',
 
 def dir_predict_process(dir_path, indic, file_name, file_type,
                         output_dir="results/", master=False, tag='',
+                        combined_output=None, dense=False, workers=1,
+                        extra_features=None, models=None,
+                        output_columns=None, output_format=None,
+                        output_compression=None, compression_level=None,
+                        compact=False, staged=False, queue_size=None,
                         verbose=True):
     """Predict the indicator field for number of datasets in a directory.
 
     The filetype for the unlabelled datasets is CSVs with the fields 'Speaker'
-    and speech.
+    and speech, or any format of utils.read_dataset, possibly compressed
+    (e.g. ".csv.gz" or ".csv.zst"). With more than one worker the files are
+    labelled in parallel by a pool of processes, largest files first, all
+    sharing the models loaded once by this process, see batch_executor. A
+    file that fails
+    doesn't stop the others, the failures are reported at the end.
+
+    With staged, the files go through a pipeline instead, see
+    delib_ana_pipeline: reader threads read the next files while the
+    workers preprocess and predict, and writer threads save the results, so
+    reading, computing and writing overlap. Bounded queues between the stages
+    cap the number of datasets in memory, and the throughput of each stage is
+    printed at the end.
+
+    Each file labelled is recorded in a manifest in the output directory,
+    with the hash of its content and the fingerprint of the model used. Files
+    already labelled by the same model, and unchanged since, are skipped so
+    an interrupted or repeated run only processes new or changed files.
+
+    Several models can be applied at once with models, in which case each
+    file is read and preprocessed once, its text features are computed once
+    per distinct vectorizer, and all the indicators are written to a single
+    output file.
 
     Arguments:
         dir_path {str} -- directory where the data files are stored
@@ -246,6 +821,38 @@ def dir_predict_process(dir_path, indic, file_name, file_type,
             (default: {False})
         tag {str} -- overall name of the datasets being processed.
             (default: '')
+        combined_output {str} -- location of a file (.csv, .parquet or
+            .feather, optionally compressed e.g. .csv.gz) to which all the
+            results are written, with a "source_file" column.
+            (default: {None})
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        workers {int} -- number of processes labelling files in parallel.
+            (default: {1})
+        extra_features {list} -- features added to the output in addition
+            to the ones used by the model, see delib_ana_features.
+            (default: {None})
+        models {list} -- (indicator, file name) tuple of each model to
+            apply, used instead of indic and file_name, see load_models.
+            (default: {None})
+        output_columns {list} -- columns written with the predicted
+            indicators, None for all of them. Only these columns are read
+            from the input files. (default: {None})
+        output_format {str} -- format of the result files ('csv', 'parquet'
+            or 'feather'), the format of each input file if None.
+            (default: {None})
+        output_compression {str} -- compression of the result files ('gzip',
+            'bz2', 'xz', 'zstd' or 'none'), the compression of each input
+            file if None, see utils.output_name. (default: {None})
+        compression_level {int} -- compression level of the result files.
+            (default: {None})
+        compact {bool} -- import the datasets with compact column types, and
+            drop the cleaned text once predicted, see utils.compact_frame.
+            (default: {False})
+        staged {bool} -- run the batch as a read, predict and write
+            pipeline. (default: {False})
+        queue_size {int} -- datasets waiting between two pipeline stages, the
+            number of workers if None. (default: {None})
         verbose {bool} -- if true, progress text is shown to default output.
             (default: {False})
 
@@ -254,52 +861,610 @@ def dir_predict_process(dir_path, indic, file_name, file_type,
                      isn't selected
     """
 
-    if master:
-        master_df = forest.pd.DataFrame()
-    if file_type == 'joblib':
-        model, vecs, _ = storage.joblib_retrieve(file_name)
-    if file_type == 'pickle':
-        model, vecs, _ = storage.unpickle(file_name)
-
-    f_it = utils.dir_iter(dir_path)
-    with f_it:
-        pth_begin = dir_path + output_dir
-        if utils.create_directory(pth_begin):
-            for a_file in f_it:
-                if a_file.name.endswith('.csv') and a_file.is_file():
-                    pth = dir_path + a_file.name
-                    if verbose:
-                        print('Processing: %s ...' % pth)
+    if models:
+        indic = MULTI_NAME
+    else:
+        models = [(indic, file_name)]
+    loaded = load_models(file_type, models, verbose)
+    feature_names = features.required_features(
+        [vecs for _, _, vecs, _ in loaded], extra_features)
+    fingerprints = [cache.vectorizer_fingerprint(vecs['vec_combo'])
+                    for _, _, vecs, _ in loaded]
+    if verbose:
+        print(features.describe_plan(feature_names))
+    collect = master or bool(combined_output)
+    master_frames = [] if master else None
+    combined = None
 
-                    unlabelled_data = utils.import_unlabelled_data(pth)
-                    new_data = forest.f_class_predict(unlabelled_data, indic,
-                                                      vecs['vec_combo'], model)
+    pth_begin = dir_path + output_dir
+    if not utils.create_directory(pth_begin):
+        print('ERROR: Error creating output directory. Exiting process.')
+        return None
 
-                    pth_end = indic + '_' + a_file.name
-                    if tag:
-                        result_fname = pth_begin + tag + '-' + pth_end
-                    else:
-                        result_fname = pth_begin + pth_end
-                    new_data.to_csv(result_fname)
+    manifest_file = pth_begin + MANIFEST_FILE
+    manifest = utils.load_manifest(manifest_file)
+    model_print = ';'.join(cache.file_digest(m_file) + ':' + m_indic
+                           for m_indic, _, _, m_file in loaded)
+    if extra_features:
+        # The output columns depend on the extra features
+        model_print += ':' + ','.join(extra_features)
+    if output_columns is not None:
+        model_print += ':columns=' + ','.join(output_columns)
 
-                    if master:
-                        master_df = master_df.append(new_data)
+    jobs = []
+    skipped = 0
+    for a_file in utils.batch_files(dir_path):
+        pth_end = utils.output_name(indic + '_' + a_file.name, output_format,
+                                    output_compression)
+        if tag:
+            result_fname = pth_begin + tag + '-' + pth_end
         else:
-            print('ERROR: Error creating output directory. Exiting process.')
-            return None
-        if verbose:
-            print('Output files are saved in: %s' % (pth_begin))
+            result_fname = pth_begin + pth_end
+        entry = manifest_entry(manifest.get(pth_end), a_file, model_print,
+                               result_fname)
+        if entry['status'] == 'done' and os.path.isfile(result_fname):
+            skipped += 1
+            if collect:
+                jobs.append((None, result_fname, a_file.name))
+            continue
+        manifest[pth_end] = entry
+        jobs.append((dir_path + a_file.name, result_fname, pth_end))
+    if skipped and verbose:
+        print('%d files already labelled, skipped.' % skipped)
+
+    if combined_output:
+        combined = utils.CombinedWriter(combined_output,
+                                        compression=output_compression,
+                                        level=compression_level)
+    # Results of skipped files are read back for the combined output
+    for _, result_fname, f_name in [job for job in jobs if job[0] is None]:
+        collect_result(read_result(result_fname), f_name, master_frames,
+                       combined)
+    jobs = [job for job in jobs if job[0] is not None]
+
+    failed = []
+    workers = utils.resolve_workers(workers)
+    init_batch_worker(dense, collect, feature_names, output_columns,
+                      [(m_indic, model, vecs, fingerprint)
+                       for (m_indic, model, vecs, _), fingerprint
+                       in zip(loaded, fingerprints)],
+                      output_compression, compression_level, extra_features,
+                      compact)
+    if staged:
+        def write_result(job, new_data):
+            utils.write_dataset(new_data, job[1],
+                                compression=output_compression,
+                                level=compression_level)
+
+        def finish_file(job, new_data, err):
+            pth, _, entry_name = job
+            if err is not None:
+                failed.append((pth, err))
+                update_manifest(manifest, entry_name, 'failed', manifest_file)
+                return
+            update_manifest(manifest, entry_name, 'done', manifest_file)
+            if verbose:
+                print('Processed: %s' % pth)
+            if collect:
+                collect_result(new_data, os.path.basename(pth), master_frames,
+                               combined)
+
+        executor = None
+        shared = []
+        if workers > 1:
+            executor, shared = batch_executor(workers, loaded, fingerprints,
+                                              file_type, pth_begin)
+        stages = pipeline.StagedPipeline(
+            lambda job: read_batch_data(job[0], feature_names,
+                                        output_columns, compact),
+            predict_batch_data, write_result, workers=workers,
+            queue_size=queue_size, executor=executor,
+            count=lambda data: len(data[0] if isinstance(data, tuple)
+                                   else data))
+        try:
+            stages.run(jobs, finish_file)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            remove_shared(shared, file_type)
+        print(stages.report())
+    elif workers == 1:
+        for pth, result_fname, entry_name in jobs:
+            if verbose:
+                print('Processing: %s ...' % pth)
+            try:
+                new_data = predict_batch_file(pth, result_fname)
+            except Exception as err:
+                failed.append((pth, err))
+                update_manifest(manifest, entry_name, 'failed', manifest_file)
+                continue
+            update_manifest(manifest, entry_name, 'done', manifest_file)
+            if collect:
+                collect_result(new_data, os.path.basename(pth), master_frames,
+                               combined)
+    else:
+        executor, shared = batch_executor(workers, loaded, fingerprints,
+                                          file_type, pth_begin)
+        try:
+            with executor:
+                futures = {executor.submit(predict_batch_file, pth,
+                                           result_fname): (pth, entry_name)
+                           for pth, result_fname, entry_name in jobs}
+                for future in as_completed(futures):
+                    pth, entry_name = futures[future]
+                    try:
+                        new_data = future.result()
+                    except Exception as err:
+                        failed.append((pth, err))
+                        update_manifest(manifest, entry_name, 'failed',
+                                        manifest_file)
+                        continue
+                    update_manifest(manifest, entry_name, 'done',
+                                    manifest_file)
+                    if verbose:
+                        print('Processed: %s' % pth)
+                    if collect:
+                        collect_result(new_data, os.path.basename(pth),
+                                       master_frames, combined)
+        finally:
+            remove_shared(shared, file_type)
+    if combined:
+        combined.close()
+        print('Combined results saved in: %s' % combined_output)
+
+    if verbose:
+        print('Output files are saved in: %s' % (pth_begin))
+    print('%d of %d files labelled.' % (len(jobs) - len(failed), len(jobs)))
+    for pth, err in failed:
+        print('\tFAILED: %s (%s: %s)' % (pth, type(err).__name__, err))
 
     if master:
-        return master_df
+        if master_frames:
+            return forest.pd.concat(master_frames)
+        return forest.pd.DataFrame()
     else:
         return None
 
 
-def store_model(store_type, store_name, classifier, vecs, indic, tag, verbose):
+def batch_executor(workers, loaded, fingerprints, file_type, pth_begin):
+    """Returns the pool of processes labelling the files of a batch.
+
+    The models and settings must be set up in BATCH_STATE first, with
+    init_batch_worker. Where processes can be forked, the workers inherit
+    them: the trees are loaded once, and their memory is shared by all the
+    workers as long as none writes to it (copy on write). The workers are
+    started right away, before the caller starts any thread.
+
+    Elsewhere each worker loads the models from the files returned by
+    share_models. Only the node arrays of the mmap store are then shared
+    through the page cache, scikit-learn copies the trees of the other stores
+    into the memory of each worker.
+
+    Arguments:
+        workers {int} -- number of worker processes.
+        loaded {list} -- models, see load_models.
+        fingerprints {list} -- vectorizer fingerprint of each model.
+        file_type {str} -- type of storage method used to store the models.
+        pth_begin {str} -- output directory.
+
+    Returns:
+        tuple -- the ProcessPoolExecutor, and the shared model files to pass
+            to remove_shared once it is shut down.
+    """
+
+    for _, model, _, _ in BATCH_STATE['models']:
+        # Parallelism comes from the pool, one core per worker
+        model.n_jobs = 1
+        if isinstance(model, storage.MappedForest):
+            # Rebuild the trees before forking, so the workers share them
+            model.forest()
+    if 'fork' in multiprocessing.get_all_start_methods():
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'))
+        # Forking starts every worker of the pool on the first submission
+        executor.submit(int).result()
+        return executor, []
+    shared = share_models(loaded, fingerprints, file_type, pth_begin)
+    state = dict(BATCH_STATE, models=None)
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=init_shared_worker,
+                                   initargs=(shared, state))
+    return executor, shared
+
+
+def remove_shared(shared, file_type):
+    """Delete the shared model files created by share_models.
+
+    Arguments:
+        shared {list} -- shared models, see share_models.
+        file_type {str} -- type of storage method used to store the models.
+    """
+
+    if file_type != 'mmap':
+        for _, shared_file, _ in shared:
+            os.remove(shared_file)
+
+
+def share_models(loaded, fingerprints, file_type, pth_begin):
+    """Store the models of a batch in files loaded by the worker processes.
+
+    Models stored with mmap are loaded from their file, the others are
+    copied to uncompressed files in the output directory, to be removed once
+    the batch is done.
+
+    Arguments:
+        loaded {list} -- models, see load_models.
+        fingerprints {list} -- vectorizer fingerprint of each model.
+        file_type {str} -- type of storage method used to store the models.
+        pth_begin {str} -- output directory.
+
+    Returns:
+        list -- (indicator, file name, vectorizer fingerprint) tuple of each
+            model, see init_shared_worker.
+    """
+
+    shared = []
+    for i, (m_indic, model, vecs, m_file) in enumerate(loaded):
+        if file_type == 'mmap':
+            shared_file = m_file
+        else:
+            shared_file = '%s%s.%d' % (pth_begin, SHARED_MODEL_FILE, i)
+            storage.joblib_share(model, vecs, shared_file)
+        shared.append((m_indic, shared_file, fingerprints[i]))
+    return shared
+
+
+def read_result(result_fname):
+    """Read back the labelled dataset of a batch file labelled earlier.
+
+    The blank indicator columns are read back from CSV files as missing
+    float values, they are restored as empty strings so the dataset has the
+    same column types as the ones labelled by the current run. The combined
+    output is written with the types of the first dataset written to it.
+
+    Arguments:
+        result_fname {str} -- location of the labelled output file.
+
+    Returns:
+        DataFrame -- labelled dataset.
+    """
+
+    data = utils.read_dataset(result_fname, index=True)
+    for column in dict.fromkeys(utils.INDICATORS):
+        if column in data.columns and data[column].isna().all():
+            data[column] = data[column].astype(object).fillna('').astype(str)
+    return data
+
+
+def collect_result(new_data, f_name, master_frames, combined):
+    """Add the labelled dataset of a batch file to the combined results.
+
+    Arguments:
+        new_data {DataFrame} -- labelled dataset.
+        f_name {str} -- name of the dataset file.
+        master_frames {list} -- labelled datasets to be concatenated once all
+            files are processed, None if not required.
+        combined {CombinedWriter} -- writer of the combined output file, None
+            if not required.
+    """
+
+    if master_frames is not None:
+        master_frames.append(new_data)
+    if combined is not None:
+        combined.write(new_data, f_name)
+
+
+def manifest_entry(entry, a_file, model_print, result_fname):
+    """Returns the up to date manifest entry of a batch file.
+
+    The content hash of the file is only recomputed when its size or
+    modification time differ from the ones recorded. The status is reset to
+    'pending' unless the recorded entry is for the same content, model and
+    output file.
+
+    Arguments:
+        entry {dict} -- recorded manifest entry, None for new files.
+        a_file {DirEntry} -- dataset file.
+        model_print {str} -- fingerprint of the model used.
+        result_fname {str} -- location of the labelled output file.
+
+    Returns:
+        dict -- manifest entry.
+    """
+
+    stats = a_file.stat()
+    if entry and entry['size'] == stats.st_size and \
+            entry['mtime'] == stats.st_mtime:
+        input_hash = entry['input_hash']
+    else:
+        input_hash = cache.file_digest(a_file.path)
+
+    new_entry = {'input_hash': input_hash, 'size': stats.st_size,
+                 'mtime': stats.st_mtime, 'model': model_print,
+                 'output': result_fname, 'status': 'pending'}
+    if entry and entry['status'] == 'done' and \
+            all(entry[k] == new_entry[k]
+                for k in ['input_hash', 'model', 'output']):
+        new_entry['status'] = 'done'
+    return new_entry
+
+
+def update_manifest(manifest, entry_name, status, manifest_file):
+    """Set the status of a manifest entry and save the manifest.
+
+    Arguments:
+        manifest {dict} -- manifest entries keyed by file name.
+        entry_name {str} -- name of the entry to update.
+        status {str} -- new status of the entry ('done' or 'failed').
+        manifest_file {str} -- location of the manifest file.
+    """
+
+    manifest[entry_name]['status'] = status
+    utils.save_manifest(manifest, manifest_file)
+
+
+def init_batch_worker(dense, collect, feature_names, output_columns, models,
+                      compression=None, compression_level=None,
+                      extra_features=None, compact=False):
+    """Set up the labelling of files for dir_predict_process.
+
+    Called in the process running the batch, before any worker process is
+    started, see batch_executor.
+
+    Arguments:
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+        collect {bool} -- return the labelled datasets.
+        feature_names {list} -- features computed for each file.
+        output_columns {list} -- columns read and written with the predicted
+            indicators, None for all of them.
+        models {list} -- (indicator, classifier, vectorizers, vectorizer
+            fingerprint) tuple of each model, see predict_models.
+
+    Keyword Arguments:
+        compression {str} -- compression of the result files, see
+            utils.DatasetWriter. (default: {None})
+        compression_level {int} -- compression level of the result files.
+            (default: {None})
+        extra_features {list} -- extra features requested. (default: {None})
+        compact {bool} -- import the files with compact column types, see
+            utils.compact_frame. (default: {False})
+    """
+
+    BATCH_STATE.update({'models': models, 'dense': dense, 'collect': collect,
+                        'feature_names': feature_names,
+                        'output_columns': output_columns,
+                        'compression': compression,
+                        'compression_level': compression_level,
+                        'extra_features': extra_features,
+                        'compact': compact})
+
+
+def init_shared_worker(shared, state):
+    """Set up a worker process that wasn't forked from the batch process.
+
+    Arguments:
+        shared {list} -- (indicator, file name, vectorizer fingerprint) tuple
+            of each model, see share_models.
+        state {dict} -- BATCH_STATE of the batch process, without the models.
+    """
+
+    models = []
+    for indic, shared_file, fingerprint in shared:
+        model, vecs, _ = storage.joblib_retrieve(
+            shared_file, verbose=False, mmap_mode='r')
+        if isinstance(model, dict):
+            model = model[indic]
+        # Parallelism comes from the pool, one core per worker
+        model.n_jobs = 1
+        models.append((indic, model, vecs, fingerprint))
+    BATCH_STATE.update(state)
+    BATCH_STATE['models'] = models
+
+
+def predict_batch_file(pth, result_fname):
+    """Label one dataset file of a batch and save the result.
+
+    Arguments:
+        pth {str} -- location of the unlabelled dataset.
+        result_fname {str} -- location of the labelled output file.
+
+    Returns:
+        DataFrame -- the labelled dataset if collect is set, None otherwise.
+    """
+
+    output_columns = BATCH_STATE['output_columns']
+    unlabelled_data = cache.cached_import(
+        utils.import_unlabelled_data, pth,
+        feature_names=BATCH_STATE['feature_names'], columns=output_columns,
+        compact=BATCH_STATE['compact'])
+    utils.frame_hook('import ' + os.path.basename(pth), unlabelled_data)
+    new_data = predict_models(unlabelled_data, BATCH_STATE['models'],
+                              BATCH_STATE['dense'], pth)
+    new_data = labelled_output(
+        new_data, [m[0] for m in BATCH_STATE['models']], pth,
+        BATCH_STATE['extra_features'], output_columns, BATCH_STATE['compact'])
+    utils.write_dataset(new_data, result_fname,
+                        compression=BATCH_STATE['compression'],
+                        level=BATCH_STATE['compression_level'])
+    if BATCH_STATE['collect']:
+        return new_data
+    return None
+
+
+def read_batch_data(pth, feature_names, output_columns, compact):
+    """Read one dataset file of a batch, for the staged pipeline.
+
+    The enriched dataset is read from the cache when present, the raw
+    dataset otherwise, see predict_batch_data.
+
+    Arguments:
+        pth {str} -- location of the unlabelled dataset.
+        feature_names {list} -- features computed for each file.
+        output_columns {list} -- columns read and written with the predicted
+            indicators, None for all of them.
+        compact {bool} -- import the files with compact column types.
+
+    Returns:
+        tuple -- the dataset, and True if it is already enriched.
+    """
+
+    unlabelled_data = cache.load_cached(
+        utils.import_unlabelled_data, pth, feature_names=feature_names,
+        columns=output_columns, compact=compact)
+    if unlabelled_data is not None:
+        return unlabelled_data, True
+    if output_columns is not None:
+        output_columns = utils.RAW_COLUMNS + list(output_columns)
+    return utils.read_dataset(pth, output_columns), False
+
+
+def predict_batch_data(job, data):
+    """Label one dataset of a batch read by read_batch_data.
+
+    The dataset is enriched, and stored in the cache, unless read from it.
+    Same result as predict_batch_file, without reading or writing the files.
+
+    Arguments:
+        job {tuple} -- input file, result file and manifest entry name.
+        data {tuple} -- dataset and enriched flag, see read_batch_data.
+
+    Returns:
+        DataFrame -- the labelled dataset.
+    """
+
+    pth = job[0]
+    unlabelled_data, enriched = data
+    output_columns = BATCH_STATE['output_columns']
+    if not enriched:
+        unlabelled_data = utils.prepare_unlabelled_data(
+            unlabelled_data, feature_names=BATCH_STATE['feature_names'],
+            compact=BATCH_STATE['compact'])
+        cache.store_cached(unlabelled_data, utils.import_unlabelled_data, pth,
+                           feature_names=BATCH_STATE['feature_names'],
+                           columns=output_columns,
+                           compact=BATCH_STATE['compact'])
+    utils.frame_hook('import ' + os.path.basename(pth), unlabelled_data)
+    new_data = predict_models(unlabelled_data, BATCH_STATE['models'],
+                              BATCH_STATE['dense'], pth)
+    return labelled_output(
+        new_data, [m[0] for m in BATCH_STATE['models']], pth,
+        BATCH_STATE['extra_features'], output_columns, BATCH_STATE['compact'])
+
+
+def predict_models(data, models, dense=False, file_loc=None):
+    """Predict the indicators of several models in a dataset.
+
+    The text features are computed once for each distinct vectorizer, as
+    identified by its fingerprint, and shared by all the models using it.
+
+    Arguments:
+        data {DataFrame} -- unlabelled dataset, with the features required by
+            all the models.
+        models {list} -- (indicator, classifier, vectorizers, vectorizer
+            fingerprint) tuple of each model.
+
+    Keyword Arguments:
+        dense {bool} -- use dense feature arrays instead of sparse matrices.
+            (default: {False})
+        file_loc {str} -- location of the dataset file, to use the feature
+            store. (default: {None})
+
+    Returns:
+        DataFrame -- the dataset with one column per indicator.
+    """
+
+    labelled = data.drop(columns=['Unnamed: 0'], errors='ignore')
+    text_feats = {}
+    feats = {}
+    for indic, model, vecs, fingerprint in models:
+        combo_vec = vecs['vec_combo']
+        if fingerprint not in text_feats:
+            if file_loc:
+                text_feats[fingerprint] = cache.stored_text_feats(
+                    file_loc, data, combo_vec, fingerprint)
+            else:
+                text_feats[fingerprint] = combo_vec.transform(
+                    data["cleaned_comment"])
+        feature_names = features.model_feature_names(vecs)
+        key = (fingerprint, tuple(feature_names))
+        if key not in feats:
+            feats[key] = forest.get_feats(data, combo_vec, dense,
+                                          feature_names,
+                                          text_feats[fingerprint])
+        labelled[indic] = model.predict(feats[key])
+
+    return labelled
+
+
+def load_models(file_type, entries, verbose=True):
+    """Retrieve several stored classifiers.
+
+    Arguments:
+        file_type {str} -- type of storage method used to store the models.
+        entries {list} -- (indicator, file name) tuple of each model. All the
+            classifiers of a model bundle are retrieved when the indicator is
+            BUNDLE_NAME.
+
+    Keyword Arguments:
+        verbose {bool} -- print process messages. (default: {True})
+
+    Returns:
+        list -- (indicator, classifier, vectorizers, file name) tuple of each
+            classifier.
+    """
+
+    loaded = []
+    for indic, file_name in entries:
+        if indic == BUNDLE_NAME:
+            indic = None
+        model, vecs = load_model(file_type, file_name, indic, verbose)
+        if isinstance(model, dict):
+            loaded.extend((bundle_indic, bundle_model, vecs, file_name)
+                          for bundle_indic, bundle_model in model.items())
+        else:
+            loaded.append((indic, model, vecs, file_name))
+    return loaded
+
+
+def load_model(file_type, file_name, indic, verbose=True):
+    """Retrieve a stored classifier and its vectorizers.
+
+    Model bundles created by generate_all_process store one classifier per
+    indicator, in which case the classifier for indic is returned, or the
+    whole dictionary of classifiers if indic is None.
+
+    Arguments:
+        file_type {str} -- type of storage method used to store the model.
+        file_name {str} -- name of the file that stores the model.
+        indic {str} -- name of the indicator that will be predicted.
+
+    Keyword Arguments:
+        verbose {bool} -- print process messages. (default: {True})
+
+    Returns:
+        [tuple] -- two item tuple containing the classifier and vectorizers.
+    """
+
+    if file_type == 'joblib':
+        model, vecs, _ = storage.joblib_retrieve(file_name, verbose)
+    if file_type == 'pickle':
+        model, vecs, _ = storage.unpickle(file_name, verbose)
+    if file_type == 'mmap':
+        model, vecs, _ = storage.mmap_retrieve(file_name, verbose)
+    if isinstance(model, dict) and indic is not None:
+        model = model[indic]
+    return model, vecs
+
+
+def store_model(store_type, store_name, classifier, vecs, indic, tag, verbose,
+                lean=False, compress=0):
     if store_type == 'joblib':
         storage.joblib_store(classifier, vecs, indic, tag=tag, name=store_name,
-                             verbose=verbose)
+                             verbose=verbose, lean=lean, compress=compress)
     if store_type == 'pickle':
         storage.pickling(classifier, vecs, indic, tag=tag, name=store_name,
-                         verbose=verbose)
+                         verbose=verbose, lean=lean)
+    if store_type == 'mmap':
+        storage.mmap_store(classifier, vecs, indic, tag=tag, name=store_name,
+                           verbose=verbose, lean=lean)
@@ -0,0 +1,394 @@
+#!/usr/local/bin/python3
+"""Module: DelibAnalysis Row Index
+
+Byte offset index of the rows of a CSV dataset, stored in a sidecar file next
+to it (e.g. "speeches.csv.rowidx.npy"). The index is built with one scan of
+the file, aware of the newlines inside quoted speeches, and gives:
+    - random access to any row, e.g. to explain the prediction of a single
+      speech, without parsing the rows before it;
+    - disjoint byte ranges, parsed and enriched in parallel by worker
+      processes and reassembled in file order, see parallel_import.
+
+The index is rebuilt whenever the size or modification time of the file
+change. Compressed files can't be indexed, as their offsets aren't seekable.
+
+Usage:
+    python3 delib_ana_rowindex.py build [dataset.csv]
+    python3 delib_ana_rowindex.py row [dataset.csv] [row number]
+
+Package: DelibAnalysis
+Version: 2.0
+Authors: Eleonore Fournier-Tombs and Curtis Hendricks
+Source: https://github.com/eleonoreft/DelibAnalysis
+Copyright: Attribution-NonCommercial-ShareAlike CC BY-NC-SA
+https://creativecommons.org/licenses/by-nc-sa/4.0/
+Contact: eleonore.fournier-tombs@mail.mcgill.ca
+
+"""
+
+import argparse
+import io
+import os
+import numpy as np
+import pandas as pd
+import delib_ana_utils as utils
+
+from concurrent.futures import ProcessPoolExecutor
+
+# File extension of the sidecar index files
+INDEX_EXTENSION = '.rowidx.npy'
+
+# Version of the index layout, increased whenever it changes
+INDEX_VERSION = 1
+
+# Entries before the row offsets in an index: version, file size and
+# modification time (ns) of the indexed file
+INDEX_HEADER = 3
+
+# Bytes scanned at a time when building an index
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# Byte ranges imported per worker process, so uneven ranges balance out
+PARTS_PER_WORKER = 4
+
+QUOTE = ord('"')
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+
+
+def index_name(file_loc):
+    """Returns the location of the sidecar index of a dataset file."""
+
+    return file_loc + INDEX_EXTENSION
+
+
+def indexable(file_loc):
+    """Returns True if a dataset file can be indexed, i.e. is an
+    uncompressed CSV file."""
+
+    return utils.data_format(file_loc) == 'csv' and \
+        utils.split_compression(file_loc)[1] is None
+
+
+def scan_offsets(file_loc, block_size=BLOCK_SIZE):
+    """Find the byte offsets of the rows of a CSV file.
+
+    A newline ends a row unless it is inside a quoted field, i.e. preceded by
+    an odd number of quotes since the start of the file. This holds for the
+    files written with the standard CSV quoting, where the fields containing
+    quotes are quoted and their quotes doubled. Blank lines, skipped by the
+    CSV reader, are kept with the row before them.
+
+    Arguments:
+        file_loc {str} -- location of the CSV file.
+
+    Keyword Arguments:
+        block_size {int} -- bytes read at a time. (default: {BLOCK_SIZE})
+
+    Returns:
+        nparray -- offset of the first data row, of each following row, and
+            the file size. The header spans the bytes before the first
+            offset.
+    """
+
+    ends = []
+    in_quotes = 0
+    position = 0
+    with open(file_loc, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            values = np.frombuffer(block, dtype=np.uint8)
+            quotes = np.flatnonzero(values == QUOTE)
+            newlines = np.flatnonzero(values == NEWLINE)
+            quotes_before = np.searchsorted(quotes, newlines) + in_quotes
+            ends.append(newlines[quotes_before % 2 == 0] + position + 1)
+            in_quotes = (in_quotes + len(quotes)) % 2
+            position += len(block)
+
+    offsets = np.concatenate(ends) if ends else np.zeros(0, dtype=np.int64)
+    offsets = offsets.astype(np.int64)
+    if len(offsets) == 0 or offsets[-1] != position:
+        offsets = np.append(offsets, position)
+    if len(offsets) == 1:
+        # Header only, or an empty file
+        return np.array([position, position], dtype=np.int64)
+
+    lengths = np.diff(offsets)
+    blank = lengths == 1
+    short = np.flatnonzero(lengths == 2)
+    if len(short):
+        data = np.memmap(file_loc, dtype=np.uint8, mode='r')
+        blank[short] = data[offsets[short]] == CARRIAGE_RETURN
+    # The first offset ends the header, a blank first row joins it
+    return np.delete(offsets, np.flatnonzero(blank))
+
+
+def build_row_index(file_loc, save=True):
+    """Build the row index of a CSV file.
+
+    Arguments:
+        file_loc {str} -- location of the CSV file.
+
+    Keyword Arguments:
+        save {bool} -- write the sidecar index file. Failing to write it
+            only prints a message. (default: {True})
+
+    Returns:
+        nparray -- the index, see row_offsets.
+    """
+
+    if not indexable(file_loc):
+        raise ValueError('only uncompressed CSV files can be indexed: %s'
+                         % file_loc)
+    stats = os.stat(file_loc)
+    index = np.concatenate([
+        np.array([INDEX_VERSION, stats.st_size, stats.st_mtime_ns],
+                 dtype=np.int64),
+        scan_offsets(file_loc)])
+    if save:
+        tmp_name = '%s.%d.tmp' % (index_name(file_loc), os.getpid())
+        try:
+            with open(tmp_name, 'wb') as f:
+                np.save(f, index)
+            os.replace(tmp_name, index_name(file_loc))
+        except OSError as err:
+            print('Row index of "%s" not stored: %s' % (file_loc, err))
+    return index
+
+
+def load_row_index(file_loc, build=True):
+    """Returns the row index of a CSV file, memory mapped.
+
+    Arguments:
+        file_loc {str} -- location of the CSV file.
+
+    Keyword Arguments:
+        build {bool} -- build the index if the sidecar file is missing or
+            out of date. (default: {True})
+
+    Returns:
+        nparray -- the index, None if it is missing or out of date and
+            build is False.
+    """
+
+    stats = os.stat(file_loc)
+    try:
+        index = np.load(index_name(file_loc), mmap_mode='r')
+    except (OSError, ValueError, EOFError):
+        index = None
+    if index is not None and len(index) > INDEX_HEADER and \
+            list(index[:INDEX_HEADER]) == [INDEX_VERSION, stats.st_size,
+                                           stats.st_mtime_ns]:
+        return index
+    if not build:
+        return None
+    return build_row_index(file_loc)
+
+
+def row_offsets(index):
+    """Returns the row offsets of an index.
+
+    Row n of the file spans the bytes offsets[n] to offsets[n + 1].
+
+    Arguments:
+        index {nparray} -- row index.
+
+    Returns:
+        nparray -- offsets, one more than the number of rows.
+    """
+
+    return index[INDEX_HEADER:]
+
+
+def read_bytes(file_loc, begin, end):
+    with open(file_loc, 'rb') as f:
+        f.seek(begin)
+        return f.read(end - begin)
+
+
+def parse_rows(header, content, first_row, columns=None):
+    """Parse consecutive rows of a CSV file.
+
+    Arguments:
+        header {bytes} -- header line of the file.
+        content {bytes} -- the rows.
+        first_row {int} -- row number of the first row.
+
+    Keyword Arguments:
+        columns {list} -- columns to read, all of them if None.
+            (default: {None})
+
+    Returns:
+        DataFrame -- the rows, indexed by row number.
+    """
+
+    usecols = None
+    if columns is not None:
+        usecols = set(columns).__contains__
+    data = pd.read_csv(io.BytesIO(header + content), usecols=usecols)
+    data.index = pd.RangeIndex(first_row, first_row + len(data))
+    return data
+
+
+def read_rows(file_loc, start, stop, columns=None, index=None):
+    """Read a range of rows of a CSV file, without parsing the others.
+
+    Arguments:
+        file_loc {str} -- location of the CSV file.
+        start {int} -- number of the first row, 0 for the first data row.
+        stop {int} -- number of the row after the last one.
+
+    Keyword Arguments:
+        columns {list} -- columns to read, all of them if None.
+            (default: {None})
+        index {nparray} -- row index of the file, loaded if None.
+            (default: {None})
+
+    Returns:
+        DataFrame -- the rows, indexed by row number.
+    """
+
+    if index is None:
+        index = load_row_index(file_loc)
+    offsets = row_offsets(index)
+    n_rows = len(offsets) - 1
+    if not 0 <= start <= stop <= n_rows:
+        raise IndexError('rows %d to %d out of range, %d rows in %s'
+                         % (start, stop, n_rows, file_loc))
+    header = read_bytes(file_loc, 0, offsets[0])
+    return parse_rows(header, read_bytes(file_loc, offsets[start],
+                                         offsets[stop]), start, columns)
+
+
+def read_row(file_loc, row, columns=None):
+    """Read a single row of a CSV file, see read_rows.
+
+    Arguments:
+        file_loc {str} -- location of the CSV file.
+        row {int} -- row number, 0 for the first data row.
+
+    Keyword Arguments:
+        columns {list} -- columns to read. (default: {None})
+
+    Returns:
+        Series -- the row.
+    """
+
+    return read_rows(file_loc, row, row + 1, columns).iloc[0]
+
+
+def count_rows(file_loc):
+    """Returns the number of data rows of a CSV file."""
+
+    return len(row_offsets(load_row_index(file_loc))) - 1
+
+
+def import_part(file_loc, header, begin, end, first_row, context,
+                feature_names, columns):
+    """Parse and enrich a byte range of an unlabelled CSV dataset.
+
+    Used by the worker processes of parallel_import.
+
+    Arguments:
+        file_loc {str} -- location of the CSV file.
+        header {bytes} -- header line of the file.
+        begin {int} -- offset of the first row of the range.
+        end {int} -- offset of the end of the range.
+        first_row {int} -- row number of the first row.
+        context {int} -- number of rows at the start of the range only read
+            for the features depending on the previous row, 0 or 1.
+        feature_names {list} -- features to compute.
+        columns {list} -- columns to read.
+
+    Returns:
+        DataFrame -- the enriched rows, without the context rows.
+    """
+
+    data = parse_rows(header, read_bytes(file_loc, begin, end), first_row,
+                      columns)
+    data = utils.prepare_unlabelled_data(data, feature_names=feature_names)
+    return data.iloc[context:]
+
+
+def parallel_import(file_loc, workers, feature_names=None, columns=None,
+                    compact=False):
+    """Import an unlabelled CSV dataset in parallel byte ranges.
+
+    The rows are split into ranges of about the same size, each one parsed
+    and enriched by a worker process. The row before each range is parsed
+    along with it, so the features depending on the previous row (i.e.
+    "has_question_parent") are the same as for a serial import. The ranges
+    are reassembled in file order.
+
+    Arguments:
+        file_loc {str} -- location of the CSV file.
+        workers {int} -- number of worker processes.
+
+    Keyword Arguments:
+        feature_names {list} -- features to compute, see
+            utils.prepare_unlabelled_data. (default: {None})
+        columns {list} -- columns to read, all of them if None.
+            (default: {None})
+        compact {bool} -- store the columns with compact types, see
+            utils.compact_frame. (default: {False})
+
+    Returns:
+        DataFrame -- the enriched dataset.
+    """
+
+    offsets = row_offsets(load_row_index(file_loc))
+    n_rows = len(offsets) - 1
+    header = read_bytes(file_loc, 0, offsets[0])
+    n_parts = max(1, min(n_rows, workers * PARTS_PER_WORKER))
+    bounds = np.linspace(0, n_rows, n_parts + 1).astype(np.int64)
+    jobs = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        context = 1 if start > 0 else 0
+        jobs.append((file_loc, header, int(offsets[start - context]),
+                     int(offsets[stop]), int(start - context), context,
+                     feature_names, columns))
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=utils.init_pos_worker) as executor:
+        parts = list(executor.map(import_part, *zip(*jobs)))
+    data = pd.concat(parts)
+    data.index = pd.RangeIndex(n_rows)
+    if compact:
+        # Categories differ between ranges, they are set on the whole dataset
+        data = utils.compact_frame(data)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="DelibAnalysis row index of CSV datasets")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser('build', help='''
+                                         Build or refresh the row index of
+                                         CSV files.''')
+    build_parser.add_argument('files', nargs='+', help='CSV dataset files.')
+
+    row_parser = subparsers.add_parser('row', help='''
+                                       Print a row of a CSV file, using its
+                                       row index.''')
+    row_parser.add_argument('file', help='CSV dataset file.')
+    row_parser.add_argument('row', type=int,
+                            help='Row number, 0 for the first data row.')
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        for file_loc in args.files:
+            index = build_row_index(file_loc)
+            print('%s: %d rows, index saved in %s' % (
+                file_loc, len(row_offsets(index)) - 1, index_name(file_loc)))
+    if args.command == 'row':
+        print(read_row(args.file, args.row).to_json(indent=1))
+
+
+if __name__ == '__main__':
+
+    main()
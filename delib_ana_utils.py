@@ -15,11 +15,21 @@ Contact: eleonore.fournier-tombs@mail.mcgill.ca
 
 import pandas as pd
 import numpy as np
+import bz2
+import gzip
+import json
+import lzma
 import re
 import os
+import delib_ana_cache as cache
+import delib_ana_features as features
+import delib_ana_rowindex as rowindex
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime
+from itertools import chain
 from nltk import word_tokenize, pos_tag
+from nltk.tag import PerceptronTagger
 
 # List of indicators that classifier can be trained on
 INDICATORS = [
@@ -28,6 +38,44 @@ INDICATORS = [
     'counterarguments', 'constructive_proposal'
 ]
 
+# POS tagger loaded once per worker process by init_pos_worker
+POS_TAGGER = None
+
+# Number of chunks given to each worker process when POS tagging in parallel
+POS_CHUNKS_PER_WORKER = 4
+
+# Dataset file formats, by file extension. CSV is used for other extensions.
+DATA_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather',
+                '.arrow': 'feather'}
+
+# File extension of the files written in each format
+FORMAT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet',
+                     'feather': '.feather'}
+
+# Compressed streams, by file extension following the format extension
+# (e.g. "speeches.csv.gz")
+COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd'}
+
+# File extension of the files written with each compression
+COMPRESSION_EXTENSIONS = {v: k for k, v in COMPRESSIONS.items()}
+
+# Codecs used inside Parquet and Feather files, which are compressed by
+# column rather than as a stream
+COLUMNAR_CODECS = {'parquet': ['gzip', 'zstd', 'brotli', 'snappy', 'lz4'],
+                   'feather': ['zstd', 'lz4']}
+
+# Columns of the unlabelled datasets the features are computed from
+RAW_COLUMNS = ['speaker', 'speech']
+
+# Types of the raw and label columns in compact datasets, the feature columns
+# declare their own, see compact_frame
+COMPACT_DTYPES = {'speaker': 'category', 'interruption': np.int8,
+                  'disrespect': np.int8}
+
+# Functions called with the name of a stage and the dataset at that stage of
+# the processes, see add_frame_hook
+FRAME_HOOKS = []
+
 # Dictionary of character ranges
 char_dict = {
     'less_than_1000_chars': (1000, 0),
@@ -37,6 +85,168 @@ char_dict = {
     'more_than_4000_chars': (1000000, 4000)
 }
 
+# Phrases marking a respectful speech, see get_respect
+RESPECT_VOCAB = [
+    "thank you", "thank you, mr speaker", "thanks", "thank", "good day",
+    "good morning", "good afternoon", "welcome", "appreciation",
+    "like to recognize", "wish to recognize", "an honour", "my honour",
+    "welcoming", "pay tribute", "applause", "give tribute", "appreciate",
+    "happy to", "i apologize"
+]
+
+# Patterns and tables of the vectorized column functions, built once
+NON_LETTERS = re.compile('[^a-zA-Z]+')
+ASCII_NON_LETTERS = {i: ' ' for i in range(128) if not chr(i).isalpha()}
+FEMALE_PATTERN = re.compile('ms|mrs')
+
+
+class PhraseMatcher:
+    """Find the phrases of several phrase lists in texts with a single scan.
+
+    All the phrases are compiled once into one regular expression shaped as
+    a trie (e.g. "thank(?: you(?:, mr speaker)?|s)?"), so each position of a
+    text is only compared with the phrases sharing its first characters, and
+    the longest phrase starting there is matched. Every shorter phrase that
+    is a prefix of the matched one also starts at that position, so the
+    occurrences of all the phrases are known from one pass over the text.
+    Matching is case insensitive and uses substring semantics, as "in".
+
+    Arguments:
+        phrase_lists {dict} -- list of phrases of each name, e.g. an
+            indicator vocabulary. A single list can also be given.
+    """
+
+    def __init__(self, phrase_lists):
+        if not isinstance(phrase_lists, dict):
+            phrase_lists = {'phrases': phrase_lists}
+        self.names = list(phrase_lists)
+        phrases = {}
+        for name in self.names:
+            for phrase in phrase_lists[name]:
+                phrase = str(phrase).lower()
+                if phrase:
+                    phrases.setdefault(phrase, set()).add(name)
+        self.phrases = phrases
+        # Lists gaining an occurrence when each phrase is the longest match
+        self.prefix_lists = {}
+        for phrase in phrases:
+            counts = dict.fromkeys(self.names, 0)
+            for end in range(1, len(phrase) + 1):
+                for name in phrases.get(phrase[:end], ()):
+                    counts[name] += 1
+            self.prefix_lists[phrase] = counts
+        trie = self.trie_pattern(list(phrases))
+        self.pattern = re.compile(trie)
+        self.scan_pattern = re.compile('(?=(%s))' % trie)
+
+    @staticmethod
+    def trie_pattern(phrases):
+        """Returns a regular expression matching the longest of the phrases.
+
+        Arguments:
+            phrases {list} -- phrases to be matched.
+
+        Returns:
+            str -- regular expression, matching nothing if phrases is empty.
+        """
+
+        if not phrases:
+            return '(?!)'
+        trie = {}
+        for phrase in phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[''] = {}
+
+        def node_pattern(node):
+            branches = [re.escape(char) + node_pattern(child)
+                        for char, child in sorted(node.items()) if char]
+            if not branches:
+                return ''
+            if len(branches) == 1:
+                body = branches[0]
+            else:
+                body = '(?:%s)' % '|'.join(branches)
+            if '' in node:
+                # Greedy optional group, longer phrases are tried first
+                return '(?:%s)?' % body if len(branches) == 1 else body + '?'
+            return body
+
+        return node_pattern(trie)
+
+    def counts(self, text):
+        """Returns the number of phrase occurrences of each list in a text.
+
+        Overlapping occurrences are all counted.
+
+        Arguments:
+            text {str} -- text to examine.
+
+        Returns:
+            dict -- number of occurrences of the phrases of each list.
+        """
+
+        counts = dict.fromkeys(self.names, 0)
+        for match in self.scan_pattern.finditer(str(text).lower()):
+            for name, count in self.prefix_lists[match.group(1)].items():
+                counts[name] += count
+        return counts
+
+    def contains(self, text):
+        """Returns True if a text contains any of the phrases.
+
+        Arguments:
+            text {str} -- text to examine.
+
+        Returns:
+            bool -- True if one of the phrases is found.
+        """
+
+        return self.pattern.search(str(text).lower()) is not None
+
+    def flag_column(self, texts):
+        """Flag the texts containing any of the phrases.
+
+        Arguments:
+            texts {Series} -- texts to examine.
+
+        Returns:
+            Series -- 1 for the texts containing a phrase, 0 otherwise.
+        """
+
+        # The pandas string methods can use a faster regular expression
+        # engine than re, when pyarrow is installed
+        found = texts.astype(str).str.lower().str.contains(
+            self.pattern.pattern, regex=True, na=False)
+        return found.astype(np.int64)
+
+    def count_columns(self, texts):
+        """Count the phrase occurrences of each list, for a column of texts.
+
+        Each text is scanned once, whatever the number of lists.
+
+        Arguments:
+            texts {Series} -- texts to examine.
+
+        Returns:
+            DataFrame -- one count column per phrase list, named after it.
+        """
+
+        counts = np.zeros((len(texts), len(self.names)), dtype=np.int64)
+        columns = {name: i for i, name in enumerate(self.names)}
+        finditer = self.scan_pattern.finditer
+        prefix_lists = self.prefix_lists
+        for row, text in enumerate(texts.astype(str).str.lower().tolist()):
+            for match in finditer(text):
+                for name, count in prefix_lists[match.group(1)].items():
+                    counts[row, columns[name]] += count
+        return pd.DataFrame(counts, index=texts.index, columns=self.names)
+
+
+# Matcher of the respect phrases, see respect_column
+RESPECT_MATCHER = PhraseMatcher({'respect': RESPECT_VOCAB})
+
 
 def comment_to_words(raw_comment):
     """Clean up raw comments and convert to a list of words
@@ -58,22 +268,121 @@ def comment_to_words(raw_comment):
         print(raw_comment)
 
 
-def append_features(input_matrix, input_feature):
-    new_matrix = np.zeros(shape=(input_matrix.shape[0],
-                                 input_matrix.shape[1] + 1))
-    for i in range(0, len(input_feature)):
-        new_matrix[i] = np.append(input_matrix[i], input_feature[i])
-    return new_matrix
+def feature_block(data, features, dtypes=None):
+    """Build a single typed block from quantitative feature columns.
+
+    Every column is copied once, as a whole, into a preallocated 2d array.
+    The block uses the smallest dtype able to hold all the requested columns
+    (e.g. int8 for binary flags only, float32 once counts are included).
+
+    Arguments:
+        data {DataFrame} -- dataset containing the feature columns.
+        features {list} -- names of the columns to include, in order.
+
+    Keyword Arguments:
+        dtypes {dict} -- dtype to use for each feature column, float32 is used
+            for columns not listed. (default: {None})
+
+    Returns:
+        nparray -- 2d numpy array with one column per feature.
+    """
+
+    if dtypes is None:
+        dtypes = {}
+    col_types = [np.dtype(dtypes.get(f, np.float32)) for f in features]
+    block = np.empty(shape=(len(data), len(features)),
+                     dtype=np.result_type(*col_types))
+    for i, f in enumerate(features):
+        block[:, i] = data[f].to_numpy(dtype=col_types[i])
+    return block
 
 
 def add_character_counts(data, chars):
-    data['char_count'] = data['cleaned_comment'].apply(lambda x: len(x))
+    counts = data['cleaned_comment'].str.len().to_numpy(dtype=np.int64)
+    data['char_count'] = counts
     for k, v in chars.items():
-        data[k] = data.char_count.map(lambda x: 1
-                                      if (x <= v[0] and x > v[1]) else 0)
+        data[k] = ((counts <= v[0]) & (counts > v[1])).astype(np.int64)
     return data
 
 
+def clean_column(texts):
+    """Vectorized comment_to_words, for a column of texts.
+
+    ASCII texts, by far the most common, are cleaned with a translation table
+    instead of a regular expression, which gives the same words.
+
+    Arguments:
+        texts {Series} -- raw texts.
+
+    Returns:
+        Series -- lower case words of each text, separated by single spaces.
+    """
+
+    cleaned = [' '.join(t.translate(ASCII_NON_LETTERS).lower().split())
+               if t.isascii() else
+               ' '.join(NON_LETTERS.sub(' ', t).lower().split())
+               for t in texts.astype(str).tolist()]
+    return pd.Series(cleaned, index=texts.index)
+
+
+def binary_column(column):
+    """Vectorized change_to_binary, for a numeric column.
+
+    Arguments:
+        column {Series} -- numeric values.
+
+    Returns:
+        Series -- 0 for the 0 values and 1 for all the others.
+    """
+
+    return (column != 0).astype(np.int64)
+
+
+def question_column(speech):
+    """Vectorized get_question, for a column of texts.
+
+    Arguments:
+        speech {Series} -- phrases or sentences.
+
+    Returns:
+        Series -- 1 for the texts containing a question mark, 0 otherwise.
+    """
+
+    flags = np.fromiter(('?' in t for t in speech.astype(str).tolist()),
+                        dtype=np.int64, count=len(speech))
+    return pd.Series(flags, index=speech.index)
+
+
+def respect_column(speech):
+    """Vectorized get_respect, for a column of texts.
+
+    All the respect phrases are searched at once, see PhraseMatcher.
+
+    Arguments:
+        speech {Series} -- texts to examine.
+
+    Returns:
+        Series -- 1 for the texts containing a respect phrase, 0 otherwise.
+    """
+
+    return RESPECT_MATCHER.flag_column(speech)
+
+
+def gender_column(speaker):
+    """Vectorized get_gender, for a column of speaker names.
+
+    Arguments:
+        speaker {Series} -- texts containing a person's name and title.
+
+    Returns:
+        Series -- 'F' for female and 'M' otherwise.
+    """
+
+    names = speaker.astype(str).str.replace('.', '', regex=False).str.lower()
+    female = names.str.contains(FEMALE_PATTERN, na=False).to_numpy(dtype=bool)
+    return pd.Series(np.where(female, 'F', 'M'), index=speaker.index)
+
+
 def change_to_binary(value):
     """
     Make a numeric field binary. All 0 values are 0 and all other values are 1
@@ -137,17 +446,10 @@ def get_respect(text):
         int -- binary: 1 for respect, 0 for no respect
     """
 
-    respect_vocab = [
-        "thank you", "thank you, mr speaker", "thanks", "thank", "good day",
-        "good morning", "good afternoon", "welcome", "appreciation",
-        "like to recognize", "wish to recognize", "an honour", "my honour",
-        "welcoming", "pay tribute", "applause", "give tribute", "appreciate",
-        "happy to", "i apologize"
-    ]
     respect = 0
     text = str(text)
     text = text.lower()
-    for word in respect_vocab:
+    for word in RESPECT_VOCAB:
         if word in text:
             return 1
     return respect
@@ -156,12 +458,87 @@ def get_respect(text):
 def pos_tokenizer(text):
     text = re.sub("[^a-zA-Z]", " ", text)
     text = text.lower()
-    token_array = pos_tag(word_tokenize(text))
+    if POS_TAGGER is not None:
+        token_array = POS_TAGGER.tag(word_tokenize(text))
+    else:
+        token_array = pos_tag(word_tokenize(text))
     token_pos = [x[1] for x in token_array]
     return ' '.join(token_pos)
 
 
-def add_column_parent(column):
+def init_pos_worker():
+    """Load the POS tagger once in a worker process."""
+
+    global POS_TAGGER
+    POS_TAGGER = PerceptronTagger()
+
+
+def pos_tokenize_chunk(texts):
+    """POS tag a list of texts, used by the worker processes.
+
+    Arguments:
+        texts {list} -- texts to be tagged.
+
+    Returns:
+        list -- POS tags of each text, in the same order.
+    """
+
+    return [pos_tokenizer(text) for text in texts]
+
+
+def resolve_workers(workers):
+    """Returns the number of worker processes to use.
+
+    Arguments:
+        workers {int} -- requested number of workers, negative values count
+            back from the number of CPUs (-1 uses all of them).
+
+    Returns:
+        int -- number of worker processes, at least 1.
+    """
+
+    if workers is None:
+        return 1
+    if workers < 0:
+        workers = (os.cpu_count() or 1) + 1 + workers
+    return max(1, workers)
+
+
+def pos_column(texts, workers=1):
+    """POS tag a column of texts, optionally using several processes.
+
+    The column is split into chunks that are tagged by a pool of worker
+    processes, each loading the tagger only once. Results are returned in the
+    original order.
+
+    Arguments:
+        texts {Series} -- texts to be tagged.
+
+    Keyword Arguments:
+        workers {int} -- number of worker processes, see resolve_workers.
+            (default: {1})
+
+    Returns:
+        Series -- POS tags of each text, with the same index as texts.
+    """
+
+    workers = resolve_workers(workers)
+    if workers == 1 or len(texts) < 2 * workers:
+        return texts.apply(pos_tokenizer)
+
+    values = texts.tolist()
+    n_chunks = workers * POS_CHUNKS_PER_WORKER
+    chunk_size = -(-len(values) // n_chunks)
+    chunks = [values[i:i + chunk_size]
+              for i in range(0, len(values), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_pos_worker) as executor:
+        tagged = list(chain.from_iterable(
+            executor.map(pos_tokenize_chunk, chunks)))
+    return pd.Series(tagged, index=texts.index)
+
+
+def add_column_parent(column, first=0):
     """Add a "parent" column for a given column.
 
     Parent column converts numeric data column to binary format.
@@ -170,13 +547,67 @@ def add_column_parent(column):
         column {Series} -- Pandas Series datatype, a 'column' from a Pandas
             Dataframe
 
+    Keyword Arguments:
+        first {int} -- parent value of the first row, i.e. the binary value
+            of the row preceding the column when processing a dataset in
+            chunks. (default: {0})
+
     Returns:
         Series -- Pandas Series datatype (a DataFrame 'column')
     """
-    new_column = [0]
-    for i in range(0, len(column) - 1):
-        new_column.append(change_to_binary(column[i]))
-    return pd.Series(new_column)
+    new_column = np.empty(len(column), dtype=np.int64)
+    if len(column) > 0:
+        new_column[0] = first
+        new_column[1:] = column.to_numpy()[:-1] != 0
+    return pd.Series(new_column, index=column.index)
+
+
+def text_columns(speech, workers=1, cleaned=None):
+    """Clean and POS tag a column of speeches.
+
+    When the utterance cache is enabled, each distinct utterance is only
+    cleaned and tagged if it isn't already in the cache.
+
+    Arguments:
+        speech {Series} -- speeches to be processed.
+
+    Keyword Arguments:
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        cleaned {Series} -- speeches already cleaned with clean_column, to
+            only tag them. (default: {None})
+
+    Returns:
+        [tuple] -- two Series: the cleaned comments and the POS tags.
+    """
+
+    texts = speech.astype(str)
+    utt_cache = cache.utterance_cache()
+    if utt_cache is None:
+        if cleaned is None:
+            cleaned = clean_column(texts)
+        return cleaned, pos_column(texts, workers)
+
+    keys = texts.map(utt_cache.text_key)
+    key_counts = keys.value_counts().to_dict()
+    found = utt_cache.lookup(list(key_counts), key_counts)
+
+    missing = texts[~keys.isin(found)]
+    missing = missing[~keys[missing.index].duplicated()]
+    if len(missing) > 0:
+        if cleaned is None:
+            missing_cleaned = clean_column(missing)
+        else:
+            missing_cleaned = cleaned[missing.index]
+        new_items = dict(zip(keys[missing.index],
+                             zip(missing_cleaned,
+                                 pos_column(missing, workers))))
+        utt_cache.store(new_items)
+        found.update(new_items)
+
+    cleaned = keys.map(lambda k: found[k][0])
+    pos = keys.map(lambda k: found[k][1])
+    return cleaned, pos
 
 
 def tst_print(descrip, info):
@@ -278,7 +709,75 @@ def curr_tm_txt():
     return now.strftime('%H:%M')
 
 
-def import_label_data(file_loc):
+def compact_frame(data):
+    """Store the columns of a dataset with compact types.
+
+    Binary flags become int8, character counts int32, and the speaker,
+    gender and empty indicator columns categorical, each distinct value being
+    stored once. The values written to CSV files are unchanged.
+
+    Arguments:
+        data {DataFrame} -- enriched dataset.
+
+    Returns:
+        DataFrame -- the dataset with compact columns.
+    """
+
+    dtypes = dict(COMPACT_DTYPES)
+    dtypes.update(features.compact_dtypes())
+    for column, dtype in dtypes.items():
+        if column not in data.columns:
+            continue
+        try:
+            data[column] = data[column].astype(dtype)
+        except (TypeError, ValueError):
+            # e.g. missing values in an input column, kept as read
+            pass
+    return data
+
+
+def add_frame_hook(hook):
+    """Register a function called with the datasets of the processes.
+
+    Hooks are called after each dataset import and prediction, e.g. with
+    memory_report.
+
+    Arguments:
+        hook {function} -- called with the name of the stage and the dataset.
+    """
+
+    FRAME_HOOKS.append(hook)
+
+
+def frame_hook(stage, data):
+    """Call the registered frame hooks.
+
+    Arguments:
+        stage {str} -- name of the stage, e.g. "import speeches.csv".
+        data {DataFrame} -- dataset at that stage.
+    """
+
+    for hook in FRAME_HOOKS:
+        hook(stage, data)
+
+
+def memory_report(stage, data):
+    """Print the memory used by each column of a dataset, largest first.
+
+    Arguments:
+        stage {str} -- name of the stage the dataset is at.
+        data {DataFrame} -- dataset to report on.
+    """
+
+    usage = data.memory_usage(deep=True)
+    print('Memory use, %s: %d rows, %.1f MB' % (stage, len(data),
+                                                usage.sum() / 2 ** 20))
+    for column, size in usage.sort_values(ascending=False).items():
+        dtype = data.index.dtype if column == 'Index' else data[column].dtype
+        print('\t%-28s %-10s %10.1f KB' % (column, dtype, size / 1024))
+
+
+def import_label_data(file_loc, workers=1, compact=False):
     """Import a labelled dataset.
 
     Dataset should contain all the indicator fields already labelled.
@@ -286,54 +785,99 @@ def import_label_data(file_loc):
     Arguments:
         file_loc {str} -- location of dataset file.
 
+    Keyword Arguments:
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        compact {bool} -- store the columns with compact types, see
+            compact_frame. (default: {False})
+
     Returns:
         DataFrame -- dataset converted to Pandas DataFrame object.
     """
 
-    label_data = pd.read_csv(file_loc)
-    label_data["cleaned_comment"] = label_data["speech"].astype(str).apply(
-        comment_to_words)
-    label_data["speech"] = label_data["speech"].apply(lambda x: x.lower())
-    label_data = add_character_counts(label_data, char_dict)
-    label_data["has_question"] = label_data["speech"].apply(get_question)
-    label_data["has_respect"] = label_data["speech"].apply(get_respect)
-    label_data["pos"] = label_data["speech"].apply(pos_tokenizer)
-    label_data["interruption"] = label_data["interruption"].apply(
-        lambda x: change_to_binary(x))
-    label_data["disrespect"] = label_data["disrespect"].apply(
-        lambda x: change_to_binary(x))
-    label_data["has_question_parent"] = add_column_parent(
-        label_data["has_question"])
+    label_data = read_dataset(file_loc)
+    label_data["speech"] = label_data["speech"].str.lower()
+    label_data = features.compute_features(label_data,
+                                           features.LABEL_FEATURES, workers)
+    label_data["interruption"] = binary_column(label_data["interruption"])
+    label_data["disrespect"] = binary_column(label_data["disrespect"])
+    if compact:
+        label_data = compact_frame(label_data)
 
     return label_data
 
 
-def import_unlabelled_data(file_loc):
+def import_unlabelled_data(file_loc, workers=1, feature_names=None,
+                           columns=None, compact=False, row_index=False):
     """ Import an unlabelled dataset.
 
     Dataset shoud be a two columns csv file with columns "speaker" and
-        "speech".
+        "speech". Parquet and Feather files are read as well, see
+        read_dataset.
 
     Arguments:
         file_loc {str} -- Location of input file
 
+    Keyword Arguments:
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        feature_names {list} -- features to compute, see
+            prepare_unlabelled_data. (default: {None})
+        columns {list} -- columns of the file to keep in addition to
+            RAW_COLUMNS, None to keep all of them. (default: {None})
+        compact {bool} -- store the columns with compact types, see
+            compact_frame. (default: {False})
+        row_index {bool} -- with more than one worker, parse and enrich
+            uncompressed CSV files in parallel byte ranges found with their
+            row index, see rowindex.parallel_import. The result is the same.
+            (default: {False})
+
     Returns:
         [DataFrame] -- Unlabelled dataset with addiditonal columns required for
         processing
     """
 
-    data = pd.read_csv(file_loc)
-    data["cleaned_comment"] = data["speech"].astype(
-        str).apply(comment_to_words)
-    data = add_character_counts(data, char_dict)
-    data["has_respect"] = data["speech"].apply(get_respect)
-    data["has_question"] = data["speech"].apply(get_question)
-    data["has_question_parent"] = add_column_parent(data["has_question"])
-    data["gender"] = data["speaker"].apply(get_gender)
-    data["pos"] = data["speech"].apply(pos_tokenizer)
-    for i in INDICATORS:
-        data[i] = ''
+    if columns is not None:
+        columns = RAW_COLUMNS + list(columns)
+    workers = resolve_workers(workers)
+    if row_index and workers > 1 and rowindex.indexable(file_loc):
+        return rowindex.parallel_import(file_loc, workers, feature_names,
+                                        columns, compact)
+    data = read_dataset(file_loc, columns)
+    return prepare_unlabelled_data(data, workers, feature_names=feature_names,
+                                   compact=compact)
+
+
+def prepare_unlabelled_data(data, workers=1, prev_question=0,
+                            feature_names=None, compact=False):
+    """Add the columns required for processing to unlabelled data.
+
+    Arguments:
+        data {DataFrame} -- unlabelled dataset, or a chunk of it, with columns
+            "speaker" and "speech".
+
+    Keyword Arguments:
+        workers {int} -- number of processes used for POS tagging.
+            (default: {1})
+        prev_question {int} -- has_question value of the row preceding the
+            data, when it is a chunk of a larger dataset. (default: {0})
+        feature_names {list} -- features to compute, e.g. the ones returned
+            by features.required_features for a model. All the unlabelled
+            dataset features are computed if None. (default: {None})
+        compact {bool} -- store the columns with compact types, see
+            compact_frame. (default: {False})
 
+    Returns:
+        [DataFrame] -- Unlabelled dataset with addiditonal columns required for
+        processing
+    """
+
+    if feature_names is None:
+        feature_names = features.UNLABELLED_FEATURES
+    data = features.compute_features(data, feature_names, workers,
+                                     prev_question)
+    if compact:
+        data = compact_frame(data)
     return data
 
 
@@ -381,3 +925,470 @@ def create_directory(pth):
 
 def dir_iter(pth):
     return os.scandir(pth)
+
+
+def batch_files(pth):
+    """Returns the dataset files of a directory, largest first.
+
+    Arguments:
+        pth {str} -- directory to scan.
+
+    Returns:
+        list -- DirEntry objects of the dataset files.
+    """
+
+    with dir_iter(pth) as f_it:
+        files = [a_file for a_file in f_it
+                 if split_compression(a_file.name.lower())[0].endswith(
+                     tuple(DATA_FORMATS)) and a_file.is_file()]
+    return sorted(files, key=lambda a_file: a_file.stat().st_size,
+                  reverse=True)
+
+
+def load_manifest(pth):
+    """Load a batch manifest file.
+
+    Arguments:
+        pth {str} -- location of the manifest file.
+
+    Returns:
+        dict -- manifest entries keyed by input file name, empty if the file
+            doesn't exist.
+    """
+
+    if not os.path.isfile(pth):
+        return {}
+    with open(pth) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, pth):
+    """Save a batch manifest file.
+
+    The file is replaced atomically so an interrupted run always leaves a
+    readable manifest behind.
+
+    Arguments:
+        manifest {dict} -- manifest entries keyed by input file name.
+        pth {str} -- location of the manifest file.
+    """
+
+    tmp_pth = pth + '.tmp'
+    with open(tmp_pth, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_pth, pth)
+
+
+def split_compression(file_loc):
+    """Separate the compression extension of a file name.
+
+    Arguments:
+        file_loc {str} -- file name, e.g. "speeches.csv.gz".
+
+    Returns:
+        tuple -- the file name without the compression extension, and the
+            compression ('gzip', 'bz2', 'xz' or 'zstd'), None if the file
+            isn't compressed.
+    """
+
+    root, ext = os.path.splitext(file_loc)
+    compression = COMPRESSIONS.get(ext.lower())
+    if compression is None:
+        return file_loc, None
+    return root, compression
+
+
+def open_stream(file_loc, mode='rb', compression=None, level=None):
+    """Open a file, through a compressed stream if needed.
+
+    Arguments:
+        file_loc {str} -- location of the file.
+
+    Keyword Arguments:
+        mode {str} -- file mode, "t" modes are opened as text with universal
+            newlines disabled, as expected by the csv module.
+            (default: {'rb'})
+        compression {str} -- compression of the file, from its extension if
+            None. 'none' opens the file as is. (default: {None})
+        level {int} -- compression level when writing, the default level of
+            each compression if None. (default: {None})
+
+    Returns:
+        file -- file object.
+    """
+
+    if compression is None:
+        compression = split_compression(file_loc)[1]
+    text = {'newline': ''} if 't' in mode else {}
+    if compression == 'gzip':
+        return gzip.open(file_loc, mode,
+                         compresslevel=9 if level is None else level, **text)
+    if compression == 'bz2':
+        return bz2.open(file_loc, mode,
+                        compresslevel=9 if level is None else level, **text)
+    if compression == 'xz':
+        return lzma.open(file_loc, mode,
+                         preset=level if 'w' in mode else None, **text)
+    if compression == 'zstd':
+        import zstandard
+        cctx = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return zstandard.open(file_loc, mode, cctx=cctx, **text)
+    return open(file_loc, mode, **text)
+
+
+def columnar_source(file_loc):
+    """Returns the source to read a Parquet or Feather file from.
+
+    Compressed files are decompressed in memory, as both formats need
+    random access to the file.
+
+    Arguments:
+        file_loc {str} -- location of the dataset file.
+
+    Returns:
+        str or BufferReader -- the file location, or its decompressed
+            content.
+    """
+
+    if split_compression(file_loc)[1] is None:
+        return file_loc
+    import pyarrow as pa
+    with open_stream(file_loc) as f:
+        return pa.BufferReader(f.read())
+
+
+def data_format(file_loc, fmt=None):
+    """Returns the format of a dataset file.
+
+    The compression extension of the file, if any, is ignored.
+
+    Arguments:
+        file_loc {str} -- location of the dataset file.
+
+    Keyword Arguments:
+        fmt {str} -- format to use whatever the extension ('csv', 'parquet'
+            or 'feather'). (default: {None})
+
+    Returns:
+        str -- format of the file.
+    """
+
+    if fmt:
+        return fmt
+    file_loc = split_compression(file_loc)[0]
+    return DATA_FORMATS.get(os.path.splitext(file_loc)[1].lower(), 'csv')
+
+
+def output_name(file_loc, fmt=None, compression=None):
+    """Returns the name of an output file, with the extensions of a format
+    and a compression.
+
+    CSV files are compressed as a stream and get the extension of the
+    compression (e.g. ".csv.gz"). Parquet and Feather files are compressed
+    internally and keep their own extension, unless the name is left as is.
+
+    Arguments:
+        file_loc {str} -- output file name.
+
+    Keyword Arguments:
+        fmt {str} -- output format, the format extension is unchanged if
+            None. (default: {None})
+        compression {str} -- output compression, 'none' for an uncompressed
+            file. The compression extension is unchanged if None.
+            (default: {None})
+
+    Returns:
+        str -- output file name.
+    """
+
+    root, file_compression = split_compression(file_loc)
+    if fmt:
+        base, ext = os.path.splitext(root)
+        if ext.lower() in DATA_FORMATS:
+            root = base
+        root += FORMAT_EXTENSIONS[fmt]
+    if compression is not None:
+        file_compression = compression
+    if (fmt or compression) and data_format(root) != 'csv':
+        # Parquet and Feather files are compressed internally
+        file_compression = None
+    if file_compression in COMPRESSION_EXTENSIONS:
+        root += COMPRESSION_EXTENSIONS[file_compression]
+    return root
+
+
+def dataset_columns(file_loc, fmt=None):
+    """Returns the column names of a Parquet or Feather file.
+
+    Only the file schema is read.
+
+    Arguments:
+        file_loc {str} -- location of the dataset file.
+
+    Keyword Arguments:
+        fmt {str} -- format of the file. (default: {None})
+
+    Returns:
+        list -- column names.
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    source = columnar_source(file_loc)
+    if data_format(file_loc, fmt) == 'parquet':
+        return pq.read_schema(source).names
+    if isinstance(source, str):
+        source = pa.memory_map(source)
+    with source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def read_dataset(file_loc, columns=None, fmt=None, index=False):
+    """Read a dataset file in CSV, Parquet or Feather format.
+
+    Only the requested columns are parsed, which for Parquet and Feather
+    files means the others are not read at all. Files compressed with gzip,
+    bz2, xz or zstd are decompressed as they are read, see split_compression.
+
+    Arguments:
+        file_loc {str} -- location of the dataset file.
+
+    Keyword Arguments:
+        columns {list} -- columns to read, columns missing from the file are
+            ignored. All the columns are read if None. (default: {None})
+        fmt {str} -- format of the file, from its extension if None.
+            (default: {None})
+        index {bool} -- the first column of a CSV file is the row index, as
+            in the labelled datasets written by DelibAnalysis. The index is
+            always restored from Parquet and Feather files. (default: {False})
+
+    Returns:
+        DataFrame -- the dataset.
+    """
+
+    fmt = data_format(file_loc, fmt)
+    if fmt == 'csv':
+        usecols = None
+        if columns is not None:
+            usecols = set(columns).__contains__
+        return pd.read_csv(file_loc, usecols=usecols,
+                           index_col=0 if index else None,
+                           compression=split_compression(file_loc)[1])
+
+    if columns is not None:
+        wanted = set(columns)
+        columns = [column for column in dataset_columns(file_loc, fmt)
+                   if column in wanted]
+    if fmt == 'parquet':
+        return pd.read_parquet(columnar_source(file_loc), columns=columns)
+    return pd.read_feather(columnar_source(file_loc), columns=columns)
+
+
+def read_dataset_chunks(file_loc, chunk_size, columns=None, fmt=None):
+    """Read a dataset file in chunks of rows, see read_dataset.
+
+    Arguments:
+        file_loc {str} -- location of the dataset file.
+        chunk_size {int} -- number of rows per chunk.
+
+    Keyword Arguments:
+        columns {list} -- columns to read. (default: {None})
+        fmt {str} -- format of the file. (default: {None})
+
+    Returns:
+        iterator -- DataFrame chunks, indexed by row number in the file.
+    """
+
+    fmt = data_format(file_loc, fmt)
+    if fmt == 'csv':
+        usecols = None
+        if columns is not None:
+            usecols = set(columns).__contains__
+        return pd.read_csv(file_loc, usecols=usecols, chunksize=chunk_size,
+                           compression=split_compression(file_loc)[1])
+    return columnar_chunks(file_loc, chunk_size, columns, fmt)
+
+
+def columnar_chunks(file_loc, chunk_size, columns, fmt):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if columns is not None:
+        wanted = set(columns)
+        columns = [column for column in dataset_columns(file_loc, fmt)
+                   if column in wanted]
+    source = columnar_source(file_loc)
+    if fmt == 'parquet':
+        batches = pq.ParquetFile(source).iter_batches(
+            batch_size=chunk_size, columns=columns)
+    else:
+        if isinstance(source, str):
+            source = pa.memory_map(source)
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        batches = table.to_batches(max_chunksize=chunk_size)
+    first = 0
+    for batch in batches:
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(first, first + len(chunk))
+        first += len(chunk)
+        yield chunk
+
+
+def write_dataset(data, file_loc, fmt=None, compression=None, level=None):
+    """Write a dataset file in CSV, Parquet or Feather format.
+
+    Arguments:
+        data {DataFrame} -- dataset to write, with its index.
+        file_loc {str} -- location of the file.
+
+    Keyword Arguments:
+        fmt {str} -- format of the file, from its extension if None.
+            (default: {None})
+        compression {str} -- compression of the file, see DatasetWriter.
+            (default: {None})
+        level {int} -- compression level. (default: {None})
+    """
+
+    writer = DatasetWriter(file_loc, fmt, compression, level)
+    writer.write(data)
+    writer.close()
+
+
+def output_projection(data, indicators, columns=None):
+    """Select the columns of a labelled dataset written to the output.
+
+    Arguments:
+        data {DataFrame} -- labelled dataset.
+        indicators {list} -- names of the predicted indicators.
+
+    Keyword Arguments:
+        columns {list} -- columns written before the indicators, the row
+            index is always written. All the columns are kept if None.
+            (default: {None})
+
+    Returns:
+        DataFrame -- the selected columns.
+    """
+
+    if columns is None:
+        return data
+    keep = [c for c in columns if c in data.columns and c not in indicators]
+    return data[keep + [i for i in indicators if i in data.columns]]
+
+
+class DatasetWriter:
+    """Write a dataset to a file, one chunk of rows at a time.
+
+    The file is written incrementally, in CSV, Parquet or Feather format
+    depending on its extension, so the time and memory needed grow linearly
+    with the number of rows. The row index is kept in every format. All the
+    chunks are written with the columns and types of the first one.
+
+    Files with a compression extension (e.g. ".csv.gz") are written through
+    a compressed stream. Parquet and Feather files without one are
+    compressed internally, by column, with the requested compression.
+
+    Arguments:
+        pth {str} -- location of the file.
+
+    Keyword Arguments:
+        fmt {str} -- format of the file, from its extension if None.
+            (default: {None})
+        compression {str} -- compression used when the file has no
+            compression extension: a codec of COLUMNAR_CODECS for Parquet
+            and Feather files, ignored for CSV files, whose compression is
+            given by output_name. (default: {None})
+        level {int} -- compression level, the default level of the
+            compression if None. (default: {None})
+    """
+
+    def __init__(self, pth, fmt=None, compression=None, level=None):
+        self.pth = pth
+        self.fmt = data_format(pth, fmt)
+        self.stream = split_compression(pth)[1]
+        self.codec = None
+        if self.stream is None and self.fmt != 'csv' and \
+                compression not in (None, 'none'):
+            if compression not in COLUMNAR_CODECS[self.fmt]:
+                raise ValueError('%s compression is not available for %s '
+                                 'files, options: %s' % (
+                                     compression, self.fmt,
+                                     COLUMNAR_CODECS[self.fmt]))
+            self.codec = compression
+        self.level = level
+        self.columns = None
+        self.schema = None
+        self.f_out = None
+        self.writer = None
+
+    def write(self, data):
+        """Append rows to the file.
+
+        Arguments:
+            data {DataFrame} -- rows to write.
+        """
+
+        if self.columns is None:
+            self.columns = list(data.columns)
+        data = data.reindex(columns=self.columns)
+        if self.fmt == 'csv':
+            header = self.f_out is None
+            if header:
+                self.f_out = open_stream(self.pth, 'wt', self.stream,
+                                         self.level)
+            data.to_csv(self.f_out, header=header)
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(data, preserve_index=True)
+        if self.writer is None:
+            self.schema = table.schema
+            if self.stream is not None:
+                self.f_out = open_stream(self.pth, 'wb', self.stream,
+                                         self.level)
+            else:
+                self.f_out = pa.OSFile(self.pth, 'wb')
+            if self.fmt == 'parquet':
+                options = {}
+                if self.codec is not None:
+                    options = {'compression': self.codec,
+                               'compression_level': self.level}
+                self.writer = pq.ParquetWriter(self.f_out, table.schema,
+                                               **options)
+            else:
+                options = None
+                if self.codec is not None:
+                    options = pa.ipc.IpcWriteOptions(compression=pa.Codec(
+                        self.codec, self.level))
+                self.writer = pa.ipc.new_file(self.f_out, table.schema,
+                                              options=options)
+        else:
+            table = table.cast(self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.f_out is not None:
+            self.f_out.close()
+
+
+class CombinedWriter(DatasetWriter):
+    """Write several labelled datasets, one after the other, to one file.
+
+    All datasets are written with the columns of the first one, and a
+    "source_file" column identifies their origin, see DatasetWriter.
+    """
+
+    def write(self, data, source):
+        """Append a labelled dataset to the file.
+
+        Arguments:
+            data {DataFrame} -- labelled dataset.
+            source {str} -- name of the file the dataset comes from.
+        """
+
+        super().write(data.assign(source_file=source))